@@ -0,0 +1,188 @@
+"""
+Measures what the audio preprocessing stage (AUDIO_PREPROCESS) saves on the way to
+Whisper: bytes uploaded and end-to-end transcription latency, with and without it.
+
+Synthetic notes are generated with ffmpeg: bursts of tone ("speech") separated by
+pauses over a faint noise floor, recorded the way phones upload audio files (48 kHz
+stereo, 64 kbit/s Opus by default). Each one goes through `speech_to_text.transcribe`
+against the fake Whisper of fake_upstreams.py, whose upload bandwidth is limited
+(--whisper-bandwidth, bytes/s) so that smaller uploads show up in the latency.
+
+Usage:
+    uv run python -m benchmarks.bench_audio_preprocess --notes 40 --duration 60
+    uv run python -m benchmarks.bench_audio_preprocess --speech 2 --pause 3 --codec libmp3lame --bitrate 128k
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+import httpx
+
+from benchmarks import fake_upstreams
+from benchmarks.bench_load import percentile
+
+
+def make_note(
+    ffmpeg: str,
+    path: str,
+    duration: float,
+    speech: float,
+    pause: float,
+    codec: str,
+    bitrate: str,
+) -> None:
+    """A note alternating `speech` seconds of modulated tone and `pause` seconds of noise."""
+    period = speech + pause
+    voice = (
+        f"if(lt(mod(t,{period}),{speech}),"
+        "0.4*sin(2*PI*(180+40*sin(2*PI*0.7*t))*t)*(0.6+0.4*sin(2*PI*4*t)),0)"
+        "+0.002*(random(0)-0.5)"
+    )
+    subprocess.run(
+        [ffmpeg, "-nostdin", "-v", "error", "-y"]
+        + ["-f", "lavfi", "-i", f"aevalsrc='{voice}|{voice}':s=48000:d={duration}"]
+        + ["-c:a", codec, "-b:a", bitrate, path],
+        check=True,
+    )
+
+
+async def run_pass(
+    notes: list[bytes], filename: str, concurrency: int, tag: str
+) -> list[float]:
+    """Transcribes every note (end-to-end latencies); AUDIO_PREPROCESS as configured."""
+    from src.botgram_py.services import speech_to_text
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def one(i: int, audio: bytes) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await speech_to_text.transcribe(
+                audio, "bench", dedup_key=f"{tag}-{i}", filename=filename
+            )
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i, audio) for i, audio in enumerate(notes)))
+    return latencies
+
+
+async def preprocess_times(notes: list[bytes], filename: str) -> list[float]:
+    """Time spent in the preprocessing stage alone, one note at a time."""
+    from src.botgram_py.services.audio_preprocess import audio_preprocessor
+
+    times = []
+    for audio in notes:
+        start = time.perf_counter()
+        async with audio_preprocessor.prepared(audio, filename, "audio/ogg"):
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def whisper_bytes(base_url: str) -> int:
+    health = httpx.get(f"{base_url}/_health").json()
+    return health["received"]["whisper_bytes"]
+
+
+async def compare(
+    notes: list[bytes], filename: str, concurrency: int, base_url: str
+) -> None:
+    from src.botgram_py import config
+    from src.botgram_py.services.audio_preprocess import audio_preprocessor
+
+    print(f"{'':<14}{'uploaded KiB':>14}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}")
+    for enabled in (False, True):
+        config.AUDIO_PREPROCESS = enabled
+        sent_before = whisper_bytes(base_url)
+        start = time.perf_counter()
+        latencies = await run_pass(notes, filename, concurrency, str(enabled))
+        total = time.perf_counter() - start
+        sent = whisper_bytes(base_url) - sent_before
+        print(
+            f"{'preprocess' if enabled else 'as-is':<14}"
+            f"{sent / 1024:>14.0f}"
+            f"{percentile(latencies, 0.5) * 1000:>10.0f}"
+            f"{percentile(latencies, 0.95) * 1000:>10.0f}"
+            f"{total:>10.2f}"
+        )
+
+    times = await preprocess_times(notes[:5], filename)
+    print(
+        f"Preprocessing alone: p50 {percentile(times, 0.5) * 1000:.0f} ms per note "
+        f"({audio_preprocessor.workers} worker process(es))"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--notes", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=60, help="Seconds per note.")
+    parser.add_argument("--speech", type=float, default=3, help="Seconds per burst.")
+    parser.add_argument("--pause", type=float, default=1.5, help="Seconds per pause.")
+    parser.add_argument("--codec", default="libopus")
+    parser.add_argument("--bitrate", default="64k")
+    fake_upstreams.FakeOptions.add_arguments(parser)
+    parser.set_defaults(whisper_latency=0.2, whisper_bandwidth=256 * 1024)
+    args = parser.parse_args()
+
+    fakes, base_url = fake_upstreams.start_in_background(
+        fake_upstreams.FakeOptions.from_args(args)
+    )
+    try:
+        os.environ.update(
+            {
+                "BOT_TOKEN": "123456:bench",
+                "GROQ_API_KEY": "bench",
+                "WHISPER_API_URL": f"{base_url}/openai/v1/audio/transcriptions",
+                "TRANSCRIPTION_BACKEND": "groq",
+                "TRANSCRIPTION_CACHE_DIR": "",
+            }
+        )
+        os.environ.setdefault("TRANSCRIPTION_MAX_CONCURRENCY", str(args.concurrency))
+        from src.botgram_py.services.audio_preprocess import FFMPEG, audio_preprocessor
+
+        if FFMPEG is None:
+            raise SystemExit("ffmpeg not found in PATH")
+        logging.getLogger().setLevel(logging.WARNING)
+
+        extension = {"libopus": ".ogg", "libmp3lame": ".mp3", "aac": ".m4a"}
+        filename = "audio" + extension.get(args.codec, ".ogg")
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, filename)
+            make_note(
+                FFMPEG,
+                path,
+                args.duration,
+                args.speech,
+                args.pause,
+                args.codec,
+                args.bitrate,
+            )
+            with open(path, "rb") as f:
+                note = f.read()
+        # Same audio, but distinct requests (no single-flight sharing between them)
+        notes = [note] * args.notes
+
+        print(
+            f"{args.notes} notes of {args.duration:.0f}s ({len(note) / 1024:.0f} KiB, "
+            f"{args.codec} {args.bitrate}), {args.speech}s speech / {args.pause}s "
+            f"pause, concurrency {args.concurrency}, upload "
+            f"{args.whisper_bandwidth / 1024:.0f} KiB/s"
+        )
+        asyncio.run(compare(notes, filename, args.concurrency, base_url))
+        audio_preprocessor.shutdown()
+    finally:
+        fakes.terminate()
+        fakes.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+End-to-end load test of the bot against local fakes of Telegram, the LLM provider and
+Whisper (see fake_upstreams.py), which run in a separate process so that the CPU and
+memory figures below belong to the bot alone.
+
+"webhook" mode POSTs updates to `main.app`'s /webhook (in process, through the real
+lifespan, queue and workers); "polling" mode feeds them to the fake getUpdates and runs
+the application built by `main.build_application`, as `run_polling` does. An update
+counts as done once every handler group has run for it.
+
+Reports updates/sec, end-to-end latency percentiles (submit -> handlers done), webhook
+acknowledgement latency, CPU time per update, RSS growth and upstream call counts.
+
+Usage:
+    uv run python -m benchmarks.bench_load --mode webhook --updates 2000 --concurrency 64
+    uv run python -m benchmarks.bench_load --mode polling --mix private=1 --llm-latency 0.2
+    uv run python -m benchmarks.bench_load --stream --llm-error-rate 0.05 --provider google
+
+Bot settings (UPDATE_WORKERS, UPSTREAM_MAX_CONCURRENCY, ...) are read from the
+environment as usual; rate limits default to off so that synthetic users aren't throttled.
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Any
+
+import httpx
+
+from benchmarks import fake_upstreams
+
+KINDS = ("private", "group", "voice", "translate")
+
+
+def rss_mib() -> float:
+    """Current resident set size (peak RSS where /proc isn't available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def configure_environment(
+    args: argparse.Namespace, base_url: str, workdir: str
+) -> None:
+    """Points the bot at the fakes. Must run before the bot's modules are imported."""
+    api_url = {
+        "openai": f"{base_url}/v1/chat/completions",
+        "google": f"{base_url}/v1beta/models",
+    }[args.provider]
+    os.environ.update(
+        {
+            "BOT_TOKEN": "123456:bench",
+            "TELEGRAM_API_URL": base_url,
+            "PROVIDER": args.provider,
+            "API_URL": api_url,
+            "API_TOKEN": "bench",
+            "LLM_MODEL": "bench-model",
+            "LLM_PROVIDERS": "",
+            "GROQ_API_KEY": "bench",
+            "WHISPER_API_URL": f"{base_url}/openai/v1/audio/transcriptions",
+            "TRANSCRIPTION_CACHE_DIR": "",
+            "HOSTING": "development",
+            "WEBHOOK_SECRET": "",
+            "STREAM_RESPONSES": "true" if args.stream else "false",
+            "PERSISTENCE_PATH": os.path.join(workdir, "bot_data.sqlite3"),
+            "LEGACY_PICKLE_PATH": os.path.join(workdir, "missing.pickle"),
+            "TRACE_EXPORT_PATH": os.path.join(workdir, "traces.jsonl"),
+        }
+    )
+    for name in ("RATE_LIMIT_LLM", "RATE_LIMIT_TRANSCRIPTION", "RATE_LIMIT_CHAT"):
+        os.environ.setdefault(name, "1000000/1")
+    os.environ.setdefault("MAX_INFLIGHT_PER_USER", "1000000")
+    # The fake Whisper, unless the local engine is what's being measured
+    os.environ.setdefault("TRANSCRIPTION_BACKEND", "groq")
+    os.environ.setdefault("STREAM_EDIT_INTERVAL", "0.2")
+    os.environ.setdefault("STREAM_EDIT_INTERVAL_GROUP", "0.2")
+
+
+def parse_mix(mix: str) -> tuple[list[str], list[float]]:
+    weights = dict.fromkeys(KINDS, 0.0)
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in weights:
+            raise SystemExit(f"Unknown update kind {kind!r}, expected one of {KINDS}")
+        weights[kind.strip()] = float(weight or 1)
+    return list(weights), list(weights.values())
+
+
+def make_update(update_id: int, kind: str, users: int) -> dict[str, Any]:
+    user_id = 10_000 + update_id % users
+    sender = {"id": user_id, "is_bot": False, "first_name": "Load"}
+    message: dict[str, Any] = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": sender,
+    }
+    if kind == "private":
+        message["text"] = f"Question {update_id}: what is the capital of France?"
+    elif kind == "group":
+        mention = f"@{fake_upstreams.BOT_USERNAME}"
+        message["chat"] = {
+            "id": -100_000 - user_id,
+            "type": "supergroup",
+            "title": "Load",
+        }
+        message["text"] = f"{mention} question {update_id}, capital of France?"
+        message["entities"] = [{"type": "mention", "offset": 0, "length": len(mention)}]
+    elif kind == "voice":
+        message["voice"] = {
+            "file_id": f"voice{update_id}",
+            "file_unique_id": f"voice{update_id}",
+            "duration": 3,
+            "mime_type": "audio/ogg",
+            "file_size": 32 * 1024,
+        }
+    else:
+        message["text"] = f"/translate fr Good morning number {update_id}"
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": 10}]
+    return {"update_id": update_id, "message": message}
+
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LoadRun:
+    """Submits updates with bounded concurrency and records when each one is done."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.kinds, self.weights = parse_mix(args.mix)
+        self.done: dict[int, asyncio.Future[None]] = {}
+        self.latencies: list[float] = []
+        self.ack_latencies: list[float] = []
+        self.rejected = 0
+        self.upstream_before: dict[tuple[str, ...], tuple[int, float]] = {}
+        self._next_id = 1
+
+    async def on_update(self, update: Any, context: Any) -> None:
+        """Last handler group: every other handler has finished with this update."""
+        future = self.done.get(update.update_id)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def run(self, count: int, submit: Any, record: bool) -> float:
+        limit = asyncio.Semaphore(self.args.concurrency)
+        start = time.perf_counter()
+
+        async def one(update: dict[str, Any]) -> None:
+            update_id = update["update_id"]
+            self.done[update_id] = asyncio.get_running_loop().create_future()
+            try:
+                sent = time.perf_counter()
+                await submit(update)
+                await asyncio.wait_for(self.done[update_id], self.args.timeout)
+                if record:
+                    self.latencies.append(time.perf_counter() - sent)
+            finally:
+                del self.done[update_id]
+                limit.release()
+
+        tasks = []
+        for _ in range(count):
+            await limit.acquire()
+            kind = random.choices(self.kinds, self.weights)[0]
+            update = make_update(self._next_id, kind, self.args.users)
+            self._next_id += 1
+            tasks.append(asyncio.create_task(one(update)))
+            if self.args.rate:
+                await asyncio.sleep(random.expovariate(self.args.rate))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        timeouts = sum(isinstance(r, asyncio.TimeoutError) for r in results)
+        if timeouts:
+            print(f"⚠️ {timeouts} updates did not finish within {self.args.timeout}s")
+        return time.perf_counter() - start
+
+
+async def drive_webhook(run: LoadRun, args: argparse.Namespace) -> float:
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    from src.botgram_py import main
+
+    async with main.lifespan(main.app):
+        main.app.state.ptb_bot.add_handler(
+            TypeHandler(Update, run.on_update), group=1000
+        )
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bot"
+        ) as client:
+
+            async def submit(update: dict[str, Any]) -> None:
+                while True:
+                    sent = time.perf_counter()
+                    response = await client.post("/webhook", json=update)
+                    run.ack_latencies.append(time.perf_counter() - sent)
+                    if response.status_code != 503:
+                        response.raise_for_status()
+                        return
+                    # Queue full: Telegram would redeliver it later
+                    run.rejected += 1
+                    await asyncio.sleep(0.1)
+
+            return await measure(run, args, submit)
+
+
+async def drive_polling(run: LoadRun, args: argparse.Namespace, base_url: str) -> float:
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    from src.botgram_py import main, tracing
+
+    application = main.build_application()
+    application.add_handler(TypeHandler(Update, run.on_update), group=1000)
+    in_order = asyncio.Lock()
+    async with httpx.AsyncClient(base_url=base_url) as client:
+
+        async def submit(update: dict[str, Any]) -> None:
+            # One at a time: an update landing after a higher offset was confirmed
+            # would never be delivered
+            async with in_order:
+                (await client.post("/_updates", json=[update])).raise_for_status()
+
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.updater.start_polling(poll_interval=0.0, timeout=1)  # type: ignore[union-attr]
+        await application.start()
+        try:
+            return await measure(run, args, submit)
+        finally:
+            await application.updater.stop()  # type: ignore[union-attr]
+            await application.stop()
+            await application.shutdown()
+            await main.llm_client.aclose()
+            await main.groq_client.aclose()
+            await main.telegram_files_client.aclose()
+            await main.video_client.aclose()
+            tracing.tracer.shutdown()
+
+
+def upstream_calls() -> dict[tuple[str, ...], tuple[int, float]]:
+    from src.botgram_py import metrics
+
+    return {
+        labels: (child.count, child.sum)
+        for labels, child in metrics.UPSTREAM_SECONDS._children.items()
+    }
+
+
+async def measure(run: LoadRun, args: argparse.Namespace, submit: Any) -> float:
+    """Runs the warmup, then the measured updates; prints CPU and memory figures."""
+    if args.warmup:
+        await run.run(args.warmup, submit, record=False)
+    run.ack_latencies.clear()
+    run.rejected = 0
+    run.upstream_before = upstream_calls()
+
+    gc.collect()
+    rss_before = rss_mib()
+    cpu_before = time.process_time()
+    elapsed = await run.run(args.updates, submit, record=True)
+    cpu = time.process_time() - cpu_before
+    gc.collect()
+    rss_after = rss_mib()
+
+    print(
+        f"CPU per update   {cpu / args.updates * 1e3:>10.2f} ms "
+        f"({cpu / elapsed * 100:.0f}% of one core)\n"
+        f"RSS              {rss_before:>10.1f} -> {rss_after:.1f} MiB "
+        f"({(rss_after - rss_before) * 1024 / args.updates:+.2f} KiB per update)"
+    )
+    return elapsed
+
+
+def report(run: LoadRun, args: argparse.Namespace, elapsed: float) -> None:
+    from src.botgram_py import metrics
+
+    print(
+        f"Throughput       {len(run.latencies) / elapsed:>10.1f} updates/s "
+        f"({len(run.latencies)}/{args.updates} done in {elapsed:.1f}s)"
+    )
+    for name, samples in (
+        ("End to end", run.latencies),
+        ("Webhook ack", run.ack_latencies),
+    ):
+        if samples:
+            print(
+                f"{name:<16} p50 {percentile(samples, 0.5) * 1e3:>8.1f} ms   "
+                f"p90 {percentile(samples, 0.9) * 1e3:>8.1f} ms   "
+                f"p99 {percentile(samples, 0.99) * 1e3:>8.1f} ms   "
+                f"max {max(samples) * 1e3:>8.1f} ms"
+            )
+    if run.rejected:
+        print(f"Rejected (503)   {run.rejected:>10}")
+
+    before = run.upstream_before
+    for (upstream, status), (count, total) in sorted(upstream_calls().items()):
+        count -= before.get((upstream, status), (0, 0.0))[0]
+        total -= before.get((upstream, status), (0, 0.0))[1]
+        if count:
+            print(
+                f"Upstream {upstream:<12} {status:<6} {count:>6} calls, "
+                f"mean {total / count * 1e3:.1f} ms"
+            )
+    for (handler,), child in sorted(metrics.HANDLER_ERRORS._children.items()):
+        if child.value:
+            print(f"Handler errors   {handler}: {child.value:.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mode", choices=["webhook", "polling"], default="webhook")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument(
+        "--concurrency", type=int, default=64, help="Max updates in flight at once."
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="Open-loop arrivals per second (0 = closed loop).",
+    )
+    parser.add_argument(
+        "--users", type=int, default=500, help="Distinct synthetic users."
+    )
+    parser.add_argument(
+        "--mix",
+        default="private=4,group=2,voice=2,translate=2",
+        help=f"Weights of the update kinds {KINDS}.",
+    )
+    parser.add_argument("--provider", choices=["openai", "google"], default="openai")
+    parser.add_argument("--stream", action="store_true", help="STREAM_RESPONSES=true")
+    parser.add_argument(
+        "--timeout", type=float, default=120, help="Per-update timeout."
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Keep the bot's INFO logs."
+    )
+    fake_upstreams.FakeOptions.add_arguments(parser)
+    args = parser.parse_args()
+
+    fakes, base_url = fake_upstreams.start_in_background(
+        fake_upstreams.FakeOptions.from_args(args)
+    )
+
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            configure_environment(args, base_url, workdir)
+            from src.botgram_py import main as bot  # noqa: F401 (sets up logging)
+
+            if not args.verbose:
+                logging.getLogger().setLevel(logging.WARNING)
+
+            print(
+                f"{args.mode} mode, {args.updates} updates ({args.mix}), "
+                f"concurrency {args.concurrency}, {args.provider}"
+                f"{' streaming' if args.stream else ''}, LLM {args.llm_latency}s "
+                f"± {args.llm_jitter}s, {args.llm_error_rate:.0%} errors"
+            )
+            run = LoadRun(args)
+            if args.mode == "webhook":
+                elapsed = asyncio.run(drive_webhook(run, args))
+            else:
+                elapsed = asyncio.run(drive_polling(run, args, base_url))
+            report(run, args, elapsed)
+        finally:
+            fakes.terminate()
+            fakes.join()
+
+
+if __name__ == "__main__":
+    main()
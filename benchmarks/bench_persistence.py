@@ -0,0 +1,124 @@
+"""
+Compares the cost of persisting chat histories with PicklePersistence vs SQLitePersistence.
+
+Every chat holds one user's 20-message conversation. After an initial save, a small
+fraction of chats receives a new message and we time how long it takes to persist
+that round (what the Application does every `update_interval` seconds).
+
+Usage:
+    uv run python -m benchmarks.bench_persistence --chats 10000 100000 --dirty 0.01
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+from telegram import Bot
+from telegram.ext import PersistenceInput, PicklePersistence
+
+from src.botgram_py.persistence import SQLitePersistence
+
+STORE = PersistenceInput(bot_data=False, user_data=False, callback_data=False)
+
+
+def make_chat(user_id: int) -> dict[str, Any]:
+    conversation = [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"message {i} " + "lorem ipsum dolor sit amet " * 8,
+        }
+        for i in range(20)
+    ]
+    return {
+        f"conversation_{user_id}": conversation,
+        f"last_active_{user_id}": datetime.now(timezone.utc),
+    }
+
+
+def touch(chat: dict[str, Any], chat_id: int) -> None:
+    history = chat[f"conversation_{chat_id}"]
+    history.append({"role": "user", "content": "a new message"})
+    del history[0]
+
+
+async def bench_pickle(
+    chats: dict[int, dict[str, Any]], dirty: list[int], path: str
+) -> float:
+    persistence = PicklePersistence(path, store_data=STORE, on_flush=True)
+    persistence.set_bot(Bot("123456:bench"))
+    for chat_id, data in chats.items():
+        await persistence.update_chat_data(chat_id, data)
+    await persistence.flush()
+
+    for chat_id in dirty:
+        touch(chats[chat_id], chat_id)
+
+    start = time.perf_counter()
+    for chat_id in dirty:
+        await persistence.update_chat_data(chat_id, chats[chat_id])
+    await persistence.flush()
+    return time.perf_counter() - start
+
+
+async def bench_sqlite(
+    chats: dict[int, dict[str, Any]], dirty: list[int], path: str
+) -> float:
+    persistence = SQLitePersistence(path, store_data=STORE)
+    await persistence.get_chat_data()
+    await asyncio.gather(
+        *(
+            persistence.update_chat_data(chat_id, data)
+            for chat_id, data in chats.items()
+        )
+    )
+
+    for chat_id in dirty:
+        touch(chats[chat_id], chat_id)
+
+    # Same call pattern as Application.update_persistence: every touched chat is offered
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(persistence.update_chat_data(chat_id, chats[chat_id]) for chat_id in dirty)
+    )
+    elapsed = time.perf_counter() - start
+
+    await persistence.flush()
+    return elapsed
+
+
+async def run(sizes: list[int], dirty_ratio: float) -> None:
+    print(
+        f"{'chats':>8} {'dirty':>7} {'pickle (s)':>11} {'sqlite (s)':>11} {'speedup':>8}"
+    )
+    for size in sizes:
+        dirty = random.sample(range(size), max(1, int(size * dirty_ratio)))
+        with tempfile.TemporaryDirectory() as tmp:
+            pickle_time = await bench_pickle(
+                {i: make_chat(i) for i in range(size)},
+                dirty,
+                os.path.join(tmp, "bot.pickle"),
+            )
+            sqlite_time = await bench_sqlite(
+                {i: make_chat(i) for i in range(size)},
+                dirty,
+                os.path.join(tmp, "bot.sqlite3"),
+            )
+        print(
+            f"{size:>8} {len(dirty):>7} {pickle_time:>11.3f} {sqlite_time:>11.3f}"
+            f" {pickle_time / sqlite_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chats", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument(
+        "--dirty", type=float, default=0.01, help="Fraction of chats updated"
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args.chats, args.dirty))
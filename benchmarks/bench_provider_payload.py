@@ -0,0 +1,182 @@
+"""
+Measures the per-request cost of building an LLM request body for a 20-turn history.
+
+"legacy" rebuilds the configs of all five providers, copies the history to inject the
+system prompt and serializes with the stdlib `json` (what httpx's `json=` does);
+"adapter" uses the precompiled ProviderAdapter of the configured provider.
+Reports CPU time and peak memory allocated while building one body (tracemalloc).
+
+Usage:
+    uv run python -m benchmarks.bench_provider_payload --provider groq --iterations 20000
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Any
+
+from src.botgram_py.services import providers
+
+SYSTEM_MESSAGE = "You are a helpful assistant."
+
+
+def make_history(turns: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"message {i} " + "lorem ipsum dolor sit amet " * 12,
+        }
+        for i in range(turns)
+    ]
+
+
+def legacy_body(
+    provider: str,
+    messages: list[dict[str, Any]],
+    token: str,
+    model: str,
+    max_tokens: int,
+) -> bytes:
+    """The previous _format_messages + _get_provider_config + httpx json= path."""
+    final_messages = list(messages)
+    if provider == "google":
+        last_msg = final_messages[-1].copy()
+        last_msg["content"] = (
+            f"System Instructions: {SYSTEM_MESSAGE}\n\nUser Query: {last_msg['content']}"
+        )
+        final_messages[-1] = last_msg
+    else:
+        final_messages.insert(0, {"role": "system", "content": SYSTEM_MESSAGE})
+
+    configs: dict[str, dict[str, Any]] = {
+        "openai": {
+            "headers": {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            },
+            "data": {
+                "model": model,
+                "messages": final_messages,
+                "max_tokens": max_tokens,
+            },
+        },
+        "google": {
+            "headers": {"Content-Type": "application/json"},
+            "data": {
+                "contents": [
+                    {
+                        "role": "user" if m["role"] in ["system", "user"] else "model",
+                        "parts": [{"text": m["content"]}],
+                    }
+                    for m in final_messages
+                ],
+                "generationConfig": {
+                    "maxOutputTokens": max_tokens,
+                    "temperature": 0.9,
+                    "topP": 1,
+                },
+            },
+        },
+        "deepseek": {
+            "headers": {
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+                "Authorization": f"Bearer {token}",
+            },
+            "data": {
+                "messages": final_messages,
+                "model": model,
+                "max_tokens": max_tokens,
+                "temperature": 0.7,
+                "stream": False,
+            },
+        },
+        "groq": {
+            "headers": {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {token}",
+            },
+            "data": {
+                "model": model,
+                "messages": final_messages,
+                "temperature": 0.5,
+                "stream": False,
+                "max_completion_tokens": max_tokens,
+                "reasoning_effort": "medium",
+            },
+        },
+        "nvidia": {
+            "headers": {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            },
+            "data": {
+                "model": model,
+                "messages": final_messages,
+                "max_tokens": max_tokens,
+                "temperature": 0.7,
+                "stream": False,
+            },
+        },
+    }
+    data = configs[provider]["data"]
+    return json.dumps(
+        data, ensure_ascii=False, separators=(",", ":"), allow_nan=False
+    ).encode()
+
+
+def measure(build: Any, iterations: int) -> tuple[float, float]:
+    """Returns (CPU microseconds per request, peak KiB allocated by one request)."""
+    for _ in range(100):
+        build()
+
+    start = time.process_time()
+    for _ in range(iterations):
+        build()
+    cpu_us = (time.process_time() - start) / iterations * 1e6
+
+    tracemalloc.start()
+    sample = max(1, iterations // 20)
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    for _ in range(sample):
+        build()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    # Bodies are discarded right away, so the peak is what one request allocates
+    return cpu_us, peak / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--provider",
+        nargs="+",
+        default=["openai", "groq", "google"],
+        choices=["openai", "google", "deepseek", "groq", "nvidia"],
+    )
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    history = make_history(args.turns)
+    print(
+        f"{args.turns}-turn history, orjson {'on' if providers.orjson else 'off'}\n"
+        f"{'provider':<10} {'path':<8} {'µs/request':>12} {'peak KiB':>12}"
+    )
+    for provider in args.provider:
+        adapter = providers.get_adapter(
+            provider, "https://llm.invalid", "token", "model"
+        )
+        paths = {
+            "legacy": lambda: legacy_body(provider, history, "token", "model", 1024),
+            "adapter": lambda: adapter.build_body(history, SYSTEM_MESSAGE, 1024),
+        }
+        for name, build in paths.items():
+            cpu_us, kib = measure(build, args.iterations)
+            print(f"{provider:<10} {name:<8} {cpu_us:>12.1f} {kib:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Measures the video transcoding stage (VIDEO_TRANSCODE): encode time against output
+size for each x264 preset, at the bitrate the size limit allows for the clip.
+
+A synthetic clip is generated with ffmpeg: a moving test pattern under film-like
+grain (hard to compress, as camera footage is) with a tone for audio, encoded at a
+high bitrate the way phone videos come in. Each preset then re-encodes it with
+`video_transcode._transcode_file`, the function the worker processes run. The
+limit is scaled down with --limit-mb so that short clips exercise the same
+bitrates as long videos against Telegram's 50MB: a 60s clip under 5MB is
+encoded like a 10 min video under 50MB.
+
+Usage:
+    uv run python -m benchmarks.bench_video_transcode --duration 60 --limit-mb 5
+    uv run python -m benchmarks.bench_video_transcode --size 1280x720 --presets ultrafast,veryfast,medium
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+
+def make_clip(
+    ffmpeg: str, path: str, duration: float, size: str, fps: int, bitrate: str
+) -> None:
+    """A `duration` seconds clip of moving test pattern with grain, plus a tone."""
+    subprocess.run(
+        [ffmpeg, "-nostdin", "-v", "error", "-y"]
+        + ["-f", "lavfi", "-i", f"testsrc2=s={size}:r={fps}:d={duration}"]
+        + ["-f", "lavfi", "-i", f"sine=f=440:d={duration}"]
+        + ["-vf", "noise=alls=12:allf=t", "-c:v", "libx264", "-preset", "ultrafast"]
+        + ["-b:v", bitrate, "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k"]
+        + ["-shortest", path],
+        check=True,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--duration", type=float, default=60, help="Clip seconds.")
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--bitrate", default="12M", help="Bitrate of the clip.")
+    parser.add_argument("--limit-mb", type=float, default=5)
+    parser.add_argument("--presets", default="ultrafast,superfast,veryfast,faster")
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    from src.botgram_py import config
+    from src.botgram_py.services.video_transcode import FFMPEG, _transcode_file
+
+    if FFMPEG is None:
+        raise SystemExit("ffmpeg not found in PATH")
+    logging.getLogger().setLevel(logging.WARNING)
+    limit = int(args.limit_mb * 1024 * 1024)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        src = os.path.join(workdir, "clip.mp4")
+        make_clip(FFMPEG, src, args.duration, args.size, args.fps, args.bitrate)
+        src_size = os.path.getsize(src)
+        print(
+            f"{args.duration:.0f}s {args.size} clip of {src_size / 1024 / 1024:.1f} MB "
+            f"-> limit {args.limit_mb:g} MB, audio {config.VIDEO_TRANSCODE_AUDIO_KBPS}"
+            f" kbit/s, {os.cpu_count()} CPU(s)"
+        )
+        print(
+            f"{'preset':<12}{'time s':>9}{'x realtime':>12}{'size MB':>10}{'fits':>6}"
+        )
+        for preset in args.presets.split(","):
+            dst = os.path.join(workdir, f"{preset}.mp4")
+            start = time.perf_counter()
+            size = _transcode_file(
+                FFMPEG,
+                src,
+                dst,
+                os.path.join(workdir, "progress"),
+                limit,
+                preset,
+                config.VIDEO_TRANSCODE_AUDIO_KBPS,
+                config.VIDEO_TRANSCODE_MIN_VIDEO_KBPS,
+                args.threads,
+            )
+            elapsed = time.perf_counter() - start
+            print(
+                f"{preset:<12}{elapsed:>9.1f}{args.duration / elapsed:>12.2f}"
+                f"{size / 1024 / 1024:>10.2f}{'yes' if size <= limit else 'no':>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Local stand-ins for the services the bot talks to, all served from one port:
+
+    /bot<token>/<method>                      Telegram Bot API (+ getUpdates long polling)
+    /file/bot<token>/<path>                   Telegram file downloads (voice notes)
+    /v1/chat/completions                      OpenAI-compatible LLM (JSON or SSE stream)
+    /v1beta/models/<model>:generateContent    Google LLM (and :streamGenerateContent)
+    /openai/v1/audio/transcriptions           Groq Whisper
+    /_updates                                 POST a list of updates for getUpdates
+
+LLM and Whisper latency, jitter and error rates are configurable, so the bot can be
+load tested offline (see bench_load.py). To point a real bot process at them:
+
+    uv run python -m benchmarks.fake_upstreams --port 8900 --llm-latency 0.8
+    TELEGRAM_API_URL=http://127.0.0.1:8900 PROVIDER=openai \\
+        API_URL=http://127.0.0.1:8900/v1/chat/completions \\
+        WHISPER_API_URL=http://127.0.0.1:8900/openai/v1/audio/transcriptions ...
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import random
+import socket
+import time
+from collections.abc import AsyncIterator
+from multiprocessing.process import BaseProcess
+from typing import Any
+from urllib.parse import parse_qsl
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+BOT_USERNAME = "bench_bot"
+
+REPLY_TEXT = (
+    "Paris is the capital of France. It sits on the Seine, has about two million "
+    "inhabitants and is known for the Eiffel Tower, the Louvre and its cafés. "
+) * 3
+
+
+class FakeOptions:
+    def __init__(
+        self,
+        llm_latency: float = 0.5,
+        llm_jitter: float = 0.2,
+        llm_error_rate: float = 0.0,
+        llm_error_status: int = 503,
+        stream_chunks: int = 20,
+        stream_interval: float = 0.02,
+        whisper_latency: float = 0.3,
+        whisper_error_rate: float = 0.0,
+        whisper_bandwidth: float = 0.0,
+        telegram_latency: float = 0.005,
+        voice_bytes: int = 32 * 1024,
+    ) -> None:
+        self.llm_latency = llm_latency
+        self.llm_jitter = llm_jitter
+        self.llm_error_rate = llm_error_rate
+        self.llm_error_status = llm_error_status
+        self.stream_chunks = stream_chunks
+        self.stream_interval = stream_interval
+        self.whisper_latency = whisper_latency
+        self.whisper_error_rate = whisper_error_rate
+        # Upload bandwidth to Whisper in bytes/s (0 = unlimited)
+        self.whisper_bandwidth = whisper_bandwidth
+        self.telegram_latency = telegram_latency
+        self.voice_bytes = voice_bytes
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        defaults = cls()
+        for name, value in vars(defaults).items():
+            parser.add_argument(
+                f"--{name.replace('_', '-')}", type=type(value), default=value
+            )
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "FakeOptions":
+        return cls(**{name: getattr(args, name) for name in vars(cls())})
+
+
+class UpdateFeed:
+    """Pending updates served to getUpdates, confirmed by the offset of the next call."""
+
+    def __init__(self) -> None:
+        self.pending: list[dict[str, Any]] = []
+        self._arrived = asyncio.Event()
+
+    def put(self, updates: list[dict[str, Any]]) -> None:
+        # Like Telegram, serve them in update_id order whatever order they came in
+        self.pending = sorted(self.pending + updates, key=lambda u: u["update_id"])
+        self._arrived.set()
+
+    async def get(
+        self, offset: int, timeout: float, limit: int
+    ) -> list[dict[str, Any]]:
+        self.pending = [u for u in self.pending if u["update_id"] >= offset]
+        if not self.pending and timeout > 0:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [u for u in self.pending if u["update_id"] >= offset][:limit]
+
+
+def _delay(latency: float, jitter: float) -> float:
+    return max(0.0, random.uniform(latency - jitter, latency + jitter))
+
+
+def create_app(options: FakeOptions) -> FastAPI:
+    app = FastAPI()
+    feed = UpdateFeed()
+    message_ids = itertools.count(1)
+    calls: dict[str, int] = {}
+    received = {"whisper_bytes": 0}
+
+    def message(params: dict[str, str]) -> dict[str, Any]:
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": int(params.get("message_id") or next(message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+            "text": params.get("text", ""),
+        }
+
+    @app.get("/_health")
+    async def health() -> dict[str, Any]:
+        return {"status": "ok", "calls": calls, "received": received}
+
+    @app.post("/_updates")
+    async def push_updates(request: Request) -> dict[str, int]:
+        updates = await request.json()
+        feed.put(updates)
+        return {"pending": len(feed.pending)}
+
+    # --- Telegram Bot API ---
+
+    @app.post("/bot{token}/{method}")
+    async def bot_api(token: str, method: str, request: Request) -> dict[str, Any]:
+        calls[method] = calls.get(method, 0) + 1
+        params = dict(parse_qsl((await request.body()).decode()))
+
+        if method == "getUpdates":
+            updates = await feed.get(
+                int(params.get("offset", 0)),
+                float(params.get("timeout", 0)),
+                int(params.get("limit", 100)),
+            )
+            return {"ok": True, "result": updates}
+
+        await asyncio.sleep(options.telegram_latency)
+        result: Any = True
+        if method == "getMe":
+            result = {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "Bench",
+                "username": BOT_USERNAME,
+            }
+        elif method in ("sendMessage", "editMessageText"):
+            result = message(params)
+        elif method == "getFile":
+            result = {
+                "file_id": params["file_id"],
+                "file_unique_id": params["file_id"],
+                "file_size": options.voice_bytes,
+                "file_path": f"voice/{params['file_id']}.ogg",
+            }
+        return {"ok": True, "result": result}
+
+    @app.get("/file/bot{token}/{path:path}")
+    async def download_file(token: str, path: str) -> Response:
+        await asyncio.sleep(options.telegram_latency)
+        return Response(b"\0" * options.voice_bytes, media_type="audio/ogg")
+
+    # --- LLM providers ---
+
+    def llm_error() -> Response | None:
+        if random.random() < options.llm_error_rate:
+            return JSONResponse(
+                {"error": {"message": "fake upstream error"}},
+                status_code=options.llm_error_status,
+            )
+        return None
+
+    async def sse(events: list[dict[str, Any]], done: bool) -> AsyncIterator[bytes]:
+        for event in events:
+            yield f"data: {json.dumps(event)}\n\n".encode()
+            await asyncio.sleep(options.stream_interval)
+        if done:
+            yield b"data: [DONE]\n\n"
+
+    def stream_pieces() -> list[str]:
+        size = -(-len(REPLY_TEXT) // max(1, options.stream_chunks))
+        return [REPLY_TEXT[i : i + size] for i in range(0, len(REPLY_TEXT), size)]
+
+    @app.post("/v1/chat/completions")
+    async def openai_completions(request: Request) -> Response:
+        body = await request.json()
+        await asyncio.sleep(_delay(options.llm_latency, options.llm_jitter))
+        error = llm_error()
+        if error:
+            return error
+        if body.get("stream"):
+            events = [
+                {"choices": [{"index": 0, "delta": {"content": piece}}]}
+                for piece in stream_pieces()
+            ]
+            return StreamingResponse(sse(events, True), media_type="text/event-stream")
+        return JSONResponse(
+            {
+                "id": "bench",
+                "model": body.get("model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": REPLY_TEXT},
+                    }
+                ],
+            }
+        )
+
+    @app.post("/v1beta/models/{target}")
+    async def google_generate(target: str, request: Request) -> Response:
+        await request.body()
+        await asyncio.sleep(_delay(options.llm_latency, options.llm_jitter))
+        error = llm_error()
+        if error:
+            return error
+
+        def candidate(text: str) -> dict[str, Any]:
+            return {
+                "candidates": [
+                    {"content": {"role": "model", "parts": [{"text": text}]}}
+                ]
+            }
+
+        if target.endswith(":streamGenerateContent"):
+            events = [candidate(piece) for piece in stream_pieces()]
+            return StreamingResponse(sse(events, False), media_type="text/event-stream")
+        return JSONResponse(candidate(REPLY_TEXT))
+
+    # --- Groq Whisper ---
+
+    @app.post("/openai/v1/audio/transcriptions")
+    async def transcriptions(request: Request) -> Response:
+        size = len(await request.body())
+        received["whisper_bytes"] += size
+        upload = size / options.whisper_bandwidth if options.whisper_bandwidth else 0
+        await asyncio.sleep(
+            upload + _delay(options.whisper_latency, options.whisper_latency / 4)
+        )
+        if random.random() < options.whisper_error_rate:
+            return JSONResponse({"error": {"message": "fake upstream error"}}, 503)
+        return JSONResponse({"text": "What is the capital of France?"})
+
+    return app
+
+
+def serve(port: int, options: FakeOptions, host: str = "127.0.0.1") -> None:
+    """Runs the fakes in the foreground (target of the load test's subprocess)."""
+    uvicorn.run(
+        create_app(options),
+        host=host,
+        port=port,
+        log_level="warning",
+        access_log=False,
+    )
+
+
+def start_in_background(options: FakeOptions) -> tuple[BaseProcess, str]:
+    """Serves the fakes from a subprocess on a free port: (process, base URL)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+    process = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(port, options), daemon=True
+    )
+    process.start()
+
+    for _ in range(100):
+        try:
+            httpx.get(f"{base_url}/_health").raise_for_status()
+            return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise SystemExit("Fake upstreams did not start")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    FakeOptions.add_arguments(parser)
+    args = parser.parse_args()
+    serve(args.port, FakeOptions.from_args(args), host=args.host)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,8 +17,24 @@ def setup_logging() -> None:
     logging.getLogger("httpx").setLevel(logging.WARNING)
 
 
+def _env_rate(name: str, default: str) -> tuple[int, float]:
+    """Reads a rate limit written as "<requests>/<seconds>", e.g. "10/60"."""
+    count, _, period = os.getenv(name, default).partition("/")
+    return int(count), float(period or 60)
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    """Reads a boolean flag from the environment ("1", "true", "yes", "on")."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 # --- Credentials ---
 BOT_TOKEN = str(os.getenv("BOT_TOKEN"))
+# Optional self-hosted Bot API server (or a local stand-in such as the load test's).
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
 if not BOT_TOKEN:
     raise ValueError("❌ BOT_TOKEN is not defined in the environment.")
 
@@ -28,19 +44,96 @@ API_TOKEN = os.getenv("API_TOKEN")
 LLM_MODEL = os.getenv("LLM_MODEL")
 SYSTEM_MESSAGE = os.getenv("SYSTEM_MESSAGE")
 
+# --- Conversation History ---
+# Input-token budget for the history sent to the LLM (the stored summary included);
+# the newest turns that fit are kept.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 4000))
+# Hard cap on stored turns per user, regardless of their size.
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", 50))
+# "heuristic" (fast, ~4 chars per token) or "tiktoken" (exact, needs the tiktoken package).
+TOKENIZER = os.getenv("TOKENIZER", "heuristic").lower()
+
+# Optional rolling summary: once a history has more than SUMMARY_TRIGGER_MESSAGES turns,
+# the oldest ones are summarized in the background, keeping SUMMARY_KEEP_MESSAGES verbatim.
+SUMMARIZE_HISTORY = _env_bool("SUMMARIZE_HISTORY")
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", 16))
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", 6))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 400))
+
+# --- Response Cache (translations and stateless /ask prompts) ---
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+# Total size of cached responses; 0 disables the cache.
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+
+# --- Streaming ---
+# Stream LLM tokens and progressively edit the reply instead of waiting for the full answer.
+STREAM_RESPONSES = _env_bool("STREAM_RESPONSES")
+# Minimum seconds between edits of the same message (Telegram throttles edits, stricter in groups).
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))
+STREAM_EDIT_INTERVAL_GROUP = float(os.getenv("STREAM_EDIT_INTERVAL_GROUP", 3.0))
+
 # --- Audio / Transcription ---
 GROQ_API_KEY = os.getenv("GROQ_API_KEY") or os.getenv("API_TOKEN", "")
+WHISPER_API_URL = os.getenv(
+    "WHISPER_API_URL", "https://api.groq.com/openai/v1/audio/transcriptions"
+)
+
+# Transcriptions cached by Telegram file_unique_id (in memory, plus disk when a dir is set).
+TRANSCRIPTION_CACHE_SIZE = int(os.getenv("TRANSCRIPTION_CACHE_SIZE", 2048))
+TRANSCRIPTION_CACHE_DIR = os.getenv("TRANSCRIPTION_CACHE_DIR", "")
+# Audio is streamed from Telegram to Whisper in chunks of this many bytes.
+TRANSCRIPTION_CHUNK_SIZE = int(os.getenv("TRANSCRIPTION_CHUNK_SIZE", 64 * 1024))
+# "groq" (remote Whisper API), "local" (faster-whisper on this machine's CPU, needs the
+# `local-stt` extra) or "auto" (local for short notes while its workers have room, else Groq).
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "auto").lower()
+# Model size (tiny, base, small, ...) or path of a CTranslate2 Whisper model.
+LOCAL_STT_MODEL = os.getenv("LOCAL_STT_MODEL", "base")
+LOCAL_STT_COMPUTE_TYPE = os.getenv("LOCAL_STT_COMPUTE_TYPE", "int8")
+# Worker processes (each keeps a model loaded) and CPU threads per worker.
+LOCAL_STT_WORKERS = int(os.getenv("LOCAL_STT_WORKERS", 1))
+LOCAL_STT_THREADS = int(os.getenv("LOCAL_STT_THREADS", 2))
+# Jobs that may wait for a busy worker; past that, "auto" sends notes to Groq.
+LOCAL_STT_QUEUE_SIZE = int(os.getenv("LOCAL_STT_QUEUE_SIZE", 4))
+# Longest note (seconds) that "auto" transcribes locally.
+LOCAL_STT_MAX_DURATION = float(os.getenv("LOCAL_STT_MAX_DURATION", 30))
+# Optional preprocessing before uploading to Groq (needs ffmpeg): decode to mono 16 kHz,
+# cut leading, trailing and long internal silences and re-encode as Opus.
+AUDIO_PREPROCESS = _env_bool("AUDIO_PREPROCESS")
+AUDIO_PREPROCESS_WORKERS = int(os.getenv("AUDIO_PREPROCESS_WORKERS", 2))
+AUDIO_PREPROCESS_BITRATE = os.getenv("AUDIO_PREPROCESS_BITRATE", "24k")
+# Silences longer than this (ms) are shortened to AUDIO_KEEP_SILENCE_MS around speech.
+AUDIO_MIN_SILENCE_MS = int(os.getenv("AUDIO_MIN_SILENCE_MS", 700))
+AUDIO_KEEP_SILENCE_MS = int(os.getenv("AUDIO_KEEP_SILENCE_MS", 200))
+# Silence means quieter than the note's average loudness minus this many dB.
+AUDIO_SILENCE_THRESHOLD_DB = float(os.getenv("AUDIO_SILENCE_THRESHOLD_DB", 16))
 
 MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", 1024))
 _BASE_API_URL = os.getenv("API_URL")
 
-API_URL = ""
-if PROVIDER and PROVIDER.lower() == "google":
-    if _BASE_API_URL and LLM_MODEL and API_TOKEN:
-        API_URL = f"{_BASE_API_URL}/{LLM_MODEL}:generateContent?key={API_TOKEN}"
-else:
+
+def build_api_url(provider: str | None, base_url: str | None, model: str | None) -> str:
+    """Google takes the model in the URL; the rest use the base URL as-is."""
+    if provider and provider.lower() == "google":
+        if base_url and model:
+            # The key is sent in a header so it never shows up in logged URLs
+            return f"{base_url}/{model}:generateContent"
+        return ""
     # For OpenAI/DeepSeek/Groq
-    API_URL = _BASE_API_URL if _BASE_API_URL else ""
+    return base_url if base_url else ""
+
+
+API_URL = build_api_url(PROVIDER, _BASE_API_URL, LLM_MODEL)
+
+# --- Provider Pool ---
+# Optional JSON list of LLM endpoints used together instead of the single provider above:
+# [{"name": "fast", "provider": "groq", "model": "...", "api_url": "...",
+#   "api_token_env": "GROQ_API_KEY", "weight": 1}, ...]
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "")
+# Optional JSON object restricting routes ("chat", "ask", "translate", "summary") to
+# some endpoints of the pool, e.g. {"translate": ["fast"], "ask": ["strong", "fast"]}.
+LLM_ROUTES = os.getenv("LLM_ROUTES", "")
+# Smoothing of the per-endpoint latency/error averages used to pick an endpoint (0-1).
+LLM_ROUTER_EWMA_ALPHA = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", 0.2))
 
 # --- Webhook & Hosting Configuration ---
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
@@ -50,3 +143,104 @@ WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
 PORT = int(os.environ.get("PORT", 8080))
 
 HOSTING = os.environ.get("HOSTING", "development")
+
+# --- Metrics ---
+# Prometheus text metrics at /metrics, behind a bearer token if set. In production
+# (public webhook host) they are only served with a token.
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# --- Tracing ---
+# Fraction of updates traced end to end (0 disables tracing, 1 traces everything).
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+# Finished spans are appended here as JSON lines (OTLP-like span objects).
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "traces.jsonl")
+
+# --- Persistence ---
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH", "bot_data.sqlite3")
+# Old PicklePersistence file, imported once into SQLite if present.
+LEGACY_PICKLE_PATH = os.getenv("LEGACY_PICKLE_PATH", "bot_data.pickle")
+
+# --- Webhook Update Queue ---
+# Webhook updates are acknowledged at once and processed by a pool of background workers:
+# at most UPDATE_WORKERS updates at once (one per chat), UPDATE_QUEUE_SIZE waiting.
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 64))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 256))
+# What to do when the queue is full: "reject" (answer 503 so Telegram retries) or "drop_oldest".
+UPDATE_QUEUE_POLICY = os.getenv("UPDATE_QUEUE_POLICY", "reject").lower()
+# Seconds to wait for queued updates to finish on shutdown.
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", 30))
+
+# --- Rate Limiting ---
+# Per-user limits for each command class, as "<requests>/<seconds>".
+RATE_LIMIT_LLM = _env_rate("RATE_LIMIT_LLM", "12/60")
+RATE_LIMIT_TRANSCRIPTION = _env_rate("RATE_LIMIT_TRANSCRIPTION", "6/60")
+RATE_LIMIT_VIDEO = _env_rate("RATE_LIMIT_VIDEO", "3/60")
+# Shared limit for each group chat (all command classes together).
+RATE_LIMIT_CHAT = _env_rate("RATE_LIMIT_CHAT", "30/60")
+# Requests a single user may have in progress at the same time.
+MAX_INFLIGHT_PER_USER = int(os.getenv("MAX_INFLIGHT_PER_USER", 2))
+# The "slow down" reply is sent at most once per this many seconds per user.
+RATE_LIMIT_NOTICE_INTERVAL = float(os.getenv("RATE_LIMIT_NOTICE_INTERVAL", 30))
+
+# --- Upstream Concurrency ---
+# Max concurrent requests per LLM endpoint; adapts down on 429/5xx and back up when healthy.
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", 16))
+TRANSCRIPTION_MAX_CONCURRENCY = int(os.getenv("TRANSCRIPTION_MAX_CONCURRENCY", 8))
+# Seconds a request may wait for a free slot before failing with "service busy".
+UPSTREAM_MAX_QUEUE_WAIT = float(os.getenv("UPSTREAM_MAX_QUEUE_WAIT", 5))
+
+# --- LLM Retries ---
+# Transient failures (429, 5xx, network) are retried with jittered exponential backoff,
+# honoring Retry-After, as long as the whole user request fits in the deadline (seconds).
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", 3))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 8))
+LLM_REQUEST_DEADLINE = float(os.getenv("LLM_REQUEST_DEADLINE", 45))
+# Idempotent calls (translations) fire a second request when the first is slower than
+# the endpoint's recent p95 latency (or LLM_HEDGE_DELAY until enough samples exist).
+LLM_HEDGING = _env_bool("LLM_HEDGING", True)
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", 3))
+
+# --- Circuit Breakers (LLM endpoints, Whisper, Cobalt) ---
+# Consecutive upstream failures (network, timeouts, 429/5xx) that open a circuit.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+# Seconds an open circuit fails fast before letting trial requests through.
+CIRCUIT_RECOVERY_TIMEOUT = float(os.getenv("CIRCUIT_RECOVERY_TIMEOUT", 30))
+# Trial requests allowed at once while half-open; that many successes close it again.
+CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", 1))
+
+# --- Video Downloads (/dl) ---
+# Downloads run at most this many at once; yt-dlp/ffmpeg run in as many worker processes.
+VIDEO_WORKERS = int(os.getenv("VIDEO_WORKERS", 2))
+# Downloads waiting for a worker; past that new links are turned away.
+VIDEO_QUEUE_SIZE = int(os.getenv("VIDEO_QUEUE_SIZE", 20))
+# Downloads a single user may have queued or running at the same time.
+VIDEO_MAX_JOBS_PER_USER = int(os.getenv("VIDEO_MAX_JOBS_PER_USER", 2))
+# Telegram file ids of videos already sent, re-sent without downloading or uploading.
+VIDEO_CACHE_SIZE = int(os.getenv("VIDEO_CACHE_SIZE", 4096))
+# Optional folder keeping recent downloads, up to VIDEO_CACHE_MAX_BYTES in total.
+VIDEO_CACHE_DIR = os.getenv("VIDEO_CACHE_DIR", "")
+VIDEO_CACHE_MAX_BYTES = int(os.getenv("VIDEO_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# Cobalt downloads of known size up to this many bytes are piped straight into the
+# Telegram upload; others are spooled to a temp file first.
+VIDEO_STREAM_MAX_BYTES = int(os.getenv("VIDEO_STREAM_MAX_BYTES", 50 * 1024 * 1024))
+# Chunk size (bytes) for reading, spooling and uploading videos.
+VIDEO_STREAM_CHUNK_SIZE = int(os.getenv("VIDEO_STREAM_CHUNK_SIZE", 256 * 1024))
+# Seconds a link's probed formats and sizes are reused (download links expire).
+VIDEO_PROBE_TTL = float(os.getenv("VIDEO_PROBE_TTL", 600))
+# Links whose probe results are kept at the same time.
+VIDEO_PROBE_CACHE_SIZE = int(os.getenv("VIDEO_PROBE_CACHE_SIZE", 256))
+# Optional re-encoding (needs ffmpeg) of videos over Telegram's 50MB limit, at the
+# bitrate their duration allows; downloads up to VIDEO_TRANSCODE_MAX_INPUT_BYTES.
+VIDEO_TRANSCODE = _env_bool("VIDEO_TRANSCODE")
+VIDEO_TRANSCODE_WORKERS = int(os.getenv("VIDEO_TRANSCODE_WORKERS", 1))
+VIDEO_TRANSCODE_MAX_INPUT_BYTES = int(
+    os.getenv("VIDEO_TRANSCODE_MAX_INPUT_BYTES", 512 * 1024 * 1024)
+)
+# x264 preset (ultrafast..veryslow) and threads per encode (0: ffmpeg decides).
+VIDEO_TRANSCODE_PRESET = os.getenv("VIDEO_TRANSCODE_PRESET", "veryfast")
+VIDEO_TRANSCODE_THREADS = int(os.getenv("VIDEO_TRANSCODE_THREADS", 0))
+VIDEO_TRANSCODE_AUDIO_KBPS = int(os.getenv("VIDEO_TRANSCODE_AUDIO_KBPS", 96))
+# Videos so long that their video bitrate would fall under this (kbit/s) are refused.
+VIDEO_TRANSCODE_MIN_VIDEO_KBPS = int(os.getenv("VIDEO_TRANSCODE_MIN_VIDEO_KBPS", 150))
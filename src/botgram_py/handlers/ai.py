@@ -1,13 +1,16 @@
+import asyncio
 import logging
-from datetime import datetime, timezone
-from typing import cast
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, cast
 
-from telegram import Update, constants
-from telegram.error import BadRequest
+from telegram import Message, Update, constants
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
 
 from .. import config
-from ..services import llm_api
+from ..services import history, router, summarizer, tokens
+from ..tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +24,15 @@ def get_user_keys(user_id: int) -> tuple[str, str]:
     return f"conversation_{user_id}", f"last_active_{user_id}"
 
 
+def get_summary_key(user_id: int) -> str:
+    """Key of the rolling summary of the user's older turns in chat_data."""
+    return f"summary_{user_id}"
+
+
+# (chat_id, user_id) pairs with a summarization running in the background
+_compacting: set[tuple[int, int]] = set()
+
+
 async def send_safe_reply(
     update: Update, text: str, parse_mode: str | None = None
 ) -> None:
@@ -32,12 +44,99 @@ async def send_safe_reply(
         text[i : i + TELEGRAM_MAX_CHARS]
         for i in range(0, len(text), TELEGRAM_MAX_CHARS)
     ]
-    for chunk in chunks:
+    with span("telegram.send_reply", chunks=len(chunks)):
+        for chunk in chunks:
+            try:
+                await update.message.reply_text(chunk, parse_mode=parse_mode)  # type: ignore[union-attr]
+            except BadRequest:
+                # Markdown parsing failed — retry as plain text
+                await update.message.reply_text(chunk)  # type: ignore[union-attr]
+
+
+def _as_seconds(value: float | timedelta) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class StreamingReply:
+    """
+    Progressively renders a streamed LLM answer as Telegram messages.
+
+    The first message is sent as soon as text arrives, then edited at most once
+    per `min_interval` seconds. When the text outgrows Telegram's limit, the
+    current message is finalized and a new one is started.
+    """
+
+    def __init__(self, anchor: Message, min_interval: float) -> None:
+        self._anchor = anchor
+        self._min_interval = min_interval
+        self._text = ""
+        self._offset = 0  # Start of the current message inside self._text
+        self._message: Message | None = None
+        self._last_sent = ""
+        self._next_edit_at = 0.0
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    async def append(self, chunk: str) -> None:
+        self._text += chunk
+
+        # Roll over to a new message once the current one is full
+        while len(self._text) - self._offset > TELEGRAM_MAX_CHARS:
+            end = self._offset + TELEGRAM_MAX_CHARS
+            await self._render(self._text[self._offset : end], final=True)
+            self._offset = end
+            self._message = None
+            self._last_sent = ""
+
+        if time.monotonic() >= self._next_edit_at:
+            await self._render(self._text[self._offset :])
+
+    async def finish(self) -> None:
+        """Sends the last pending text, rendered as Markdown when possible."""
+        await self._render(self._text[self._offset :], final=True)
+
+    async def _render(self, text: str, final: bool = False) -> None:
+        if not text.strip():
+            return
+        if text == self._last_sent and not final:
+            return
+
+        try:
+            await self._send(text, parse_mode="Markdown" if final else None)
+        except RetryAfter as e:
+            retry_after = _as_seconds(e.retry_after)
+            self._next_edit_at = time.monotonic() + retry_after
+            if not final:
+                return
+            # Final text must land: wait out the flood limit once
+            await asyncio.sleep(retry_after)
+            await self._send(text, parse_mode="Markdown")
+
+        self._next_edit_at = time.monotonic() + self._min_interval
+
+    async def _send(self, text: str, parse_mode: str | None) -> None:
         try:
-            await update.message.reply_text(chunk, parse_mode=parse_mode)  # type: ignore[union-attr]
-        except BadRequest:
-            # Markdown parsing failed — retry as plain text
-            await update.message.reply_text(chunk)  # type: ignore[union-attr]
+            await self._deliver(text, parse_mode)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            if parse_mode is None:
+                raise
+            # Markdown parsing failed — fall back to plain text
+            try:
+                await self._deliver(text, None)
+            except BadRequest as plain_error:
+                if "not modified" not in str(plain_error).lower():
+                    raise
+        self._last_sent = text
+
+    async def _deliver(self, text: str, parse_mode: str | None) -> None:
+        if self._message is None:
+            self._message = await self._anchor.reply_text(text, parse_mode=parse_mode)
+        else:
+            await self._message.edit_text(text, parse_mode=parse_mode)
 
 
 async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -53,6 +152,7 @@ async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
     context.chat_data[history_key] = []
     context.chat_data[time_key] = None
+    context.chat_data.pop(get_summary_key(user_id), None)
 
     await update.message.reply_text("♻️ Your conversation history has been cleared.")
 
@@ -85,7 +185,9 @@ async def ask_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         )
         return
 
-    await process_ai_interaction(update, context, final_prompt)
+    await process_ai_interaction(
+        update, context, final_prompt, cacheable=True, route=router.ASK
+    )
 
 
 async def handle_private_text(
@@ -126,10 +228,17 @@ async def handle_group_mention(
 
 
 async def process_ai_interaction(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    user_text: str,
+    cacheable: bool = False,
+    route: str = router.CHAT,
 ) -> None:
     """
     Main function to manage AI interaction: history, API call, and response.
+    With `cacheable`, the answer may come from the response cache when the prompt
+    carries no prior context (no history and no summary). `route` selects which
+    endpoints of the provider pool may answer.
     """
     if not update.effective_chat or not update.effective_user or not update.message:
         logger.warning("Update missing critical data (chat/user/message), ignoring.")
@@ -142,6 +251,7 @@ async def process_ai_interaction(
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id
     history_key, time_key = get_user_keys(user_id)
+    summary_key = get_summary_key(user_id)
 
     await context.bot.send_chat_action(
         chat_id=chat_id, action=constants.ChatAction.TYPING
@@ -155,6 +265,7 @@ async def process_ai_interaction(
 
     if last_active and (current_time - last_active).total_seconds() > 3600:
         context.chat_data[history_key] = []
+        context.chat_data.pop(summary_key, None)
         await update.message.reply_text("🕒 Your chat history reset due to inactivity.")
 
     context.chat_data[time_key] = current_time
@@ -162,28 +273,63 @@ async def process_ai_interaction(
     conversation = cast(list[dict[str, str]], context.chat_data[history_key])
     conversation.append({"role": "user", "content": user_text})
 
-    if len(conversation) > 20:
-        context.chat_data[history_key] = conversation[-20:]
-        conversation = cast(list[dict[str, str]], context.chat_data[history_key])
-
-    api_token = config.API_TOKEN or ""
-    llm_model = config.LLM_MODEL or ""
-    api_url = config.API_URL
+    primary = router.router.primary
+    estimator = tokens.get_estimator(
+        primary.provider if primary else "", config.TOKENIZER
+    )
+    summary = context.chat_data.get(summary_key)
+    budget = config.HISTORY_TOKEN_BUDGET
+    if summary:
+        # The summary is sent along with the window, so it takes its share too
+        budget -= history.message_tokens(
+            {"role": "system", "content": summary}, estimator
+        )
+    window = cast(
+        list[dict[str, str]],
+        history.trim_to_budget(
+            conversation,
+            max(budget, 0),
+            estimator,
+            max_messages=config.MAX_HISTORY_MESSAGES,
+        ),
+    )
+    # With summaries on, the older turns stay stored until compact_history folds
+    # them into the summary; only the window sent to the provider is trimmed
+    if not config.SUMMARIZE_HISTORY:
+        context.chat_data[history_key] = conversation = window
+    elif len(conversation) > config.MAX_HISTORY_MESSAGES:
+        del conversation[: -config.MAX_HISTORY_MESSAGES]
+
+    use_cache = cacheable and len(window) == 1 and not summary
     ai_response = ""
 
     try:
-        ai_response = await llm_api.get_api_llm(
-            conversation,
-            api_token,
-            api_url,
-            llm_model,
-            config.PROVIDER or "",
-            MAX_OUTPUT_TOKENS=config.MAX_OUTPUT_TOKENS,
-            system_message=config.SYSTEM_MESSAGE,
-        )
+        if config.STREAM_RESPONSES:
+            ai_response = await stream_ai_reply(
+                update, window, summary, use_cache, route
+            )
+        else:
+            ai_response = await router.router.complete(
+                route,
+                window,
+                system_message=config.SYSTEM_MESSAGE,
+                summary=summary,
+                use_cache=use_cache,
+            )
+            await send_safe_reply(update, ai_response, parse_mode="Markdown")
 
         conversation.append({"role": "assistant", "content": ai_response})
-        await send_safe_reply(update, ai_response, parse_mode="Markdown")
+
+        if (
+            config.SUMMARIZE_HISTORY
+            and len(conversation) > config.SUMMARY_TRIGGER_MESSAGES
+            and (chat_id, user_id) not in _compacting
+        ):
+            _compacting.add((chat_id, user_id))
+            context.application.create_task(
+                compact_history(context.chat_data, chat_id, user_id),
+                update=update,
+            )
 
     except Exception as e:
         logger.error("Error in AI handler: %s", e, exc_info=True)
@@ -191,3 +337,81 @@ async def process_ai_interaction(
             await update.message.reply_text("🚨 Sorry, technical problem")
         except Exception:
             pass
+
+
+async def stream_ai_reply(
+    update: Update,
+    conversation: list[dict[str, str]],
+    summary: str | None = None,
+    use_cache: bool = False,
+    route: str = router.CHAT,
+) -> str:
+    """Streams the LLM answer into progressively edited messages and returns the full text."""
+    is_private = (
+        update.effective_chat is not None and update.effective_chat.type == "private"
+    )
+    reply = StreamingReply(
+        update.message,  # type: ignore[arg-type]
+        (
+            config.STREAM_EDIT_INTERVAL
+            if is_private
+            else config.STREAM_EDIT_INTERVAL_GROUP
+        ),
+    )
+
+    with span("llm.stream", route=route):
+        async for chunk in router.router.stream(
+            route,
+            conversation,
+            system_message=config.SYSTEM_MESSAGE,
+            summary=summary,
+            use_cache=use_cache,
+        ):
+            await reply.append(chunk)
+
+    if not reply.text.strip():
+        raise RuntimeError("API Error: empty streamed response")
+
+    await reply.finish()
+    return reply.text
+
+
+async def compact_history(
+    chat_data: dict[Any, Any], chat_id: int, user_id: int
+) -> None:
+    """
+    Background task: folds the oldest turns into the stored summary, keeping only the
+    most recent ones verbatim. Runs off the request path; if the history changed in
+    a way that makes the snapshot stale (e.g. /clear), the result is discarded.
+    """
+    history_key, _ = get_user_keys(user_id)
+    summary_key = get_summary_key(user_id)
+
+    try:
+        conversation = cast(list[dict[str, str]], chat_data.get(history_key) or [])
+        old_turns = conversation[: -config.SUMMARY_KEEP_MESSAGES]
+        if not old_turns:
+            return
+
+        new_summary = await summarizer.summarize(chat_data.get(summary_key), old_turns)
+
+        # Drop the summarized turns that are still at the head of the history
+        current = cast(list[dict[str, str]], chat_data.get(history_key) or [])
+        cut = next((i + 1 for i, msg in enumerate(current) if msg is old_turns[-1]), 0)
+        if not cut:
+            logger.info(
+                "History of %s/%s changed, discarding summary.", chat_id, user_id
+            )
+            return
+
+        chat_data[summary_key] = new_summary
+        # In place: a request in flight may still append to this same list
+        del current[:cut]
+        logger.info(
+            "🗜️ Compacted %d turns of %s/%s into the summary.", cut, chat_id, user_id
+        )
+
+    except Exception as e:
+        logger.warning("Could not summarize history of %s/%s: %s", chat_id, user_id, e)
+    finally:
+        _compacting.discard((chat_id, user_id))
@@ -1,21 +1,74 @@
 import logging
+import os
+import time
+import warnings
+from datetime import timedelta
 
-from telegram import Update, constants
+from telegram import Audio, Update, Voice, constants
 from telegram.ext import ContextTypes
+from telegram.warnings import PTBDeprecationWarning
 
 from .. import config
-from ..services.speech_to_text import transcribe
+from ..services.speech_to_text import is_configured, transcribe
+from ..services.telegram_files import iter_file
+from ..services.transcription_cache import transcription_cache
+from ..tracing import span
 from .ai import process_ai_interaction
 
 logger = logging.getLogger(__name__)
 
 
+def _duration_seconds(audio_obj: Voice | Audio) -> float | None:
+    """The duration as seconds, whether PTB returns an int or (opted in) a timedelta."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", PTBDeprecationWarning)
+        duration = audio_obj.duration
+    return duration.total_seconds() if isinstance(duration, timedelta) else duration
+
+
+async def get_transcription(
+    context: ContextTypes.DEFAULT_TYPE, audio_obj: Voice | Audio
+) -> str:
+    """
+    Returns the transcription of a voice note or audio file. Already transcribed
+    files (same file_unique_id) are served from cache without downloading them again.
+    """
+    cached = await transcription_cache.get(audio_obj.file_unique_id)
+    if cached is not None:
+        logger.info("♻️ Transcription cache hit: %s", transcription_cache.stats())
+        return cached
+
+    start = time.perf_counter()
+    with span("telegram.get_file"):
+        new_file = await context.bot.get_file(audio_obj.file_id)
+
+    # The download is piped into the Whisper upload chunk by chunk, never buffered whole
+    extension = os.path.splitext(new_file.file_path or "")[1] or ".ogg"
+    transcribed_text = await transcribe(
+        iter_file(new_file, config.TRANSCRIPTION_CHUNK_SIZE),
+        config.GROQ_API_KEY,
+        dedup_key=audio_obj.file_unique_id,
+        size=new_file.file_size,
+        filename=f"audio{extension}",
+        content_type=audio_obj.mime_type or "audio/ogg",
+        duration=_duration_seconds(audio_obj),
+    )
+
+    await transcription_cache.set(
+        audio_obj.file_unique_id,
+        transcribed_text,
+        size=new_file.file_size or 0,
+        seconds=time.perf_counter() - start,
+    )
+    return transcribed_text
+
+
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles voice notes, transcribes them via Groq, and sends to AI."""
     if not update.message or not update.message.voice or not update.effective_chat:
         return
 
-    if not config.GROQ_API_KEY:
+    if not is_configured(config.GROQ_API_KEY):
         await update.message.reply_text(
             "⚠️ Voice transcription is not configured (missing GROQ_API_KEY)."
         )
@@ -34,10 +87,7 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             await update.message.reply_text("⚠️ Audio too large to process.")
             return
 
-        new_file = await context.bot.get_file(voice.file_id)
-        file_byte_array = await new_file.download_as_bytearray()
-
-        transcribed_text = await transcribe(bytes(file_byte_array), config.GROQ_API_KEY)
+        transcribed_text = await get_transcription(context, voice)
 
         if not transcribed_text:
             await update.message.reply_text("😓 I couldn't hear anything in the audio.")
@@ -79,7 +129,7 @@ async def transcribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     # Configuration check
-    if not config.GROQ_API_KEY:
+    if not is_configured(config.GROQ_API_KEY):
         await update.message.reply_text("⚠️ GROQ_API_KEY is missing in configuration.")
         return
 
@@ -88,12 +138,8 @@ async def transcribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await context.bot.send_chat_action(chat_id=chat_id, action=constants.ChatAction.TYPING)
 
     try:
-        # Download file
-        new_file = await context.bot.get_file(audio_obj.file_id)
-        file_byte_array = await new_file.download_as_bytearray()
-
-        # Call Groq Service
-        transcribed_text = await transcribe(bytes(file_byte_array), config.GROQ_API_KEY)
+        # Download file and call Groq Service (or reuse a cached transcription)
+        transcribed_text = await get_transcription(context, audio_obj)
 
         if not transcribed_text:
             await status_msg.edit_text("😓 I couldn't extract any text from this audio.")
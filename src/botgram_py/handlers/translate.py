@@ -3,8 +3,7 @@ import logging
 from telegram import Update, constants
 from telegram.ext import ContextTypes
 
-from .. import config
-from ..services import llm_api
+from ..services.router import TRANSLATE, router
 from .ai import send_safe_reply
 
 logger = logging.getLogger(__name__)
@@ -91,14 +90,12 @@ async def translate_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
     try:
-        translation = await llm_api.get_api_llm(
+        translation = await router.complete(
+            TRANSLATE,
             messages=[{"role": "user", "content": prompt}],
-            API_TOKEN=config.API_TOKEN or "",
-            API_URL=config.API_URL,
-            LLM_MODEL=config.LLM_MODEL or "",
-            PROVIDER=config.PROVIDER or "",
-            MAX_OUTPUT_TOKENS=config.MAX_OUTPUT_TOKENS,
             system_message="You are a professional translator. Translate text accurately and naturally.",
+            use_cache=True,
+            idempotent=True,
         )
         await send_safe_reply(update, translation)
 
@@ -1,15 +1,47 @@
+import asyncio
 import logging
 import os
 import re
-import shutil
-
-from telegram import Update, constants
+import secrets
+import time
+from contextlib import suppress
+
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    Message,
+    Update,
+    constants,
+)
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import ContextTypes
 
-from ..services import video_api
+from .. import config
+from ..services import telegram_files
+from ..services.video_api import (
+    TELEGRAM_MAX_UPLOAD,
+    TOO_LARGE_MESSAGE,
+    VideoSource,
+    VideoStream,
+    normalize_url,
+)
+from ..services.video_cache import video_cache
+from ..services.video_jobs import VideoJob, video_jobs
 
 logger = logging.getLogger(__name__)
 
+CANCEL_PREFIX = "dl_cancel:"
+CAPTION = "🎥 Here is your video"
+PROCESSING_TEXT = "⏳ Processing video... (this may take a few seconds)"
+# Queue position edits of one status message are at least this many seconds apart
+POSITION_EDIT_INTERVAL = 2.0
+# While downloading, the status shows the elapsed time every this many seconds,
+# which also tells whether the user deleted it to cancel
+DOWNLOAD_EDIT_INTERVAL = 10.0
+
+# Cancel token -> (user who asked, task downloading and sending the video)
+_downloads: dict[str, tuple[int, asyncio.Task[None]]] = {}
+
 
 async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the /dl command, extracting URL from arguments or replies."""
@@ -35,35 +67,79 @@ async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         return
 
     chat_id = update.effective_chat.id
+    user_id = update.effective_user.id if update.effective_user else chat_id
 
+    try:
+        if await _send_cached(update.message, normalize_url(url)):
+            return
+    except ValueError:
+        pass  # Malformed link: reported by the download below
+
+    token = secrets.token_hex(8)
+    cancel_button = InlineKeyboardButton(
+        "✖️ Cancel", callback_data=CANCEL_PREFIX + token
+    )
     status_msg = await update.message.reply_text(
-        "⏳ Processing video... (this may take a few seconds)"
+        PROCESSING_TEXT, reply_markup=InlineKeyboardMarkup([[cancel_button]])
     )
     await context.bot.send_chat_action(
         chat_id=chat_id, action=constants.ChatAction.UPLOAD_VIDEO
     )
 
-    video_path: str | None = None
-    try:
-        video_path = await video_api.download_video(url)
+    # Queued downloads can take minutes: don't hold the update worker meanwhile
+    task = context.application.create_task(
+        _download_and_send(update.message, status_msg, url, user_id), update=update
+    )
+    _downloads[token] = (user_id, task)
+    task.add_done_callback(lambda _: _downloads.pop(token, None))
 
-        file_size = os.path.getsize(video_path)
-        if file_size > 50 * 1024 * 1024:  # 50MB
-            await status_msg.edit_text(
-                "❌ The video is too large to send via Telegram (>50MB)."
-            )
-            return
 
-        await update.message.reply_video(
-            video=open(video_path, "rb"),
-            caption="🎥 Here is your video",
-            supports_streaming=True,
-            read_timeout=120,
-            write_timeout=120,
-        )
+async def cancel_download(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handles the "Cancel" button of a /dl status message."""
+    query = update.callback_query
+    if not query or not query.data:
+        return
+
+    download = _downloads.get(query.data.removeprefix(CANCEL_PREFIX))
+    if download is None:
+        await query.answer("This download is already over.")
+        return
+    user_id, task = download
+    if query.from_user.id != user_id:
+        await query.answer("Only the person who asked for it can cancel it.")
+        return
+
+    task.cancel()
+    await query.answer("Cancelled.")
+
+
+async def _download_and_send(
+    message: Message, status_msg: Message, url: str, user_id: int
+) -> None:
+    try:
+        async with video_jobs.request(url, user_id) as job:
+            source = None
+            if await _show_queue_position(job, status_msg):
+                source = await _wait_showing_progress(job, status_msg)
+            if source is None:
+                logger.info("🚫 Status message deleted, dropping the download.")
+                return
+
+            # Requests sharing this download upload it once, then reuse its file_id
+            async with video_cache.upload_lock(job.key):
+                sent = await _send_cached(message, job.key) or await _upload(
+                    message, job.key, source
+                )
+            if not sent:
+                await status_msg.edit_text(TOO_LARGE_MESSAGE)
+                return
 
         await status_msg.delete()
 
+    except asyncio.CancelledError:
+        with suppress(TelegramError):
+            await status_msg.edit_text("🚫 Download cancelled.")
+        raise
     except ValueError as e:
         await status_msg.edit_text(f"⚠️ {str(e)}")
     except Exception as e:
@@ -72,10 +148,104 @@ async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
             "🚨 Download failed. Please check if the link is public and valid."
         )
 
+
+async def _send_cached(message: Message, key: str) -> bool:
+    """Re-sends a video Telegram already has, by file_id. False if there is none."""
+    file_id = video_cache.file_id(key)
+    if file_id is None:
+        return False
+    try:
+        await message.reply_video(video=file_id, caption=CAPTION)
+    except BadRequest as e:
+        logger.warning("Cached video file_id rejected (%s), sending it again.", e)
+        video_cache.forget_file_id(key)
+        return False
+    logger.info("♻️ Video cache hit: %s", video_cache.stats())
+    return True
+
+
+async def _upload(message: Message, key: str, source: VideoSource) -> bool:
+    """
+    Uploads the video and remembers its file_id. False if it is too large. A stream
+    is read once: after that, what it spooled to disk is uploaded instead.
+    """
+    if isinstance(source, VideoStream) and source.taken:
+        if source.path is None:
+            raise ValueError("❌ The video could not be sent, please try again.")
+        source = source.path
+    if isinstance(source, VideoStream):
+        video, file_size = source.chunks(), source.size
+    else:
+        video, file_size = source, os.path.getsize(source)
+    if file_size > TELEGRAM_MAX_UPLOAD:
+        return False
+
+    sent = await telegram_files.send_video(
+        message, video, file_size, CAPTION, config.VIDEO_STREAM_CHUNK_SIZE
+    )
+    if sent.video:
+        video_cache.set_file_id(key, sent.video.file_id, file_size)
+    return True
+
+
+async def _show_queue_position(job: VideoJob, status_msg: Message) -> bool:
+    """
+    Keeps the status message up to date while the download waits for a worker.
+    Returns False if the message is gone: the user deleted it to cancel.
+    """
+    queued = False
+    async for position in video_jobs.positions(job):
+        queued = True
+        if not await _edit_status(
+            status_msg, f"🕒 Waiting in the queue (position {position})..."
+        ):
+            return False
+        await asyncio.sleep(POSITION_EDIT_INTERVAL)
+    return not queued or await _edit_status(status_msg, PROCESSING_TEXT)
+
+
+async def _wait_showing_progress(
+    job: VideoJob, status_msg: Message
+) -> VideoSource | None:
+    """
+    Waits for the download, editing the status along the way: elapsed time, then
+    how far transcoding is, if it happens. Returns None if the message is gone:
+    the user deleted it to cancel.
+    """
+    result = asyncio.ensure_future(video_jobs.wait(job))
+    start = time.monotonic()
+    last_edit = start
+    shown: float | None = None
+    try:
+        while not result.done():
+            await asyncio.wait({result}, timeout=POSITION_EDIT_INTERVAL)
+            if result.done():
+                break
+            now = time.monotonic()
+            done = job.transcoding
+            if done is not None and done != shown:
+                shown = done
+                text = f"🎞️ Compressing the video to fit in 50MB... {done:.0%}"
+            elif done is None and now - last_edit >= DOWNLOAD_EDIT_INTERVAL:
+                text = f"⏳ Downloading video... ({now - start:.0f}s)"
+            else:
+                continue
+            last_edit = now
+            if not await _edit_status(status_msg, text):
+                return None
+        return result.result()
     finally:
-        if video_path and os.path.exists(video_path):
-            try:
-                folder = os.path.dirname(video_path)
-                shutil.rmtree(folder, ignore_errors=True)
-            except OSError:
-                pass
+        result.cancel()
+
+
+async def _edit_status(status_msg: Message, text: str) -> bool:
+    """Edits the status, keeping the Cancel button. False if the message is gone."""
+    try:
+        await status_msg.edit_text(text, reply_markup=status_msg.reply_markup)
+    except BadRequest as e:
+        if "not found" in str(e).lower():
+            return False
+    except TelegramError as e:
+        # Flood limits and the like: the next update will do
+        logger.warning("Could not update the video status: %s", e)
+    return True
@@ -1,5 +1,6 @@
 import argparse
 import logging
+import time
 import warnings
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
@@ -8,6 +9,7 @@ from typing import Any
 import uvicorn
 from cachetools import TTLCache
 from fastapi import FastAPI, Header, Request, Response
+from fastapi.responses import PlainTextResponse
 from telegram import Update, BotCommand
 from telegram.ext import (
     Application,
@@ -15,17 +17,30 @@ from telegram.ext import (
     CommandHandler,
     ContextTypes,
     MessageHandler,
-    PicklePersistence,
+    TypeHandler,
     filters,
 )
 
-from . import config
+from . import config, metrics, tracing
 from .custom_filters import TARGETED_OR_PRIVATE
 from .handlers import ai, audio, translate
+from .persistence import SQLitePersistence
+from .rate_limit import enforce_rate_limits, release_rate_limits
+from .services.audio_preprocess import audio_preprocessor
+from .services.circuit_breaker import CLOSED, HALF_OPEN, all_breakers
+from .services.local_stt import local_engine
+from .services.response_cache import response_cache
+from .services.router import router
+from .services.speech_to_text import uses_local_engine
+from .services.upstream_limits import all_limiters
+from .services.video_jobs import video_jobs
+from .services.video_transcode import video_transcoder
+from .update_queue import UpdateDispatcher
 
 # We import the HTTP clients to close them on shutdown
 from .services.llm_api import http_client as llm_client
 from .services.speech_to_text import http_client as groq_client
+from .services.telegram_files import http_client as telegram_files_client
 from .services.video_api import http_client as video_client
 
 config.setup_logging()
@@ -34,6 +49,8 @@ logger = logging.getLogger(__name__)
 processed_updates: TTLCache[int, bool] = TTLCache(maxsize=1000, ttl=300)
 warnings.filterwarnings("ignore", category=SyntaxWarning, module="pydub")
 
+timed = metrics.timed_handler
+
 
 # --- 1. Define Basic Handlers ---
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -48,33 +65,29 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     """Shows the welcome and help message with detailed instructions."""
     if not update.message or not update.effective_user:
         return
-    
+
     user = update.effective_user.first_name
     bot_username = context.bot.username
 
     help_text = (
         f"👋 Hello, *{user}*! I am your multifunctional AI assistant.\n\n"
-        
         "🧠 *Artificial Intelligence*\n"
         "• `/ask [text]` — Ask me a direct question.\n"
         "• `/ask` — *Replying to a message:* I analyze and answer the message you quote.\n"
         "• `/clear` — Reset my memory and forget our current conversation.\n\n"
-        
         "🗣️ *Audio & Voice*\n"
         "• *Voice Note:* Send me a voice note in private chat to talk to the AI.\n"
         "• `/transcribe` — Convert audio to text (reply to any audio file).\n\n"
-        
         "🌍 *Translation*\n"
         "• `/translate [lang] [text]` — Translate to any language.\n"
         "• _Supported codes:_ `es` `en` `fr` `it` `de` `pt` `ja` `zh` `ar` `ru`\n"
         "• _Example:_ `/translate fr Hello, how are you?`\n"
         "• _You can also reply to a message with `/translate [lang]`._\n\n"
-        
         "👥 *Group Usage*\n"
         "To get my attention in groups, you must mention me:\n"
         f"`/ask@{bot_username} question` or `@{bot_username} hello`"
     )
-    
+
     await update.message.reply_text(help_text, parse_mode="Markdown")
 
 
@@ -84,38 +97,46 @@ def register_handlers(application: Application) -> None:
     Registers all commands for both Webhook and Polling modes.
     Follows DRY principle.
     """
+    # 0. Rate limits: checked before any handler (group -1), released after all of them
+    application.add_handler(TypeHandler(Update, enforce_rate_limits), group=-1)
+    application.add_handler(TypeHandler(Update, release_rate_limits), group=100)
+
     # 1. General Commands
     # filters=TARGETED_OR_PRIVATE performs the magic of filtering group spam
     application.add_handler(
-        CommandHandler("start", start_command, filters=TARGETED_OR_PRIVATE)
+        CommandHandler("start", timed(start_command), filters=TARGETED_OR_PRIVATE)
     )
     application.add_handler(
-        CommandHandler("help", help_command, filters=TARGETED_OR_PRIVATE)
+        CommandHandler("help", timed(help_command), filters=TARGETED_OR_PRIVATE)
     )
     application.add_handler(
         MessageHandler(
-            filters.ChatType.GROUPS & filters.Entity("mention"), ai.handle_group_mention
+            filters.ChatType.GROUPS & filters.Entity("mention"),
+            timed(ai.handle_group_mention),
         )
     )
 
     # 2. AI
     application.add_handler(
-        CommandHandler("ask", ai.ask_command, filters=TARGETED_OR_PRIVATE)
+        CommandHandler("ask", timed(ai.ask_command), filters=TARGETED_OR_PRIVATE)
     )
     application.add_handler(
-        CommandHandler("clear", ai.clear_command, filters=TARGETED_OR_PRIVATE)
+        CommandHandler("clear", timed(ai.clear_command), filters=TARGETED_OR_PRIVATE)
     )
 
     # 3. Video (Commented out by default)
     # application.add_handler(
-    #     CommandHandler("dl", video.dl_command, filters=TARGETED_OR_PRIVATE)
+    #     CommandHandler("dl", timed(video.dl_command), filters=TARGETED_OR_PRIVATE)
+    # )
+    # application.add_handler(
+    #     CallbackQueryHandler(video.cancel_download, pattern=f"^{video.CANCEL_PREFIX}")
     # )
 
     # 4. Translation
     application.add_handler(
         CommandHandler(
             "translate",
-            translate.translate_command,
+            timed(translate.translate_command),
             filters=TARGETED_OR_PRIVATE,
         )
     )
@@ -123,18 +144,20 @@ def register_handlers(application: Application) -> None:
     # 5. Audio / Voice
     application.add_handler(
         CommandHandler(
-            "transcribe", audio.transcribe_command, filters=TARGETED_OR_PRIVATE
+            "transcribe", timed(audio.transcribe_command), filters=TARGETED_OR_PRIVATE
         )
     )
     application.add_handler(
-        MessageHandler(filters.VOICE & filters.ChatType.PRIVATE, audio.handle_voice)
+        MessageHandler(
+            filters.VOICE & filters.ChatType.PRIVATE, timed(audio.handle_voice)
+        )
     )
 
     # 6. Private Text for AI
     application.add_handler(
         MessageHandler(
             filters.ChatType.PRIVATE & filters.TEXT & ~filters.COMMAND,
-            ai.handle_private_text,
+            timed(ai.handle_private_text),
         )
     )
 
@@ -162,24 +185,35 @@ async def setup_commands(application: Application) -> None:
     await application.bot.set_my_commands(BOT_COMMANDS)
 
 
+def build_application() -> Application:
+    """Builds the Telegram application (persistence and handlers) for either mode."""
+    storage_data = SQLitePersistence(
+        filepath=config.PERSISTENCE_PATH, migrate_from=config.LEGACY_PICKLE_PATH
+    )
+    builder = (
+        ApplicationBuilder()
+        .token(config.BOT_TOKEN)
+        .persistence(storage_data)
+        .post_init(setup_commands)
+    )
+    if config.TELEGRAM_API_URL:
+        builder = builder.base_url(f"{config.TELEGRAM_API_URL}/bot").base_file_url(
+            f"{config.TELEGRAM_API_URL}/file/bot"
+        )
+
+    application = builder.build()
+    register_handlers(application)
+    return application
+
+
 # --- 4. Lifespan Logic (for FastAPI) ---
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
-    storage_data = PicklePersistence(filepath="bot_data.pickle")
-
     # --- STARTUP ---
     logger.info("🚀 Starting Bot Application...")
-    ptb_app = (
-        ApplicationBuilder()
-        .token(config.BOT_TOKEN)
-        .persistence(storage_data)
-        .post_init(setup_commands)
-        .build()
-    )
-
-    register_handlers(ptb_app)
+    ptb_app = build_application()
 
     await ptb_app.initialize()
     await ptb_app.start()
@@ -191,55 +225,251 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
             url=webhook_url,
             secret_token=config.WEBHOOK_SECRET or None,
         )
+        if config.METRICS_ENABLED and not config.METRICS_TOKEN:
+            logger.warning("⚠️ METRICS_TOKEN is not set: /metrics is disabled.")
     else:
         await ptb_app.bot.delete_webhook()
 
+    dispatcher = UpdateDispatcher(
+        ptb_app,
+        workers=config.UPDATE_WORKERS,
+        max_size=config.UPDATE_QUEUE_SIZE,
+        policy=config.UPDATE_QUEUE_POLICY,
+    )
+    dispatcher.start()
+    if uses_local_engine():
+        local_engine.start()
+
     app.state.ptb_bot = ptb_app
+    app.state.dispatcher = dispatcher
 
     yield
 
     logger.info("🛑 Stopping Bot and closing connections...")
+    await dispatcher.stop(timeout=config.UPDATE_DRAIN_TIMEOUT)
     await app.state.ptb_bot.stop()
     await app.state.ptb_bot.shutdown()
 
     await llm_client.aclose()
     await groq_client.aclose()
+    await telegram_files_client.aclose()
     await video_client.aclose()
+    local_engine.shutdown()
+    audio_preprocessor.shutdown()
+    video_jobs.shutdown()
+    video_transcoder.shutdown()
+    tracing.tracer.shutdown()
 
 
 # --- 5. Initialize FastAPI ---
 app = FastAPI(lifespan=lifespan)
 
 
+def _dispatcher_depth() -> list[tuple[tuple[str, ...], float]]:
+    dispatcher: UpdateDispatcher | None = getattr(app.state, "dispatcher", None)
+    return [((), dispatcher.depth if dispatcher else 0)]
+
+
+def _pool_utilization() -> list[tuple[tuple[str, ...], float]]:
+    samples: list[tuple[tuple[str, ...], float]] = []
+    for name, client in (
+        ("llm", llm_client),
+        ("groq", groq_client),
+        ("telegram_files", telegram_files_client),
+        ("video", video_client),
+    ):
+        in_use, idle, waiting, max_connections = metrics.pool_stats(client)
+        samples += [
+            ((name, "in_use"), in_use),
+            ((name, "idle"), idle),
+            ((name, "waiting"), waiting),
+            ((name, "max"), max_connections),
+        ]
+    return samples
+
+
+def _limiter_state() -> list[tuple[tuple[str, ...], float]]:
+    samples: list[tuple[tuple[str, ...], float]] = []
+    for limiter in all_limiters():
+        samples += [
+            ((limiter.name, "in_flight"), limiter.in_flight),
+            ((limiter.name, "limit"), int(limiter.limit)),
+            ((limiter.name, "queued"), limiter.queue_depth),
+        ]
+    return samples
+
+
+def _local_stt_state() -> list[tuple[tuple[str, ...], float]]:
+    return [
+        (("pending",), local_engine.pending),
+        (("capacity",), local_engine.capacity),
+        (("completed",), local_engine.completed_total),
+        (("rejected",), local_engine.rejected_total),
+    ]
+
+
+def _video_job_state() -> list[tuple[tuple[str, ...], float]]:
+    return [
+        (("running",), video_jobs.running),
+        (("queued",), video_jobs.queued),
+        (("completed",), video_jobs.completed_total),
+        (("deduplicated",), video_jobs.deduplicated_total),
+        (("rejected",), video_jobs.rejected_total),
+    ]
+
+
+def _response_cache_state() -> list[tuple[tuple[str, ...], float]]:
+    return [((stat,), value) for stat, value in response_cache.stats().items()]
+
+
+def _breaker_state() -> list[tuple[tuple[str, ...], float]]:
+    codes = {CLOSED: 0, HALF_OPEN: 1}
+    return [
+        ((breaker.name,), codes.get(breaker.state, 2)) for breaker in all_breakers()
+    ]
+
+
+def _breaker_events() -> list[tuple[tuple[str, ...], float]]:
+    samples: list[tuple[tuple[str, ...], float]] = []
+    for breaker in all_breakers():
+        samples += [
+            ((breaker.name, "opened"), breaker.opened_total),
+            ((breaker.name, "rejected"), breaker.rejected_total),
+        ]
+    return samples
+
+
+def _router_state() -> list[tuple[tuple[str, ...], float]]:
+    samples: list[tuple[tuple[str, ...], float]] = []
+    for endpoint in router.stats():
+        samples += [
+            ((endpoint["name"], stat), value)
+            for stat, value in endpoint.items()
+            if stat != "name" and value is not None  # No latency before a call
+        ]
+    return samples
+
+
+metrics.Gauge(
+    "botgram_update_queue_depth",
+    "Webhook updates waiting for a worker.",
+    (),
+    _dispatcher_depth,
+)
+metrics.Gauge(
+    "botgram_processed_updates_cached",
+    "Update ids kept to drop duplicate webhook deliveries.",
+    (),
+    lambda: [((), len(processed_updates))],
+)
+metrics.Gauge(
+    "botgram_http_pool_connections",
+    "Connections of each HTTP client pool by state.",
+    ("client", "state"),
+    _pool_utilization,
+)
+metrics.Gauge(
+    "botgram_upstream_concurrency",
+    "Adaptive concurrency limiter of each upstream.",
+    ("upstream", "state"),
+    _limiter_state,
+)
+metrics.Gauge(
+    "botgram_local_transcription_jobs",
+    "Jobs of the local transcription engine (pending, capacity and running totals).",
+    ("state",),
+    _local_stt_state,
+)
+metrics.Gauge(
+    "botgram_video_jobs",
+    "Video downloads (running, queued and running totals).",
+    ("state",),
+    _video_job_state,
+)
+metrics.Gauge(
+    "botgram_llm_response_cache",
+    "LLM response cache size (entries, bytes) and running totals (hits, misses...).",
+    ("stat",),
+    _response_cache_state,
+)
+metrics.Gauge(
+    "botgram_circuit_state",
+    "Circuit breaker state (0 closed, 1 half-open, 2 open).",
+    ("upstream",),
+    _breaker_state,
+)
+metrics.Gauge(
+    "botgram_circuit_events",
+    "Running totals of circuit breaker openings and calls rejected while open.",
+    ("upstream", "event"),
+    _breaker_events,
+)
+metrics.Gauge(
+    "botgram_llm_endpoint",
+    "LLM router endpoints: latency and error EWMAs, requests and failures.",
+    ("endpoint", "stat"),
+    _router_state,
+)
+
+
 @app.api_route("/", methods=["GET", "HEAD"])
 async def health_check() -> dict[str, str]:
     return {"status": "ok", "bot": "active"}
 
 
+@app.get("/metrics")
+async def metrics_endpoint(authorization: str | None = Header(None)) -> Response:
+    if not config.METRICS_ENABLED or (
+        config.HOSTING == "production" and not config.METRICS_TOKEN
+    ):
+        return Response(status_code=404)
+    if config.METRICS_TOKEN and authorization != f"Bearer {config.METRICS_TOKEN}":
+        return Response(status_code=403, content="Forbidden")
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.post("/webhook")
 async def telegram_webhook(
     request: Request,
     x_telegram_bot_api_secret_token: str | None = Header(None),
 ) -> Response:
-    if config.WEBHOOK_SECRET and x_telegram_bot_api_secret_token != config.WEBHOOK_SECRET:
+    if (
+        config.WEBHOOK_SECRET
+        and x_telegram_bot_api_secret_token != config.WEBHOOK_SECRET
+    ):
         logger.warning("⚠️ Webhook request with invalid secret token rejected.")
         return Response(status_code=403, content="Forbidden")
 
-    ptb_bot: Application = request.app.state.ptb_bot
+    start = time.perf_counter()
+    try:
+        # Root of the update's trace; the dispatcher carries it to the worker
+        with tracing.span("webhook") as root:
+            ptb_bot: Application = request.app.state.ptb_bot
+            dispatcher: UpdateDispatcher = request.app.state.dispatcher
+
+            data: dict[str, Any] = await request.json()
+            update = Update.de_json(data, ptb_bot.bot)
 
-    data: dict[str, Any] = await request.json()
-    update = Update.de_json(data, ptb_bot.bot)
+            if not update:
+                return Response(status_code=400, content="Bad Request: Invalid Update")
+            if root:
+                root.set_attribute("update_id", update.update_id)
 
-    if not update:
-        return Response(status_code=400, content="Bad Request: Invalid Update")
+            if update.update_id in processed_updates:
+                logger.warning(f"⚠️ Update {update.update_id} duplicated.")
+                metrics.WEBHOOK_DUPLICATES.inc()
+                return Response(status_code=200)
 
-    if update.update_id in processed_updates:
-        logger.warning(f"⚠️ Update {update.update_id} duplicated.")
-        return Response(status_code=200)
+            # Acknowledge at once; the update is handled by the background workers
+            if not dispatcher.submit(update):
+                return Response(
+                    status_code=503, content="Service Unavailable: Queue full"
+                )
 
-    processed_updates[update.update_id] = True
-    await ptb_bot.process_update(update)
-    return Response(status_code=200)
+            processed_updates[update.update_id] = True
+            return Response(status_code=200)
+    finally:
+        metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - start)
 
 
 # --- 6. Entry Point for Polling (Classic Local Development) ---
@@ -248,24 +478,20 @@ def run_polling() -> None:
     Runs WITHOUT FastAPI, directly with the Telegram library.
     Ideal for local testing without configuring ngrok or ports.
     """
-    storage_data = PicklePersistence(filepath="bot_data.pickle")
-
     logger.info("Polling Mode: Starting...")
 
-    # Create a LOCAL instance
-    app_bot = (
-        ApplicationBuilder()
-        .token(config.BOT_TOKEN)
-        .persistence(storage_data)
-        .post_init(setup_commands)
-        .build()
-    )
-
-    # Use the SAME registration function
-    register_handlers(app_bot)
+    # Create a LOCAL instance, built the SAME way as in webhook mode
+    app_bot = build_application()
 
     logger.info("🤖 Bot listening... (Ctrl+C to stop)")
+    if uses_local_engine():
+        local_engine.start()
     app_bot.run_polling()
+    local_engine.shutdown()
+    audio_preprocessor.shutdown()
+    video_jobs.shutdown()
+    video_transcoder.shutdown()
+    tracing.tracer.shutdown()
 
 
 if __name__ == "__main__":
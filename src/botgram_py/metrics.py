@@ -0,0 +1,278 @@
+import bisect
+import functools
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Any, TypeVar
+
+import httpx
+
+from .tracing import span
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+# Seconds; covers fast Telegram calls up to slow transcriptions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class HistogramChild:
+    __slots__ = ("_bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...]
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: dict[LabelValues, Any] = {}
+        _registry.append(self)
+
+    def labels(self, *values: str) -> Any:
+        """
+        Returns the child for these label values. Resolve it once (at import or setup
+        time) and keep the reference, so the hot path never builds label tuples.
+        """
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._default = self.labels() if not labelnames else None
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        assert self._default is not None, "Counter has labels, use .labels()"
+        self._default.inc(amount)
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        for values, child in self._children.items():
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+        self._default = self.labels() if not labelnames else None
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        assert self._default is not None, "Histogram has labels, use .labels()"
+        self._default.observe(value)
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {child.sum}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+
+class Gauge(_Metric):
+    """Read at scrape time from `collect`, which yields (label values, value) pairs."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...],
+        collect: Callable[[], Iterable[tuple[LabelValues, float]]],
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._collect = collect
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        for values, value in self._collect():
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {value}"
+
+
+_registry: list[_Metric] = []
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- Application metrics ---
+
+WEBHOOK_SECONDS = Histogram(
+    "botgram_webhook_seconds", "Time to validate and enqueue a webhook update."
+)
+WEBHOOK_DUPLICATES = Counter(
+    "botgram_webhook_duplicate_updates_total",
+    "Webhook updates dropped because they were already processed.",
+)
+HANDLER_SECONDS = Histogram(
+    "botgram_handler_seconds", "Latency of each Telegram handler.", ("handler",)
+)
+HANDLER_ERRORS = Counter(
+    "botgram_handler_errors_total",
+    "Exceptions escaping each Telegram handler.",
+    ("handler",),
+)
+UPSTREAM_SECONDS = Histogram(
+    "botgram_upstream_seconds",
+    "Latency of upstream HTTP calls (LLM providers, Whisper, Cobalt) by status class.",
+    ("upstream", "status"),
+)
+UPSTREAM_QUEUE_WAIT_SECONDS = Histogram(
+    "botgram_upstream_queue_wait_seconds",
+    "Time calls waited for a slot of the upstream's concurrency limiter.",
+    ("upstream",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+UPSTREAM_REJECTED = Counter(
+    "botgram_upstream_rejected_total",
+    "Calls that gave up waiting for a slot of the upstream's concurrency limiter.",
+    ("upstream",),
+)
+PERSISTENCE_FLUSH_SECONDS = Histogram(
+    "botgram_persistence_flush_seconds",
+    "Time to commit one batch of persistence writes.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+def timed_handler(fn: F) -> F:
+    """
+    Records the latency (and escaping errors) of a handler under its function name,
+    inside a trace span of the same name.
+    """
+    latency = HANDLER_SECONDS.labels(fn.__name__)
+    errors = HANDLER_ERRORS.labels(fn.__name__)
+    span_name = f"handler {fn.__name__}"
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            with span(span_name):
+                return await fn(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - start)
+
+    return wrapper  # type: ignore[return-value]
+
+
+class UpstreamMetrics:
+    """Pre-bound latency histograms of one upstream, one per status class."""
+
+    __slots__ = ("_by_class", "_error")
+
+    def __init__(self, name: str) -> None:
+        self._by_class = [
+            UPSTREAM_SECONDS.labels(name, f"{status_class}xx")
+            for status_class in range(1, 6)
+        ]
+        self._error = UPSTREAM_SECONDS.labels(name, "error")
+
+    def observe(self, status_code: int | None, seconds: float) -> None:
+        """`status_code` None means the request failed without a response."""
+        if status_code is None or not 100 <= status_code < 600:
+            self._error.observe(seconds)
+        else:
+            self._by_class[status_code // 100 - 1].observe(seconds)
+
+
+_upstreams: dict[str, UpstreamMetrics] = {}
+
+
+def upstream(name: str) -> UpstreamMetrics:
+    metrics = _upstreams.get(name)
+    if metrics is None:
+        metrics = _upstreams[name] = UpstreamMetrics(name)
+    return metrics
+
+
+def pool_stats(client: httpx.AsyncClient) -> tuple[int, int, int, int]:
+    """
+    (connections in use, idle connections, requests waiting for a connection,
+    max connections) of a client's pool. httpx doesn't expose these publicly, so
+    this reads its transport internals and reports zeros if they change.
+    """
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", None) or [])
+    idle = sum(1 for connection in connections if connection.is_idle())
+    waiting = len(getattr(pool, "_requests", None) or []) - (len(connections) - idle)
+    max_connections = getattr(pool, "_max_connections", None) or 0
+    return len(connections) - idle, idle, max(0, waiting), max_connections
@@ -0,0 +1,385 @@
+import ast
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from .metrics import PERSISTENCE_FLUSH_SECONDS
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_data (
+    chat_id INTEGER NOT NULL,
+    key     TEXT    NOT NULL,
+    value   BLOB    NOT NULL,
+    PRIMARY KEY (chat_id, key)
+);
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    value   BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name  TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+CREATE TABLE IF NOT EXISTS kv (
+    name  TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+);
+"""
+
+# A staged write: (sql, params)
+_Write = tuple[str, tuple[Any, ...]]
+# A digest to record once its write is committed: (digests, key, digest or None
+# for a deleted key)
+_Saved = tuple[dict[Any, bytes], Any, bytes | None]
+ConversationKey = tuple[int | str, ...]
+
+
+def _dumps(value: Any) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+class _PickleFileUnpickler(pickle.Unpickler):
+    """Reads PicklePersistence files, ignoring persisted Bot references."""
+
+    def persistent_load(self, pid: object) -> None:
+        return None
+
+
+class SQLitePersistence(
+    BasePersistence[dict[Any, Any], dict[Any, Any], dict[Any, Any]]
+):
+    """
+    Incremental persistence backed by SQLite (WAL mode).
+
+    Unlike PicklePersistence, which rewrites every chat on each save, chat_data is
+    stored one row per key (e.g. one row per user's conversation in a chat) and only
+    keys whose content changed are written. Chat data is loaded lazily the first time
+    a chat is seen, and all database work runs on a dedicated thread so the event loop
+    is never blocked.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        migrate_from: str | None = None,
+        store_data: PersistenceInput | None = None,
+        update_interval: float = 60,
+    ) -> None:
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.filepath = filepath
+        self.migrate_from = migrate_from
+
+        # Single thread: serializes access to the connection and keeps writes ordered
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn: sqlite3.Connection | None = None
+        self._ready: asyncio.Future[None] | None = None
+
+        self._loaded_chats: set[int] = set()
+        # Digest of the last written value of each chat_data key, per chat
+        self._digests: dict[int, dict[str, bytes]] = {}
+        self._user_digests: dict[int, bytes] = {}
+
+        self._pending: list[_Write] = []
+        self._commit_task: asyncio.Task[None] | None = None
+
+    # --- Database plumbing (runs on the executor thread) ---
+
+    def _connect(self) -> None:
+        conn = sqlite3.connect(self.filepath, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        conn.commit()
+        self._conn = conn
+
+        if self.migrate_from and os.path.exists(self.migrate_from):
+            self._migrate_pickle(self.migrate_from)
+
+    def _migrate_pickle(self, path: str) -> None:
+        """One-shot import of an existing PicklePersistence file."""
+        assert self._conn is not None
+        if self._conn.execute("SELECT 1 FROM chat_data LIMIT 1").fetchone():
+            logger.warning(
+                "⚠️ SQLite store is not empty, skipping migration of %s.", path
+            )
+            return
+
+        with open(path, "rb") as f:
+            data: dict[str, Any] = _PickleFileUnpickler(f).load()
+
+        chat_rows = [
+            (chat_id, str(key), _dumps(value))
+            for chat_id, chat_data in (data.get("chat_data") or {}).items()
+            for key, value in chat_data.items()
+        ]
+        user_rows = [
+            (user_id, _dumps(user_data))
+            for user_id, user_data in (data.get("user_data") or {}).items()
+        ]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chat_data VALUES (?, ?, ?)", chat_rows
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO user_data VALUES (?, ?)", user_rows
+            )
+            for name in ("bot_data", "callback_data"):
+                if data.get(name) is not None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO kv VALUES (?, ?)",
+                        (name, _dumps(data[name])),
+                    )
+            for conv_name, states in (data.get("conversations") or {}).items():
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                    [(conv_name, repr(k), _dumps(v)) for k, v in states.items()],
+                )
+
+        os.replace(path, f"{path}.migrated")
+        logger.info(
+            "📦 Migrated %d chat rows and %d users from %s.",
+            len(chat_rows),
+            len(user_rows),
+            path,
+        )
+
+    def _fetchall(self, sql: str, params: tuple[Any, ...] = ()) -> list[Any]:
+        assert self._conn is not None
+        return self._conn.execute(sql, params).fetchall()
+
+    def _write_batch(self, writes: list[_Write]) -> None:
+        assert self._conn is not None
+        with self._conn:
+            for sql, params in writes:
+                self._conn.execute(sql, params)
+
+    async def _run(self, fn: Any, *args: Any) -> Any:
+        await self._ensure_ready()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, fn, *args
+        )
+
+    async def _ensure_ready(self) -> None:
+        if self._ready is None:
+            self._ready = asyncio.get_running_loop().run_in_executor(
+                self._executor, self._connect
+            )
+        await self._ready
+
+    # --- Write batching ---
+
+    async def _stage(self, writes: list[_Write], saved: Iterable[_Saved] = ()) -> None:
+        """
+        Queues writes and waits until they are committed in a shared transaction.
+        The `saved` digests are only recorded then: if the commit fails, the next
+        flush sees the values as changed and writes them again.
+        """
+        if not writes:
+            return
+        self._pending.extend(writes)
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.create_task(self._commit())
+        await asyncio.shield(self._commit_task)
+        for digests, key, digest in saved:
+            if digest is None:
+                digests.pop(key, None)
+            else:
+                digests[key] = digest
+
+    async def _commit(self) -> None:
+        # Let concurrent update_* calls (the Application gathers them) stage first
+        await asyncio.sleep(0)
+        while self._pending:
+            writes, self._pending = self._pending, []
+            start = time.perf_counter()
+            with span("persistence.commit", writes=len(writes)):
+                await self._run(self._write_batch, writes)
+            PERSISTENCE_FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    # --- Chat data ---
+
+    async def get_chat_data(self) -> dict[int, dict[Any, Any]]:
+        # Loaded lazily per chat in refresh_chat_data
+        await self._ensure_ready()
+        return {}
+
+    async def _load_chat(self, chat_id: int) -> dict[Any, Any]:
+        rows = await self._run(
+            self._fetchall,
+            "SELECT key, value FROM chat_data WHERE chat_id = ?",
+            (chat_id,),
+        )
+        data: dict[Any, Any] = {}
+        digests = self._digests.setdefault(chat_id, {})
+        for key, blob in rows:
+            data[key] = pickle.loads(blob)
+            digests[key] = _digest(blob)
+        self._loaded_chats.add(chat_id)
+        return data
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict[Any, Any]) -> None:
+        if chat_id in self._loaded_chats:
+            return
+        stored = await self._load_chat(chat_id)
+        for key, value in stored.items():
+            chat_data.setdefault(key, value)
+
+    async def update_chat_data(self, chat_id: int, data: dict[Any, Any]) -> None:
+        writes: list[_Write] = []
+        saved: list[_Saved] = []
+        seen: set[str] = set()
+        digests = self._digests.setdefault(chat_id, {})
+
+        for key, value in data.items():
+            key = str(key)
+            seen.add(key)
+            blob = _dumps(value)
+            digest = _digest(blob)
+            if digests.get(key) == digest:
+                continue
+            saved.append((digests, key, digest))
+            writes.append(
+                (
+                    "INSERT OR REPLACE INTO chat_data VALUES (?, ?, ?)",
+                    (chat_id, key, blob),
+                )
+            )
+
+        # Deletions are only safe when we know what the database holds for this chat
+        if chat_id in self._loaded_chats:
+            for key in [k for k in digests if k not in seen]:
+                saved.append((digests, key, None))
+                writes.append(
+                    (
+                        "DELETE FROM chat_data WHERE chat_id = ? AND key = ?",
+                        (chat_id, key),
+                    )
+                )
+
+        await self._stage(writes, saved)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._digests.pop(chat_id, None)
+        self._loaded_chats.discard(chat_id)
+        await self._stage([("DELETE FROM chat_data WHERE chat_id = ?", (chat_id,))])
+
+    # --- User data ---
+
+    async def get_user_data(self) -> dict[int, dict[Any, Any]]:
+        rows = await self._run(self._fetchall, "SELECT user_id, value FROM user_data")
+        user_data: dict[int, dict[Any, Any]] = {}
+        for user_id, blob in rows:
+            user_data[user_id] = pickle.loads(blob)
+            self._user_digests[user_id] = _digest(blob)
+        return user_data
+
+    async def update_user_data(self, user_id: int, data: dict[Any, Any]) -> None:
+        blob = _dumps(data)
+        digest = _digest(blob)
+        if self._user_digests.get(user_id) == digest:
+            return
+        await self._stage(
+            [("INSERT OR REPLACE INTO user_data VALUES (?, ?)", (user_id, blob))],
+            [(self._user_digests, user_id, digest)],
+        )
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._user_digests.pop(user_id, None)
+        await self._stage([("DELETE FROM user_data WHERE user_id = ?", (user_id,))])
+
+    async def refresh_user_data(self, user_id: int, user_data: dict[Any, Any]) -> None:
+        pass
+
+    # --- Bot data, callback data and conversations ---
+
+    async def _get_kv(self, name: str) -> Any:
+        rows = await self._run(
+            self._fetchall, "SELECT value FROM kv WHERE name = ?", (name,)
+        )
+        return pickle.loads(rows[0][0]) if rows else None
+
+    async def _set_kv(self, name: str, value: Any) -> None:
+        await self._stage(
+            [("INSERT OR REPLACE INTO kv VALUES (?, ?)", (name, _dumps(value)))]
+        )
+
+    async def get_bot_data(self) -> dict[Any, Any]:
+        return await self._get_kv("bot_data") or {}
+
+    async def update_bot_data(self, data: dict[Any, Any]) -> None:
+        await self._set_kv("bot_data", data)
+
+    async def refresh_bot_data(self, bot_data: dict[Any, Any]) -> None:
+        pass
+
+    async def get_callback_data(self) -> Any:
+        return await self._get_kv("callback_data")
+
+    async def update_callback_data(self, data: Any) -> None:
+        await self._set_kv("callback_data", data)
+
+    async def get_conversations(self, name: str) -> dict[ConversationKey, object]:
+        rows = await self._run(
+            self._fetchall,
+            "SELECT key, state FROM conversations WHERE name = ?",
+            (name,),
+        )
+        return {
+            _parse_conversation_key(key): pickle.loads(state) for key, state in rows
+        }
+
+    async def update_conversation(
+        self, name: str, key: ConversationKey, new_state: object | None
+    ) -> None:
+        if new_state is None:
+            await self._stage(
+                [
+                    (
+                        "DELETE FROM conversations WHERE name = ? AND key = ?",
+                        (name, repr(key)),
+                    )
+                ]
+            )
+            return
+        await self._stage(
+            [
+                (
+                    "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                    (name, repr(key), _dumps(new_state)),
+                )
+            ]
+        )
+
+    async def flush(self) -> None:
+        if self._commit_task is not None:
+            await self._commit_task
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._conn.close
+            )
+            self._conn = None
+            self._ready = None
+        self._executor.shutdown(wait=False)
+
+
+def _parse_conversation_key(key: str) -> ConversationKey:
+    """Conversation keys are tuples of ints/strs, stored with repr()."""
+    return tuple(ast.literal_eval(key))
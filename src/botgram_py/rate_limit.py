@@ -0,0 +1,184 @@
+import logging
+import time
+
+from cachetools import TTLCache
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from . import config
+from .custom_filters import TARGETED_OR_PRIVATE
+
+logger = logging.getLogger(__name__)
+
+# Command classes with their own limits
+LLM = "llm"
+TRANSCRIPTION = "transcription"
+VIDEO = "video"
+
+_COMMAND_CLASSES: dict[str, str] = {
+    "ask": LLM,
+    "translate": LLM,
+    "transcribe": TRANSCRIPTION,
+    "dl": VIDEO,
+}
+
+# Key -> [tokens, last refill timestamp]
+_Bucket = list[float]
+
+
+class RateLimiter:
+    """
+    Token-bucket limits per user for each command class, a shared bucket per
+    group chat, plus a cap on requests a single user can have in progress at once.
+
+    Memory is O(1) per active user: buckets idle for `idle_ttl` seconds are evicted,
+    which is harmless because an idle bucket would be full again anyway. In-flight
+    slots expire after `inflight_ttl` seconds, so one never released (its update
+    was cancelled mid-processing) can't lock a user out for good.
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, tuple[int, float]],
+        chat_limit: tuple[int, float],
+        max_inflight: int,
+        notice_interval: float,
+        idle_ttl: float = 600,
+        inflight_ttl: float = 600,
+        max_keys: int = 100_000,
+    ) -> None:
+        self.limits = limits
+        self.chat_limit = chat_limit
+        self.max_inflight = max_inflight
+        self.notice_interval = notice_interval
+
+        self._buckets: TTLCache[tuple[str, int], _Bucket] = TTLCache(max_keys, idle_ttl)
+        self._notices: TTLCache[int, float] = TTLCache(max_keys, notice_interval)
+        self._inflight: TTLCache[int, int] = TTLCache(max_keys, inflight_ttl)
+        # update_id -> user_id, for the updates currently holding an in-flight slot
+        self._holders: TTLCache[int, int] = TTLCache(max_keys, inflight_ttl)
+
+    def _refilled(
+        self, key: tuple[str, int], limit: tuple[int, float], now: float
+    ) -> _Bucket:
+        capacity, period = limit
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return [float(capacity), now]
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * capacity / period)
+        return [tokens, now]
+
+    def try_acquire(
+        self, kind: str, update_id: int, user_id: int, chat_id: int | None
+    ) -> bool:
+        """Consumes one token from every applicable bucket, or none if any is empty."""
+        if self._inflight.get(user_id, 0) >= self.max_inflight:
+            return False
+
+        now = time.monotonic()
+        checks = [((kind, user_id), self.limits[kind])]
+        if chat_id is not None:
+            # Groups also share one bucket across all command classes
+            checks.append((("chat", chat_id), self.chat_limit))
+
+        buckets = [(key, self._refilled(key, limit, now)) for key, limit in checks]
+        if any(bucket[0] < 1 for _, bucket in buckets):
+            return False
+
+        for key, bucket in buckets:
+            bucket[0] -= 1
+            self._buckets[key] = bucket
+
+        self._inflight[user_id] = self._inflight.get(user_id, 0) + 1
+        self._holders[update_id] = user_id
+        return True
+
+    def release(self, update_id: int) -> None:
+        user_id = self._holders.pop(update_id, None)
+        if user_id is None:
+            return
+        remaining = self._inflight.get(user_id, 1) - 1
+        if remaining > 0:
+            self._inflight[user_id] = remaining
+        else:
+            self._inflight.pop(user_id, None)
+
+    def should_notify(self, user_id: int) -> bool:
+        """The "slow down" notice itself is sent at most once per notice interval."""
+        if user_id in self._notices:
+            return False
+        self._notices[user_id] = time.monotonic()
+        return True
+
+
+def classify(update: Update, bot_username: str | None) -> str | None:
+    """Returns the command class an update will be handled as, or None if it is free."""
+    message = update.message
+    if not message or not update.effective_chat:
+        return None
+
+    is_private = update.effective_chat.type == "private"
+
+    if message.voice:
+        return TRANSCRIPTION if is_private else None
+
+    text = message.text or ""
+    if text.startswith("/"):
+        if not TARGETED_OR_PRIVATE.check_update(update):
+            return None
+        command = text.split()[0][1:].split("@")[0].lower()
+        return _COMMAND_CLASSES.get(command)
+
+    if is_private and text:
+        return LLM
+    if bot_username and f"@{bot_username}" in text:
+        return LLM
+    return None
+
+
+rate_limiter = RateLimiter(
+    limits={
+        LLM: config.RATE_LIMIT_LLM,
+        TRANSCRIPTION: config.RATE_LIMIT_TRANSCRIPTION,
+        VIDEO: config.RATE_LIMIT_VIDEO,
+    },
+    chat_limit=config.RATE_LIMIT_CHAT,
+    max_inflight=config.MAX_INFLIGHT_PER_USER,
+    notice_interval=config.RATE_LIMIT_NOTICE_INTERVAL,
+)
+
+
+async def enforce_rate_limits(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """
+    Pre-filter (runs in a handler group before the real handlers).
+    Stops the update if the user or the group is over its limits.
+    """
+    if not update.effective_user:
+        return
+
+    kind = classify(update, context.bot.username)
+    if kind is None:
+        return
+
+    chat = update.effective_chat
+    chat_id = chat.id if chat and chat.type != "private" else None
+    user_id = update.effective_user.id
+
+    if rate_limiter.try_acquire(kind, update.update_id, user_id, chat_id):
+        return
+
+    logger.info("🐢 Rate limited user %s (%s).", user_id, kind)
+    if update.message and rate_limiter.should_notify(user_id):
+        await update.message.reply_text(
+            "🐢 You're sending requests too fast. Please wait a moment and try again."
+        )
+    raise ApplicationHandlerStop
+
+
+async def release_rate_limits(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Post-filter (runs in the last handler group): frees the in-flight slot."""
+    rate_limiter.release(update.update_id)
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, suppress
+
+from .. import config, metrics
+from .multipart import iter_path
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = shutil.which("ffmpeg")
+
+SAMPLE_RATE = 16000
+BYTES_PER_MS = SAMPLE_RATE * 2 // 1000  # Mono, 16-bit
+
+PREPROCESS_BYTES = metrics.Counter(
+    "botgram_audio_preprocess_bytes_total",
+    "Audio bytes before and after preprocessing.",
+    ("stage",),
+)
+PREPROCESS_SECONDS = metrics.Counter(
+    "botgram_audio_preprocess_audio_seconds_total",
+    "Seconds of audio before and after silence trimming.",
+    ("stage",),
+)
+_bytes_in, _bytes_out = PREPROCESS_BYTES.labels("in"), PREPROCESS_BYTES.labels("out")
+_seconds_in = PREPROCESS_SECONDS.labels("in")
+_seconds_out = PREPROCESS_SECONDS.labels("out")
+
+
+async def spool(audio: bytes | AsyncIterator[bytes], suffix: str) -> str:
+    """Writes the audio to a temporary file and returns its path."""
+    fd, path = tempfile.mkstemp(prefix="audio-", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(audio, bytes):
+                await asyncio.to_thread(f.write, audio)
+            else:
+                async for chunk in audio:
+                    await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def _preprocess_file(
+    ffmpeg: str,
+    src: str,
+    dst: str,
+    bitrate: str,
+    min_silence_ms: int,
+    keep_silence_ms: int,
+    threshold_db: float,
+) -> tuple[float, float]:
+    """
+    Runs in a worker process: decodes `src` straight to mono 16 kHz PCM, cuts the
+    silences and encodes the rest to Opus in `dst`. Returns the audio seconds
+    before and after trimming.
+    """
+    from pydub import AudioSegment
+    from pydub.silence import detect_nonsilent
+
+    pcm = subprocess.run(
+        [ffmpeg, "-nostdin", "-v", "error", "-i", src]
+        + ["-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"],
+        capture_output=True,
+        check=True,
+    ).stdout
+    audio = AudioSegment(data=pcm, sample_width=2, frame_rate=SAMPLE_RATE, channels=1)
+
+    # Loudness relative to the note itself, so quiet recordings aren't cut away
+    ranges = detect_nonsilent(
+        audio,
+        min_silence_len=min_silence_ms,
+        silence_thresh=audio.dBFS - threshold_db,
+        seek_step=10,
+    )
+    if ranges:
+        keep = keep_silence_ms
+        speech = b"".join(
+            pcm[max(0, start - keep) * BYTES_PER_MS : (end + keep) * BYTES_PER_MS]
+            for start, end in ranges
+        )
+    else:
+        speech = pcm  # Nothing stands out: leave it to Whisper
+
+    subprocess.run(
+        [ffmpeg, "-nostdin", "-v", "error", "-y"]
+        + ["-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "-"]
+        + ["-c:a", "libopus", "-b:a", bitrate, "-application", "voip"]
+        # Lowest encoder complexity: several times faster, and speech at these
+        # bitrates gains little from the slower modes
+        + ["-compression_level", "0", dst],
+        input=speech,
+        capture_output=True,
+        check=True,
+    )
+    return len(pcm) / BYTES_PER_MS / 1000, len(speech) / BYTES_PER_MS / 1000
+
+
+class PreparedAudio:
+    """An audio file ready to upload (preprocessed, or the original as a fallback)."""
+
+    def __init__(self, path: str, filename: str, content_type: str) -> None:
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.filename = filename
+        self.content_type = content_type
+
+    def chunks(self, chunk_size: int) -> AsyncIterator[bytes]:
+        return iter_path(self.path, chunk_size)
+
+
+class AudioPreprocessor:
+    """
+    Shrinks audio before it is uploaded: silences longer than `min_silence_ms` are
+    cut down to `keep_silence_ms` on each side of speech, and what remains is
+    re-encoded as mono 16 kHz Opus. Runs in a pool of worker processes, off the
+    event loop. Any failure falls back to the original audio.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        bitrate: str,
+        min_silence_ms: int,
+        keep_silence_ms: int,
+        threshold_db: float,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.bitrate = bitrate
+        self.min_silence_ms = min_silence_ms
+        # More than half of a gap on each side would repeat audio
+        self.keep_silence_ms = min(keep_silence_ms, min_silence_ms // 2)
+        self.threshold_db = threshold_db
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def available(self) -> bool:
+        return FFMPEG is not None
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @asynccontextmanager
+    async def prepared(
+        self,
+        audio: bytes | AsyncIterator[bytes],
+        filename: str,
+        content_type: str,
+    ) -> AsyncIterator[PreparedAudio]:
+        """Yields the file to upload; temporary files are removed on exit."""
+        src = await spool(audio, os.path.splitext(filename)[1])
+        dst = f"{src}.opus.ogg"
+        try:
+            original = PreparedAudio(src, filename, content_type)
+            result = original
+            try:
+                result = await self._run(src, dst, original.size) or original
+            except (OSError, subprocess.SubprocessError, BrokenProcessPool) as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._executor = None
+                stderr = getattr(e, "stderr", b"") or b""
+                logger.warning(
+                    "Audio preprocessing failed, uploading the original: %s %s",
+                    e,
+                    stderr.decode(errors="replace")[-300:],
+                )
+            yield result
+        finally:
+            for path in (src, dst):
+                with suppress(FileNotFoundError):
+                    os.unlink(path)
+
+    async def _run(
+        self, src: str, dst: str, original_size: int
+    ) -> PreparedAudio | None:
+        """The preprocessed file, or None when it isn't smaller than the original."""
+        assert FFMPEG is not None
+        loop = asyncio.get_running_loop()
+        seconds_before, seconds_after = await loop.run_in_executor(
+            self._get_executor(),
+            _preprocess_file,
+            FFMPEG,
+            src,
+            dst,
+            self.bitrate,
+            self.min_silence_ms,
+            self.keep_silence_ms,
+            self.threshold_db,
+        )
+        processed = PreparedAudio(dst, "audio.ogg", "audio/ogg")
+        _bytes_in.inc(original_size)
+        _seconds_in.inc(seconds_before)
+        _seconds_out.inc(seconds_after)
+        if processed.size >= original_size:
+            # Already compact (e.g. a short Opus note without pauses)
+            _bytes_out.inc(original_size)
+            return None
+        _bytes_out.inc(processed.size)
+        logger.info(
+            "🎚️ Audio preprocessed: %.1fs -> %.1fs, %d -> %d bytes.",
+            seconds_before,
+            seconds_after,
+            original_size,
+            processed.size,
+        )
+        return processed
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+
+audio_preprocessor = AudioPreprocessor(
+    workers=config.AUDIO_PREPROCESS_WORKERS,
+    bitrate=config.AUDIO_PREPROCESS_BITRATE,
+    min_silence_ms=config.AUDIO_MIN_SILENCE_MS,
+    keep_silence_ms=config.AUDIO_KEEP_SILENCE_MS,
+    threshold_db=config.AUDIO_SILENCE_THRESHOLD_DB,
+)
+
+if config.AUDIO_PREPROCESS and FFMPEG is None:
+    logger.warning(
+        "⚠️ AUDIO_PREPROCESS is on but ffmpeg wasn't found; audio is sent as-is."
+    )
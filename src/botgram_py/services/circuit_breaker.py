@@ -0,0 +1,158 @@
+import logging
+import time
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+
+import httpx
+
+from .. import config
+from .retry import is_retryable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(ConnectionError):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Whether an error means the upstream is unhealthy (network errors, timeouts,
+    429/5xx), also when it was re-raised as a user-facing ConnectionError.
+    Client errors such as 400/401 say nothing about the upstream's health.
+    """
+    cause = error.__cause__ if error.__cause__ is not None else error
+    if isinstance(cause, httpx.HTTPError):
+        return is_retryable(cause)
+    return isinstance(cause, TimeoutError)
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through and consecutive failures are counted. After
+    `failure_threshold` of them the circuit opens and calls fail fast with
+    CircuitOpen for `recovery_timeout` seconds. Then it goes half-open and lets
+    `half_open_max_calls` trial calls through: if that many succeed it closes
+    again, while any failure opens it for another round.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        recovery_timeout: float,
+        half_open_max_calls: int = 1,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._trial_successes = 0
+
+        # Metrics
+        self.opened_total = 0
+        self.rejected_total = 0
+
+    @property
+    def state(self) -> str:
+        if (
+            self._state == OPEN
+            and time.monotonic() - self._opened_at >= self.recovery_timeout
+        ):
+            self._state = HALF_OPEN
+            self._trials = 0
+            self._trial_successes = 0
+            logger.info("🔌 %s circuit half-open, probing recovery.", self.name)
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a call would be let through right now (doesn't take a trial slot)."""
+        state = self.state
+        if state == OPEN:
+            return False
+        return state == CLOSED or self._trials < self.half_open_max_calls
+
+    @asynccontextmanager
+    async def guard(
+        self, is_failure: Callable[[BaseException], bool] = is_upstream_failure
+    ) -> AsyncIterator[None]:
+        """
+        Wraps one call to the upstream. Finishing normally counts as a success and
+        exceptions matching `is_failure` as failures; anything else is ignored.
+        """
+        if not self.allow():
+            self.rejected_total += 1
+            raise CircuitOpen("❌ Service temporarily unavailable, try again later.")
+
+        trial = self._state == HALF_OPEN
+        if trial:
+            self._trials += 1
+        try:
+            yield
+        except Exception as e:
+            if is_failure(e):
+                self.record_failure()
+            raise
+        else:
+            self.record_success()
+        finally:
+            if trial and self._state == HALF_OPEN:
+                self._trials = max(0, self._trials - 1)
+
+    def record_success(self) -> None:
+        if self._state == HALF_OPEN:
+            self._trial_successes += 1
+            if self._trial_successes >= self.half_open_max_calls:
+                self._state = CLOSED
+                self._failures = 0
+                logger.info("✅ %s circuit closed again.", self.name)
+        else:
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        if self._state == HALF_OPEN:
+            self._open()
+            return
+        self._failures += 1
+        if self._state == CLOSED and self._failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self.opened_total += 1
+        logger.warning(
+            "🔌 %s circuit open for %.0fs after repeated failures.",
+            self.name,
+            self.recovery_timeout,
+        )
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Returns the shared breaker of an upstream (e.g. "llm:groq:<model>", "whisper")."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            name,
+            failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+            recovery_timeout=config.CIRCUIT_RECOVERY_TIMEOUT,
+            half_open_max_calls=config.CIRCUIT_HALF_OPEN_CALLS,
+        )
+        _breakers[name] = breaker
+    return breaker
+
+
+def all_breakers() -> list[CircuitBreaker]:
+    return list(_breakers.values())
@@ -0,0 +1,43 @@
+from typing import Any
+
+from cachetools import LRUCache
+
+from .tokens import MESSAGE_OVERHEAD, TokenEstimator
+
+# (estimator name, role, content) -> tokens. Strings kept in chat_data are the same
+# objects between requests, so lookups reuse their cached hash: only new messages
+# are actually counted.
+_token_counts: LRUCache[tuple[str, str, str], int] = LRUCache(maxsize=50_000)
+
+
+def message_tokens(message: dict[str, Any], estimator: TokenEstimator) -> int:
+    key = (estimator.name, message["role"], message["content"])
+    tokens = _token_counts.get(key)
+    if tokens is None:
+        tokens = estimator.count(message["content"]) + MESSAGE_OVERHEAD
+        _token_counts[key] = tokens
+    return tokens
+
+
+def trim_to_budget(
+    conversation: list[dict[str, Any]],
+    budget: int,
+    estimator: TokenEstimator,
+    max_messages: int | None = None,
+) -> list[dict[str, Any]]:
+    """
+    Keeps the newest messages whose combined size fits `budget` tokens.
+    The latest message is always kept, even if it alone exceeds the budget.
+    """
+    total = 0
+    start = len(conversation)
+    lowest = 0 if max_messages is None else max(0, len(conversation) - max_messages)
+
+    while start > lowest:
+        tokens = message_tokens(conversation[start - 1], estimator)
+        if total + tokens > budget and start < len(conversation):
+            break
+        total += tokens
+        start -= 1
+
+    return conversation if start == 0 else conversation[start:]
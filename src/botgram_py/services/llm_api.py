@@ -1,12 +1,29 @@
+import asyncio
 import logging
+import time
+from collections.abc import AsyncIterator
 from typing import Any
 
 import httpx
 from httpx import HTTPStatusError, RequestError
 
-logger = logging.getLogger(__name__)
+from .. import config, metrics
+from .circuit_breaker import CircuitBreaker, get_breaker
+from .providers import MessageList, ProviderAdapter, get_adapter, loads, system_prompt
+from .response_cache import make_key, response_cache
+from .retry import (
+    LatencyTracker,
+    RetryPolicy,
+    call_with_retry,
+    describe_error,
+    hedged,
+    is_retryable,
+    retry_delay,
+)
+from .singleflight import SingleFlight
+from .upstream_limits import get_limiter, is_overload_status
 
-MessageList = list[dict[str, Any]]
+logger = logging.getLogger(__name__)
 
 # CONNECTION POOLING: Reusable global client with explicit limits
 http_client = httpx.AsyncClient(
@@ -14,123 +31,53 @@ http_client = httpx.AsyncClient(
     limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
 )
 
+# Cacheable (idempotent) requests in progress, keyed like the response cache
+_inflight: SingleFlight[str] = SingleFlight()
 
-def is_missing_env(*args: Any) -> bool:
-    return any(arg is None for arg in args)
+_retry_policy = RetryPolicy(
+    max_attempts=config.LLM_RETRY_ATTEMPTS,
+    base_delay=config.LLM_RETRY_BASE_DELAY,
+    max_delay=config.LLM_RETRY_MAX_DELAY,
+    deadline=config.LLM_REQUEST_DEADLINE,
+)
+# Recent successful request latencies per LLM endpoint (drives the hedging delay)
+_latencies: dict[str, LatencyTracker] = {}
 
 
-def _format_messages(
-    messages: MessageList, provider: str, system_message: str | None
-) -> MessageList:
-    """It only handles injecting the system prompt according to the provider."""
-    final_messages = list(messages)
+def is_missing_env(*args: Any) -> bool:
+    # Empty strings too: the router fills unset settings with ""
+    return any(not arg for arg in args)
 
-    if not system_message:
-        return final_messages
 
-    if provider.lower() == "google":
-        if final_messages and final_messages[-1]["role"] == "user":
-            last_msg = final_messages[-1].copy()
-            last_msg["content"] = (
-                f"System Instructions: {system_message}\n\nUser Query: {last_msg['content']}"
-            )
-            final_messages[-1] = last_msg
-        else:
-            final_messages.insert(
-                0, {"role": "user", "content": f"System Instructions: {system_message}"}
-            )
-    else:
-        final_messages.insert(0, {"role": "system", "content": system_message})
-
-    return final_messages
+def parse_stream_chunk(chunk: dict[str, Any], provider: str) -> str:
+    """Extracts the text delta from a single streamed (SSE) event."""
+    try:
+        if provider.lower() == "google":
+            parts = chunk["candidates"][0]["content"].get("parts", [])
+            return "".join(part.get("text", "") for part in parts)
+        choices = chunk.get("choices") or []
+        if not choices:
+            return ""
+        return choices[0].get("delta", {}).get("content") or ""
+    except (KeyError, IndexError, TypeError):
+        return ""
 
 
-def _get_provider_config(
-    provider: str,
-    final_messages: MessageList,
-    api_token: str,
-    llm_model: str,
-    max_tokens: int,
-) -> dict[str, Any]:
-    """It only handles building the JSON for the API."""
-    configs: dict[str, dict[str, Any]] = {
-        "openai": {
-            "headers": {
-                "Authorization": f"Bearer {api_token}",
-                "Content-Type": "application/json",
-            },
-            "data": {
-                "model": llm_model,
-                "messages": final_messages,
-                "max_tokens": max_tokens,
-            },
-        },
-        "google": {
-            "headers": {"Content-Type": "application/json"},
-            "data": {
-                "contents": [
-                    {
-                        "role": (
-                            "user" if msg["role"] in ["system", "user"] else "model"
-                        ),
-                        "parts": [{"text": msg["content"]}],
-                    }
-                    for msg in final_messages
-                ],
-                "generationConfig": {
-                    "maxOutputTokens": max_tokens,
-                    "temperature": 0.9,
-                    "topP": 1,
-                },
-            },
-        },
-        "deepseek": {
-            "headers": {
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "Authorization": f"Bearer {api_token}",
-            },
-            "data": {
-                "messages": final_messages,
-                "model": llm_model,
-                "max_tokens": max_tokens,
-                "temperature": 0.7,
-                "stream": False,
-            },
-        },
-        "groq": {
-            "headers": {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_token}",
-            },
-            "data": {
-                "model": llm_model,
-                "messages": final_messages,
-                "temperature": 0.5,
-                "stream": False,
-                "max_completion_tokens": max_tokens,
-                "reasoning_effort": "medium",
-            },
-        },
-        "nvidia": {
-            "headers": {
-                "Authorization": f"Bearer {api_token}",
-                "Content-Type": "application/json",
-            },
-            "data": {
-                "model": llm_model,
-                "messages": final_messages,
-                "max_tokens": max_tokens,
-                "temperature": 0.7,
-                "stream": False,
-            },
-        },
-    }
-
-    if provider.lower() not in configs:
-        raise KeyError(f"❌ Unsupported provider: {provider}")
-
-    return configs[provider.lower()]
+def _to_connection_error(e: HTTPStatusError) -> ConnectionError:
+    """Maps an HTTP error from the provider to a user-facing ConnectionError."""
+    status_code = e.response.status_code
+    error_message = {
+        401: "❌ Authentication failed: Invalid API token",
+        429: "❌ Rate limit exceeded",
+    }.get(
+        status_code,
+        (
+            "❌ Service temporarily unavailable."
+            if status_code >= 500
+            else f"API request failed ({status_code})"
+        ),
+    )
+    return ConnectionError(error_message)
 
 
 def parse_response(response: dict[str, Any], provider: str) -> str:
@@ -165,44 +112,253 @@ async def get_api_llm(
     PROVIDER: str,
     MAX_OUTPUT_TOKENS: int = 1024,
     system_message: str | None = None,
+    summary: str | None = None,
+    use_cache: bool = False,
+    idempotent: bool = False,
+    deadline: float | None = None,
 ) -> str:
-    """Main function (Orchestrator). Now it is super clean and easy to read."""
+    """
+    Main function (Orchestrator). With `use_cache`, identical requests are answered
+    from the response cache and concurrent ones are coalesced into a single call;
+    only enable it for stateless prompts. `idempotent` requests may be hedged.
+    `deadline` (a time.monotonic() value) overrides LLM_REQUEST_DEADLINE.
+    """
     if is_missing_env(API_TOKEN, API_URL, LLM_MODEL, PROVIDER):
         raise ValueError("Missing some value of a key in .env. Please check it.")
 
     # 1. Format
-    final_messages = _format_messages(messages, PROVIDER, system_message)
+    adapter = get_adapter(PROVIDER, API_URL, API_TOKEN, LLM_MODEL)
+    system = system_prompt(system_message, summary)
 
-    # 2. Configure
-    config_req = _get_provider_config(
-        PROVIDER, final_messages, API_TOKEN, LLM_MODEL, MAX_OUTPUT_TOKENS
-    )
+    if not use_cache:
+        return await _request_completion(
+            adapter, PROVIDER, messages, system, MAX_OUTPUT_TOKENS, idempotent, deadline
+        )
 
-    # 3. Execute petition
-    try:
-        response = await http_client.post(
-            API_URL, json=config_req["data"], headers=config_req["headers"]
+    cache_key = make_key(PROVIDER, LLM_MODEL, system, messages, MAX_OUTPUT_TOKENS)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        logger.info("♻️ LLM response cache hit: %s", response_cache.stats())
+        return cached
+
+    async def complete_and_cache() -> str:
+        text = await _request_completion(
+            adapter, PROVIDER, messages, system, MAX_OUTPUT_TOKENS, idempotent, deadline
         )
+        response_cache.set(cache_key, text)
+        return text
+
+    # Identical requests already in progress share a single upstream call
+    return await _inflight.do(cache_key, complete_and_cache)
+
+
+def endpoint_key(provider: str, llm_model: str) -> str:
+    """One provider/model endpoint: keys its breaker, limiter and latencies."""
+    return f"llm:{provider.lower()}:{llm_model}"
+
+
+def llm_breaker(provider: str, llm_model: str) -> CircuitBreaker:
+    """Circuit breaker of one provider/model endpoint."""
+    return get_breaker(endpoint_key(provider, llm_model))
+
+
+def _latency_tracker(key: str) -> LatencyTracker:
+    tracker = _latencies.get(key)
+    if tracker is None:
+        tracker = _latencies[key] = LatencyTracker()
+    return tracker
+
+
+async def _request_completion(
+    adapter: ProviderAdapter,
+    provider: str,
+    messages: MessageList,
+    system: str | None,
+    max_tokens: int,
+    idempotent: bool = False,
+    deadline: float | None = None,
+) -> str:
+    """
+    Sends a completion request and returns the generated text. Transient failures
+    are retried within the request deadline; idempotent requests are hedged with a
+    second attempt once the first is slower than the endpoint's p95 latency.
+    Fails fast with CircuitOpen while the endpoint's circuit is open.
+    """
+    # 2. Serialize (once, shared by retries and hedged attempts)
+    body = adapter.build_body(messages, system, max_tokens)
+    key = endpoint_key(provider, adapter.model)
+    limiter = get_limiter(key)
+    latencies = _latency_tracker(key)
+    upstream_metrics = metrics.upstream(provider.lower())
+
+    async def attempt() -> str:
+        # 3. Execute petition (waiting for a free slot of this endpoint)
+        async with limiter.slot():
+            start = time.monotonic()
+            try:
+                response = await http_client.post(
+                    adapter.url, content=body, headers=adapter.headers
+                )
+            except RequestError:
+                upstream_metrics.observe(None, time.monotonic() - start)
+                limiter.record(overloaded=True)
+                raise
+            elapsed = time.monotonic() - start
+            upstream_metrics.observe(response.status_code, elapsed)
+            limiter.record(overloaded=is_overload_status(response.status_code))
+
         response.raise_for_status()
-        return parse_response(response.json(), PROVIDER)
+        latencies.record(elapsed)
+        return parse_response(loads(response.content), provider)
 
-    except HTTPStatusError as e:
-        status_code = e.response.status_code
-        error_message = {
-            401: "❌ Authentication failed: Invalid API token",
-            429: "❌ Rate limit exceeded",
-        }.get(
-            status_code,
-            (
-                "❌ Service temporarily unavailable."
-                if status_code >= 500
-                else f"API request failed ({status_code})"
-            ),
-        )
+    async def attempt_maybe_hedged() -> str:
+        # Never hedge while requests are already queueing for this endpoint
+        if not (idempotent and config.LLM_HEDGING and limiter.queue_depth == 0):
+            return await attempt()
+        delay = latencies.percentile(0.95) or config.LLM_HEDGE_DELAY
+        return await hedged(attempt, delay)
 
-        logger.error("API Error %s: %s", status_code, e.response.text)
-        raise ConnectionError(error_message) from e
+    try:
+        async with llm_breaker(provider, adapter.model).guard():
+            return await call_with_retry(
+                attempt_maybe_hedged,
+                _retry_policy,
+                name=f"LLM {provider}",
+                deadline=deadline,
+            )
+
+    except HTTPStatusError as e:
+        logger.error("API Error %s: %s", e.response.status_code, e.response.text)
+        raise _to_connection_error(e) from e
 
     except RequestError as e:
         logger.error("Connection error on API LLM %s", str(e))
         raise ConnectionError("❌ Network connection failed") from e
+
+
+async def stream_api_llm(
+    messages: MessageList,
+    API_TOKEN: str,
+    API_URL: str,
+    LLM_MODEL: str,
+    PROVIDER: str,
+    MAX_OUTPUT_TOKENS: int = 1024,
+    system_message: str | None = None,
+    summary: str | None = None,
+    use_cache: bool = False,
+    deadline: float | None = None,
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of get_api_llm. Yields text chunks as they arrive over SSE
+    (`stream: true` for OpenAI-compatible providers, `streamGenerateContent` for Google).
+    A cache hit is yielded as a single chunk. Failures are only retried while nothing
+    has been yielded yet, and before `deadline` (LLM_REQUEST_DEADLINE by default).
+    """
+    if is_missing_env(API_TOKEN, API_URL, LLM_MODEL, PROVIDER):
+        raise ValueError("Missing some value of a key in .env. Please check it.")
+
+    adapter = get_adapter(PROVIDER, API_URL, API_TOKEN, LLM_MODEL)
+    system = system_prompt(system_message, summary)
+
+    cache_key = ""
+    if use_cache:
+        cache_key = make_key(PROVIDER, LLM_MODEL, system, messages, MAX_OUTPUT_TOKENS)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("♻️ LLM response cache hit: %s", response_cache.stats())
+            yield cached
+            return
+
+    streamed: list[str] = []
+    body = adapter.build_body(messages, system, MAX_OUTPUT_TOKENS, stream=True)
+
+    limiter = get_limiter(endpoint_key(PROVIDER, LLM_MODEL))
+    upstream_metrics = metrics.upstream(PROVIDER.lower())
+    if deadline is None:
+        deadline = time.monotonic() + _retry_policy.deadline
+    attempt = 1
+
+    async with llm_breaker(PROVIDER, LLM_MODEL).guard():
+        while True:
+            start = time.monotonic()
+            try:
+                async with limiter.slot():
+                    start = time.monotonic()
+                    async with http_client.stream(
+                        "POST",
+                        adapter.stream_url,
+                        content=body,
+                        headers=adapter.headers,
+                    ) as response:
+                        # Time until the response headers (the stream itself can be long)
+                        upstream_metrics.observe(
+                            response.status_code, time.monotonic() - start
+                        )
+                        limiter.record(
+                            overloaded=is_overload_status(response.status_code)
+                        )
+                        if response.is_error:
+                            await response.aread()
+                        response.raise_for_status()
+
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            payload = line[5:].strip()
+                            if payload == "[DONE]":
+                                break
+                            if not payload:
+                                continue
+                            try:
+                                event = loads(payload)
+                            except ValueError:
+                                logger.warning(
+                                    "Skipping malformed SSE event: %s", payload[:200]
+                                )
+                                continue
+                            if isinstance(event, dict) and event.get("error"):
+                                error_data = event["error"]
+                                error_msg = (
+                                    error_data.get("message", "Unknown error")
+                                    if isinstance(error_data, dict)
+                                    else str(error_data)
+                                )
+                                raise RuntimeError(f"API Error: {error_msg}")
+                            text = parse_stream_chunk(event, PROVIDER)
+                            if text:
+                                streamed.append(text)
+                                yield text
+                break
+
+            except (HTTPStatusError, RequestError) as e:
+                if isinstance(e, RequestError):
+                    upstream_metrics.observe(None, time.monotonic() - start)
+                    limiter.record(overloaded=True)
+
+                delay = retry_delay(e, _retry_policy, attempt)
+                can_retry = (
+                    not streamed
+                    and is_retryable(e)
+                    and attempt < _retry_policy.max_attempts
+                    and time.monotonic() + delay < deadline
+                )
+                if can_retry:
+                    logger.warning(
+                        "🔁 LLM stream failed (%s), retrying in %.2fs.",
+                        describe_error(e),
+                        delay,
+                    )
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+
+                if isinstance(e, HTTPStatusError):
+                    logger.error(
+                        "API Error %s: %s", e.response.status_code, e.response.text
+                    )
+                    raise _to_connection_error(e) from e
+                logger.error("Connection error on API LLM %s", str(e))
+                raise ConnectionError("❌ Network connection failed") from e
+
+    if use_cache and streamed:
+        response_cache.set(cache_key, "".join(streamed))
@@ -0,0 +1,155 @@
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import os
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any
+
+from .. import config
+from .audio_preprocess import spool
+
+logger = logging.getLogger(__name__)
+
+# Consecutive worker crashes (e.g. the model can't be loaded) that disable the engine
+MAX_CRASHES = 3
+
+# Model of the current worker process, loaded once by the pool initializer
+_model: Any = None
+
+
+class LocalEngineBusy(ConnectionError):
+    """Raised when the local engine already has as many jobs as it admits."""
+
+
+def _load_model(model: str, compute_type: str, cpu_threads: int) -> None:
+    global _model
+    from faster_whisper import WhisperModel
+
+    _model = WhisperModel(
+        model, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads
+    )
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _transcribe_file(path: str) -> str:
+    """Runs in a worker process."""
+    segments, _info = _model.transcribe(path, beam_size=1, vad_filter=True)
+    return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+class LocalEngine:
+    """
+    faster-whisper on the CPU, in a pool of worker processes that each keep the model
+    loaded. At most `workers + queue_size` jobs are admitted at once; past that the
+    engine is saturated and new jobs fail fast with LocalEngineBusy.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        compute_type: str,
+        workers: int,
+        cpu_threads: int,
+        queue_size: int,
+    ) -> None:
+        self.model = model
+        self.compute_type = compute_type
+        self.workers = max(1, workers)
+        self.cpu_threads = cpu_threads
+        self.capacity = self.workers + max(0, queue_size)
+        self.installed = importlib.util.find_spec("faster_whisper") is not None
+        self.disabled = False
+        self._crashes = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+        # Metrics
+        self.pending = 0
+        self.completed_total = 0
+        self.rejected_total = 0
+
+    @property
+    def usable(self) -> bool:
+        return self.installed and not self.disabled
+
+    @property
+    def saturated(self) -> bool:
+        return self.pending >= self.capacity
+
+    def start(self) -> None:
+        """Spawns the workers and loads their models in the background."""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_ping)
+        logger.info(
+            "🎙️ Loading local transcription model %r in %d worker(s).",
+            self.model,
+            self.workers,
+        )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def transcribe(
+        self, audio: bytes | AsyncIterator[bytes], suffix: str = ".ogg"
+    ) -> str:
+        if self.saturated:
+            self.rejected_total += 1
+            raise LocalEngineBusy("❌ Transcription service busy, try again later.")
+
+        self.pending += 1
+        try:
+            path = await spool(audio, suffix)
+            try:
+                loop = asyncio.get_running_loop()
+                text = await loop.run_in_executor(
+                    self._get_executor(), _transcribe_file, path
+                )
+            finally:
+                os.unlink(path)
+        except BrokenProcessPool as e:
+            # A worker died (out of memory, model failed to load...): new pool next time
+            self._executor = None
+            self._crashes += 1
+            if self._crashes >= MAX_CRASHES and not self.disabled:
+                self.disabled = True
+                logger.error(
+                    "🎙️ Local transcription disabled after %d worker crashes.",
+                    self._crashes,
+                )
+            else:
+                logger.error("Local transcription worker crashed: %s", e)
+            raise ConnectionError("❌ Local transcription failed.") from e
+        finally:
+            self.pending -= 1
+
+        self._crashes = 0
+        self.completed_total += 1
+        return text
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned, not forked: the bot's threads and event loop don't carry over
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_load_model,
+                initargs=(self.model, self.compute_type, self.cpu_threads),
+            )
+        return self._executor
+
+
+local_engine = LocalEngine(
+    model=config.LOCAL_STT_MODEL,
+    compute_type=config.LOCAL_STT_COMPUTE_TYPE,
+    workers=config.LOCAL_STT_WORKERS,
+    cpu_threads=config.LOCAL_STT_THREADS,
+    queue_size=config.LOCAL_STT_QUEUE_SIZE,
+)
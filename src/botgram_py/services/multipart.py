@@ -0,0 +1,58 @@
+import asyncio
+import os
+from collections.abc import AsyncIterator
+
+# Whole content, or an async stream of its chunks
+Content = bytes | AsyncIterator[bytes]
+
+
+async def iter_path(path: str, chunk_size: int) -> AsyncIterator[bytes]:
+    """Streams a file from disk in chunks, reading off the event loop."""
+    with open(path, "rb") as f:
+        while chunk := await asyncio.to_thread(f.read, chunk_size):
+            yield chunk
+
+
+class MultipartUpload:
+    """
+    A multipart/form-data body with one file part, streamed: only one chunk of the
+    file is in memory at a time. With the file's size, the body's length is known
+    up front and sent as Content-Length; otherwise chunked transfer encoding is used.
+    """
+
+    def __init__(
+        self,
+        fields: dict[str, str],
+        field_name: str,
+        filename: str,
+        content_type: str,
+        content: Content,
+        size: int | None = None,
+    ) -> None:
+        boundary = os.urandom(16).hex()
+        head = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+            for name, value in fields.items()
+        )
+        head += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field_name}"; '
+            f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'
+        )
+        self._head = head.encode()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+        self._content = content
+        self.headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        if size is not None:
+            self.headers["Content-Length"] = str(
+                len(self._head) + size + len(self._tail)
+            )
+
+    async def body(self) -> AsyncIterator[bytes]:
+        yield self._head
+        if isinstance(self._content, bytes):
+            yield self._content
+        else:
+            async for chunk in self._content:
+                yield chunk
+        yield self._tail
@@ -0,0 +1,200 @@
+import json
+from functools import lru_cache
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # Optional speedup (`speedups` extra)
+    orjson = None
+
+MessageList = list[dict[str, Any]]
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact JSON encoding, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def loads(data: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def system_prompt(system_message: str | None, summary: str | None) -> str | None:
+    """Combines the system message with the rolling summary of older turns."""
+    if not summary:
+        return system_message
+    note = f"Summary of the earlier conversation: {summary}"
+    return f"{system_message}\n\n{note}" if system_message else note
+
+
+@lru_cache(maxsize=256)
+def _encoded_system_message(prompt: str) -> bytes:
+    return dumps({"role": "system", "content": prompt})
+
+
+class ProviderAdapter:
+    """
+    Wire format of one provider endpoint. Built once per endpoint (see get_adapter):
+    headers, URLs and the static parts of the JSON body are prepared up front, so a
+    request only has to serialize its messages.
+    """
+
+    def __init__(self, api_url: str, api_token: str, model: str) -> None:
+        self.url = api_url
+        self.stream_url = api_url
+        self.model = model
+        self.headers: dict[str, str] = {"Content-Type": "application/json"}
+
+    def build_body(
+        self,
+        messages: MessageList,
+        system: str | None,
+        max_tokens: int,
+        stream: bool = False,
+    ) -> bytes:
+        raise NotImplementedError
+
+
+class OpenAICompatibleAdapter(ProviderAdapter):
+    """Chat Completions format (OpenAI, DeepSeek, Groq, NVIDIA)."""
+
+    max_tokens_field = "max_tokens"
+    params: dict[str, Any] = {}
+    extra_headers: dict[str, str] = {}
+
+    def __init__(self, api_url: str, api_token: str, model: str) -> None:
+        super().__init__(api_url, api_token, model)
+        self.headers.update(self.extra_headers)
+        self.headers["Authorization"] = f"Bearer {api_token}"
+
+        # {"model":"<model>","messages":<messages>,"<max tokens>":<n>,<params>}
+        self._head = b'{"model":' + dumps(model) + b',"messages":'
+        self._max_tokens_key = b',"' + self.max_tokens_field.encode() + b'":'
+        self._tails = {
+            stream: b"," + dumps({**self.params, "stream": stream})[1:]
+            for stream in (False, True)
+        }
+
+    def build_body(
+        self,
+        messages: MessageList,
+        system: str | None,
+        max_tokens: int,
+        stream: bool = False,
+    ) -> bytes:
+        encoded = memoryview(dumps(messages))
+        if system:
+            # Splice the system message in front without copying the history
+            separator = b"," if len(encoded) > 2 else b""
+            parts = (b"[", _encoded_system_message(system), separator, encoded[1:])
+        else:
+            parts = (encoded,)
+        return b"".join(
+            (
+                self._head,
+                *parts,
+                self._max_tokens_key,
+                str(max_tokens).encode(),
+                self._tails[stream],
+            )
+        )
+
+
+class OpenAIAdapter(OpenAICompatibleAdapter):
+    pass
+
+
+class DeepSeekAdapter(OpenAICompatibleAdapter):
+    params = {"temperature": 0.7}
+    extra_headers = {"Accept": "application/json"}
+
+
+class GroqAdapter(OpenAICompatibleAdapter):
+    max_tokens_field = "max_completion_tokens"
+    params = {"temperature": 0.5, "reasoning_effort": "medium"}
+
+
+class NvidiaAdapter(OpenAICompatibleAdapter):
+    params = {"temperature": 0.7}
+
+
+class GoogleAdapter(ProviderAdapter):
+    """Gemini generateContent format. The key travels in a header, not in the URL."""
+
+    def __init__(self, api_url: str, api_token: str, model: str) -> None:
+        super().__init__(api_url, api_token, model)
+        if "key=" not in api_url:
+            self.headers["x-goog-api-key"] = api_token
+        url = api_url.replace(":generateContent", ":streamGenerateContent", 1)
+        self.stream_url = f"{url}&alt=sse" if "?" in url else f"{url}?alt=sse"
+        self._generation_config = {"temperature": 0.9, "topP": 1}
+
+    def build_body(
+        self,
+        messages: MessageList,
+        system: str | None,
+        max_tokens: int,
+        stream: bool = False,
+    ) -> bytes:
+        contents = [
+            {
+                "role": "user" if msg["role"] in ("system", "user") else "model",
+                "parts": [{"text": msg["content"]}],
+            }
+            for msg in messages
+        ]
+        if system:
+            # Gemini has no system role here: prefix it to the user's last message
+            if contents and messages[-1]["role"] == "user":
+                contents[-1]["parts"] = [
+                    {
+                        "text": f"System Instructions: {system}\n\n"
+                        f"User Query: {messages[-1]['content']}"
+                    }
+                ]
+            else:
+                contents.insert(
+                    0,
+                    {
+                        "role": "user",
+                        "parts": [{"text": f"System Instructions: {system}"}],
+                    },
+                )
+        return dumps(
+            {
+                "contents": contents,
+                "generationConfig": {
+                    "maxOutputTokens": max_tokens,
+                    **self._generation_config,
+                },
+            }
+        )
+
+
+_ADAPTERS: dict[str, type[ProviderAdapter]] = {
+    "openai": OpenAIAdapter,
+    "google": GoogleAdapter,
+    "deepseek": DeepSeekAdapter,
+    "groq": GroqAdapter,
+    "nvidia": NvidiaAdapter,
+}
+
+_instances: dict[tuple[str, str, str, str], ProviderAdapter] = {}
+
+
+def get_adapter(
+    provider: str, api_url: str, api_token: str, model: str
+) -> ProviderAdapter:
+    """Returns the (cached) adapter of a provider endpoint."""
+    key = (provider.lower(), api_url, api_token, model)
+    adapter = _instances.get(key)
+    if adapter is None:
+        adapter_class = _ADAPTERS.get(key[0])
+        if adapter_class is None:
+            raise KeyError(f"❌ Unsupported provider: {provider}")
+        adapter = _instances[key] = adapter_class(api_url, api_token, model)
+    return adapter
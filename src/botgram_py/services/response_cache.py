@@ -0,0 +1,91 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any
+
+from .. import config
+
+
+def make_key(
+    provider: str,
+    model: str,
+    system_message: str | None,
+    messages: list[dict[str, Any]],
+    max_tokens: int,
+) -> str:
+    """
+    Content address of an LLM request. Only surrounding whitespace is ignored: line
+    breaks and indentation inside a prompt (code, verses) can change the answer.
+    """
+    normalized = [(msg["role"], str(msg["content"]).strip()) for msg in messages]
+    raw = json.dumps(
+        [provider.lower(), model, system_message or "", normalized, max_tokens],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+    """In-memory LLM response cache with TTL expiry and LRU eviction bounded in bytes."""
+
+    def __init__(self, max_bytes: int, ttl: float, max_entries: int = 10_000) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, str, int]] = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value, _ = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        size = len(key) + len(value.encode())
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, value, size)
+        self.size_bytes += size
+
+        while self.size_bytes > self.max_bytes or len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self.size_bytes -= size
+
+
+response_cache = ResponseCache(
+    max_bytes=config.RESPONSE_CACHE_MAX_BYTES, ttl=config.RESPONSE_CACHE_TTL
+)
@@ -0,0 +1,160 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 408 Request Timeout and 409 Conflict are transient for most providers too
+_RETRYABLE_STATUS = {408, 409, 429}
+
+
+class RetryPolicy:
+    """Capped exponential backoff with full jitter, bounded by an overall deadline."""
+
+    def __init__(
+        self,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        deadline: float,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retry number `attempt` (1-based)."""
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        )
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parses a Retry-After header, given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status in _RETRYABLE_STATUS or status >= 500
+    return isinstance(error, httpx.RequestError)
+
+
+def retry_delay(error: Exception, policy: RetryPolicy, attempt: int) -> float:
+    """Honors the server's Retry-After when given, otherwise uses jittered backoff."""
+    if isinstance(error, httpx.HTTPStatusError):
+        retry_after = parse_retry_after(error.response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return retry_after
+    return policy.backoff(attempt)
+
+
+def describe_error(error: Exception) -> str:
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"HTTP {error.response.status_code}"
+    return f"{type(error).__name__}: {error}"
+
+
+async def call_with_retry(
+    fn: Callable[[], Awaitable[T]],
+    policy: RetryPolicy,
+    name: str = "upstream",
+    deadline: float | None = None,
+) -> T:
+    """
+    Runs `fn` until it succeeds, the error is not transient, attempts run out or the
+    next wait would cross the deadline. The last error is re-raised unchanged.
+    `deadline` (a time.monotonic() value) replaces the policy's own, e.g. to share
+    one budget between several calls.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + policy.deadline
+    attempt = 1
+    while True:
+        try:
+            return await asyncio.wait_for(fn(), max(0.001, deadline - time.monotonic()))
+        except asyncio.TimeoutError as e:
+            raise httpx.TimeoutException(f"{name}: deadline exceeded") from e
+        except Exception as e:
+            if not is_retryable(e) or attempt >= policy.max_attempts:
+                raise
+            delay = retry_delay(e, policy, attempt)
+            if time.monotonic() + delay >= deadline:
+                raise
+            logger.warning(
+                "🔁 %s failed (%s), retry %d/%d in %.2fs.",
+                name,
+                describe_error(e),
+                attempt,
+                policy.max_attempts - 1,
+                delay,
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+class LatencyTracker:
+    """Rolling window of recent latencies, used to pick the hedging delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self._samples: deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def hedged(fn: Callable[[], Awaitable[T]], delay: float) -> T:
+    """
+    Starts `fn`; if it hasn't finished after `delay` seconds, starts a second copy
+    and returns whichever succeeds first. Only use for idempotent requests.
+    """
+    tasks = [asyncio.ensure_future(fn())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            tasks.append(asyncio.ensure_future(fn()))
+
+        pending = set(tasks)
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        assert error is not None
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncIterator
+from typing import Any
+
+from .. import config
+from ..tracing import span
+from . import llm_api
+from .circuit_breaker import CircuitOpen
+from .providers import get_adapter
+from .upstream_limits import get_limiter
+
+logger = logging.getLogger(__name__)
+
+# Routes the handlers ask for; each one can be pinned to a subset of the pool
+CHAT = "chat"
+ASK = "ask"
+TRANSLATE = "translate"
+SUMMARY = "summary"
+
+# Assumed latency (seconds) of an endpoint that hasn't answered yet
+_DEFAULT_LATENCY = 2.0
+# How strongly a recent error rate pushes an endpoint down the list
+_ERROR_PENALTY = 4.0
+
+# Errors after which the next endpoint is tried (network/HTTP and malformed responses)
+_FAILOVER_ERRORS = (ConnectionError, RuntimeError)
+
+
+class Endpoint:
+    """One provider/model pair of the pool, with rolling latency and error averages."""
+
+    def __init__(
+        self,
+        name: str,
+        provider: str,
+        model: str,
+        api_url: str,
+        api_token: str,
+        weight: float = 1.0,
+    ) -> None:
+        self.name = name
+        self.provider = provider
+        self.model = model
+        self.api_url = api_url
+        self.api_token = api_token
+        self.weight = max(weight, 0.01)
+
+        self.latency_ewma: float | None = None
+        self.error_ewma = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def record(self, success: bool, seconds: float, alpha: float) -> None:
+        self.requests += 1
+        self.error_ewma += alpha * ((0.0 if success else 1.0) - self.error_ewma)
+        if not success:
+            self.failures += 1
+        elif self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma += alpha * (seconds - self.latency_ewma)
+
+    def available(self) -> bool:
+        return llm_api.llm_breaker(self.provider, self.model).allow()
+
+    def score(self) -> float:
+        """Lower is better: latency, inflated by recent errors and current load."""
+        limiter = get_limiter(llm_api.endpoint_key(self.provider, self.model))
+        load = limiter.in_flight / max(1, int(limiter.limit)) + limiter.queue_depth
+        latency = (
+            self.latency_ewma if self.latency_ewma is not None else _DEFAULT_LATENCY
+        )
+        return (
+            latency * (1 + _ERROR_PENALTY * self.error_ewma) * (1 + load) / self.weight
+        )
+
+
+class ProviderRouter:
+    """
+    Picks an endpoint of the pool for every request and fails over to the next one
+    when it errors or its circuit is open. Endpoints are ordered by score (see
+    Endpoint.score), so traffic drifts toward whatever is currently fastest and healthiest.
+    """
+
+    def __init__(
+        self,
+        endpoints: list[Endpoint],
+        routes: dict[str, list[str]] | None = None,
+        alpha: float = 0.2,
+    ) -> None:
+        self.endpoints = endpoints
+        self.alpha = alpha
+        by_name = {endpoint.name: endpoint for endpoint in endpoints}
+        self.routes: dict[str, list[Endpoint]] = {}
+        for route, names in (routes or {}).items():
+            unknown = [name for name in names if name not in by_name]
+            if unknown:
+                raise ValueError(
+                    f"❌ Route '{route}' uses unknown endpoints: {unknown}"
+                )
+            self.routes[route] = [by_name[name] for name in names]
+
+    @property
+    def primary(self) -> Endpoint | None:
+        return self.endpoints[0] if self.endpoints else None
+
+    def candidates(self, route: str) -> list[Endpoint]:
+        """Endpoints of the route, best first; those with an open circuit go last."""
+        return sorted(
+            self.routes.get(route) or self.endpoints,
+            key=lambda endpoint: (not endpoint.available(), endpoint.score()),
+        )
+
+    async def complete(
+        self,
+        route: str,
+        messages: llm_api.MessageList,
+        max_tokens: int | None = None,
+        system_message: str | None = None,
+        summary: str | None = None,
+        use_cache: bool = False,
+        idempotent: bool = False,
+    ) -> str:
+        """
+        Like llm_api.get_api_llm, on the best endpoint of the route. Failover shares
+        one LLM_REQUEST_DEADLINE: endpoints tried later only get what is left of it.
+        """
+        deadline = time.monotonic() + config.LLM_REQUEST_DEADLINE
+        last_error: Exception | None = None
+        for endpoint in self.candidates(route):
+            start = time.monotonic()
+            if last_error is not None and start >= deadline:
+                break
+            try:
+                with span("llm.complete", route=route, endpoint=endpoint.name):
+                    text = await llm_api.get_api_llm(
+                        messages,
+                        endpoint.api_token,
+                        endpoint.api_url,
+                        endpoint.model,
+                        endpoint.provider,
+                        MAX_OUTPUT_TOKENS=max_tokens or config.MAX_OUTPUT_TOKENS,
+                        system_message=system_message,
+                        summary=summary,
+                        use_cache=use_cache,
+                        idempotent=idempotent,
+                        deadline=deadline,
+                    )
+            except CircuitOpen as e:
+                last_error = e
+                continue
+            except _FAILOVER_ERRORS as e:
+                endpoint.record(False, time.monotonic() - start, self.alpha)
+                logger.warning("↪️ LLM endpoint %s failed (%s).", endpoint.name, e)
+                last_error = e
+                continue
+
+            endpoint.record(True, time.monotonic() - start, self.alpha)
+            return text
+
+        raise last_error or ValueError("❌ No LLM provider configured.")
+
+    async def stream(
+        self,
+        route: str,
+        messages: llm_api.MessageList,
+        max_tokens: int | None = None,
+        system_message: str | None = None,
+        summary: str | None = None,
+        use_cache: bool = False,
+    ) -> AsyncIterator[str]:
+        """
+        Like llm_api.stream_api_llm; fails over only until the first chunk arrives,
+        and within one LLM_REQUEST_DEADLINE shared by all endpoints.
+        """
+        deadline = time.monotonic() + config.LLM_REQUEST_DEADLINE
+        last_error: Exception | None = None
+        for endpoint in self.candidates(route):
+            start = time.monotonic()
+            if last_error is not None and start >= deadline:
+                break
+            started = False
+            try:
+                async for chunk in llm_api.stream_api_llm(
+                    messages,
+                    endpoint.api_token,
+                    endpoint.api_url,
+                    endpoint.model,
+                    endpoint.provider,
+                    MAX_OUTPUT_TOKENS=max_tokens or config.MAX_OUTPUT_TOKENS,
+                    system_message=system_message,
+                    summary=summary,
+                    use_cache=use_cache,
+                    deadline=deadline,
+                ):
+                    started = True
+                    yield chunk
+            except CircuitOpen as e:
+                last_error = e
+                continue
+            except _FAILOVER_ERRORS as e:
+                endpoint.record(False, time.monotonic() - start, self.alpha)
+                if started:
+                    raise
+                logger.warning("↪️ LLM endpoint %s failed (%s).", endpoint.name, e)
+                last_error = e
+                continue
+
+            endpoint.record(True, time.monotonic() - start, self.alpha)
+            return
+
+        raise last_error or ValueError("❌ No LLM provider configured.")
+
+    def stats(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "name": endpoint.name,
+                "latency_ewma": endpoint.latency_ewma,
+                "error_ewma": round(endpoint.error_ewma, 3),
+                "requests": endpoint.requests,
+                "failures": endpoint.failures,
+            }
+            for endpoint in self.endpoints
+        ]
+
+
+def _endpoint_from_spec(spec: dict[str, Any]) -> Endpoint:
+    provider = spec["provider"]
+    model = spec["model"]
+    api_token = spec.get("api_token") or os.getenv(spec.get("api_token_env", ""), "")
+    return Endpoint(
+        name=spec.get("name") or f"{provider}:{model}",
+        provider=provider,
+        model=model,
+        api_url=config.build_api_url(provider, spec.get("api_url"), model),
+        api_token=api_token,
+        weight=float(spec.get("weight", 1.0)),
+    )
+
+
+def build_router() -> ProviderRouter:
+    """Builds the pool from LLM_PROVIDERS, or from the single PROVIDER settings."""
+    if config.LLM_PROVIDERS:
+        endpoints = [_endpoint_from_spec(s) for s in json.loads(config.LLM_PROVIDERS)]
+    else:
+        endpoints = [
+            Endpoint(
+                name="default",
+                provider=config.PROVIDER or "",
+                model=config.LLM_MODEL or "",
+                api_url=config.API_URL,
+                api_token=config.API_TOKEN or "",
+            )
+        ]
+    # Prepare the wire format of every endpoint once, at startup
+    for endpoint in endpoints:
+        if llm_api.is_missing_env(
+            endpoint.provider, endpoint.model, endpoint.api_url, endpoint.api_token
+        ):
+            logger.warning(
+                "⚠️ LLM endpoint %s is missing its provider, model, URL or token.",
+                endpoint.name,
+            )
+            continue
+        get_adapter(
+            endpoint.provider, endpoint.api_url, endpoint.api_token, endpoint.model
+        )
+
+    routes = json.loads(config.LLM_ROUTES) if config.LLM_ROUTES else None
+    return ProviderRouter(endpoints, routes, alpha=config.LLM_ROUTER_EWMA_ALPHA)
+
+
+router = build_router()
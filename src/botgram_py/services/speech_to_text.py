@@ -1,40 +1,185 @@
+import hashlib
 import logging
+import os
+import time
 from typing import Any
 
 import httpx
 from httpx import HTTPStatusError, RequestError
 
+from .. import config, metrics
+from ..tracing import span
+from .audio_preprocess import audio_preprocessor
+from .circuit_breaker import CircuitOpen, get_breaker
+from .local_stt import local_engine
+from .multipart import Content, MultipartUpload
+from .singleflight import SingleFlight
+from .upstream_limits import UpstreamOverloaded, get_limiter, is_overload_status
+
 logger = logging.getLogger(__name__)
 
-GROQ_WHISPER_URL = "https://api.groq.com/openai/v1/audio/transcriptions"
 MODEL = "whisper-large-v3-turbo"
 
+FORM_FIELDS = {"model": MODEL, "temperature": "0", "response_format": "json"}
+
+AudioSource = Content
+
+# Backends (TRANSCRIPTION_BACKEND also accepts "auto")
+GROQ = "groq"
+LOCAL = "local"
+
 # CONNECTION POOLING: Reusable global client with explicit limits
 http_client = httpx.AsyncClient(
     timeout=60.0,
     limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
 )
 
+# Transcriptions in progress, keyed by audio identity
+_inflight: SingleFlight[str] = SingleFlight()
 
-async def transcribe(audio_bytes: bytes, api_key: str) -> str:
-    if not api_key:
-        raise ValueError("❌ No API Key was provided for Groq Audio.")
+breaker = get_breaker("whisper")
+upstream_metrics = metrics.upstream("whisper")
 
-    headers: dict[str, str] = {"Authorization": f"Bearer {api_key}"}
-    files: dict[str, tuple[str, bytes, str]] = {
-        "file": ("voice.ogg", audio_bytes, "audio/ogg")
-    }
-    data: dict[str, str] = {
-        "model": MODEL,
-        "temperature": "0",
-        "response_format": "json",
-    }
 
-    try:
-        response = await http_client.post(
-            GROQ_WHISPER_URL, headers=headers, files=files, data=data
+def uses_local_engine() -> bool:
+    return local_engine.usable and config.TRANSCRIPTION_BACKEND in (LOCAL, "auto")
+
+
+def choose_backend(api_key: str, duration: float | None = None) -> str | None:
+    """
+    The backend for one transcription, None when no backend is usable. "auto" uses
+    the local engine for notes of up to LOCAL_STT_MAX_DURATION seconds while it has
+    room, and Groq for longer (or unknown) durations or when it is saturated.
+    """
+    mode = config.TRANSCRIPTION_BACKEND
+    remote = bool(api_key) and mode in (GROQ, "auto")
+    local = uses_local_engine()
+    if not (remote and local):
+        return GROQ if remote else LOCAL if local else None
+    short = duration is not None and duration <= config.LOCAL_STT_MAX_DURATION
+    return LOCAL if short and not local_engine.saturated else GROQ
+
+
+def is_configured(api_key: str) -> bool:
+    return choose_backend(api_key) is not None
+
+
+async def transcribe(
+    audio: AudioSource,
+    api_key: str,
+    dedup_key: str | None = None,
+    size: int | None = None,
+    filename: str = "voice.ogg",
+    content_type: str = "audio/ogg",
+    duration: float | None = None,
+) -> str:
+    """
+    Transcribes audio with Groq Whisper or the local engine (see choose_backend).
+    `audio` is either the whole file or an async stream of its chunks, which is
+    forwarded as it arrives (pass its `size` when known, and a `dedup_key`).
+    Concurrent calls for the same audio (same `dedup_key`, or same bytes when
+    omitted) share a single transcription.
+    """
+    backend = choose_backend(api_key, duration)
+    if backend is None:
+        raise ValueError("❌ No transcription backend configured (GROQ_API_KEY).")
+
+    if isinstance(audio, bytes):
+        size = len(audio)
+        key = dedup_key or hashlib.blake2b(audio, digest_size=16).hexdigest()
+    elif dedup_key:
+        key = dedup_key
+    else:
+        raise ValueError("❌ Streamed audio needs a dedup_key.")
+
+    with span("transcribe", size=size, backend=backend):
+        return await _inflight.do(
+            key,
+            lambda: _transcribe_with(
+                backend, audio, size, api_key, filename, content_type
+            ),
         )
-        response.raise_for_status()
+
+
+async def _transcribe_with(
+    backend: str,
+    audio: AudioSource,
+    size: int | None,
+    api_key: str,
+    filename: str,
+    content_type: str,
+) -> str:
+    suffix = os.path.splitext(filename)[1] or ".ogg"
+    if backend == LOCAL:
+        return await local_engine.transcribe(audio, suffix)
+    if not (config.AUDIO_PREPROCESS and audio_preprocessor.available):
+        return await _transcribe_remote(
+            audio, size, api_key, filename, content_type, suffix
+        )
+
+    async with audio_preprocessor.prepared(audio, filename, content_type) as prepared:
+        return await _transcribe_remote(
+            prepared.chunks(config.TRANSCRIPTION_CHUNK_SIZE),
+            prepared.size,
+            api_key,
+            prepared.filename,
+            prepared.content_type,
+            suffix,
+        )
+
+
+async def _transcribe_remote(
+    audio: AudioSource,
+    size: int | None,
+    api_key: str,
+    filename: str,
+    content_type: str,
+    suffix: str,
+) -> str:
+    try:
+        return await _transcribe_groq(audio, size, api_key, filename, content_type)
+    except (CircuitOpen, UpstreamOverloaded):
+        # Both are raised before any audio is read, so it can still go to the local engine
+        if (
+            config.TRANSCRIPTION_BACKEND != "auto"
+            or not uses_local_engine()
+            or local_engine.saturated
+        ):
+            raise
+        logger.warning("🎙️ Groq Whisper unavailable, transcribing locally.")
+        return await local_engine.transcribe(audio, suffix)
+
+
+async def _transcribe_groq(
+    audio: AudioSource,
+    size: int | None,
+    api_key: str,
+    filename: str,
+    content_type: str,
+) -> str:
+    upload = MultipartUpload(FORM_FIELDS, "file", filename, content_type, audio, size)
+    headers = {"Authorization": f"Bearer {api_key}", **upload.headers}
+
+    limiter = get_limiter("whisper", config.TRANSCRIPTION_MAX_CONCURRENCY)
+    try:
+        # Fails fast with CircuitOpen while Whisper is down
+        async with breaker.guard():
+            async with limiter.slot():
+                start = time.monotonic()
+                try:
+                    response = await http_client.post(
+                        config.WHISPER_API_URL,
+                        headers=headers,
+                        content=upload.body(),
+                    )
+                except RequestError:
+                    upstream_metrics.observe(None, time.monotonic() - start)
+                    limiter.record(overloaded=True)
+                    raise
+                upstream_metrics.observe(response.status_code, time.monotonic() - start)
+                limiter.record(overloaded=is_overload_status(response.status_code))
+
+            response.raise_for_status()
 
         result: dict[str, Any] = response.json()
         return result.get("text", "")
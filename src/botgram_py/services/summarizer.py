@@ -0,0 +1,33 @@
+import logging
+
+from .. import config
+from .router import SUMMARY, router
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_MESSAGE = (
+    "You compress chat transcripts. Write a concise summary that preserves facts, "
+    "names, decisions, open questions and the user's preferences. "
+    "Output ONLY the summary, in the language of the conversation."
+)
+
+
+def _render_transcript(turns: list[dict[str, str]]) -> str:
+    return "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+
+
+async def summarize(previous_summary: str | None, turns: list[dict[str, str]]) -> str:
+    """Folds `turns` into the running summary of a conversation."""
+    prompt = ""
+    if previous_summary:
+        prompt += f"Current summary:\n{previous_summary}\n\n"
+    prompt += (
+        "Update the summary with these new messages:\n\n" f"{_render_transcript(turns)}"
+    )
+
+    return await router.complete(
+        SUMMARY,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=config.SUMMARY_MAX_TOKENS,
+        system_message=SUMMARY_SYSTEM_MESSAGE,
+    )
@@ -0,0 +1,107 @@
+import json
+import logging
+from collections.abc import AsyncIterator
+
+import httpx
+from telegram import File, Message
+from telegram.error import (
+    BadRequest,
+    Forbidden,
+    NetworkError,
+    RetryAfter,
+    TelegramError,
+)
+
+from .multipart import MultipartUpload, iter_path
+from .retry import describe_error
+
+logger = logging.getLogger(__name__)
+
+# Streaming client for Telegram file transfers (the bot's own client buffers them)
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(60.0, connect=10.0),
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+)
+
+UPLOAD_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+
+async def iter_file(file: File, chunk_size: int) -> AsyncIterator[bytes]:
+    """
+    Yields a Telegram file in chunks of at most `chunk_size` bytes, so it never has
+    to be held in memory as a whole. Files of a local Bot API server are read from disk.
+    """
+    path = file.file_path
+    if not path:
+        raise ValueError("❌ Telegram returned no path for this file.")
+
+    if not path.startswith(("http://", "https://")):
+        async for chunk in iter_path(path, chunk_size):
+            yield chunk
+        return
+
+    try:
+        async with http_client.stream("GET", path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+    except httpx.HTTPError as e:
+        # The download URL embeds the bot token, so it stays out of logs and errors
+        logger.error("Telegram file download failed: %s", describe_error(e))
+        raise ConnectionError("❌ Could not download the file from Telegram.") from None
+
+
+async def send_video(
+    message: Message,
+    video: str | AsyncIterator[bytes],
+    size: int,
+    caption: str,
+    chunk_size: int,
+) -> Message:
+    """
+    Replies to `message` with a video uploaded as a stream, either a file path or an
+    async stream of `size` bytes (PTB would first read the whole file into memory).
+    Raises the same TelegramError subclasses as the bot's own methods.
+    """
+    bot = message.get_bot()
+    fields = {
+        "chat_id": str(message.chat_id),
+        "caption": caption,
+        "supports_streaming": "true",
+        "reply_parameters": json.dumps(
+            {"message_id": message.message_id, "allow_sending_without_reply": True}
+        ),
+    }
+    if message.is_topic_message and message.message_thread_id:
+        fields["message_thread_id"] = str(message.message_thread_id)
+    content = iter_path(video, chunk_size) if isinstance(video, str) else video
+    upload = MultipartUpload(fields, "video", "video.mp4", "video/mp4", content, size)
+
+    try:
+        response = await http_client.post(
+            f"{bot.base_url}/sendVideo",
+            content=upload.body(),
+            headers=upload.headers,
+            timeout=UPLOAD_TIMEOUT,
+        )
+        data = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        # Like downloads, the URL embeds the bot token
+        logger.error("Telegram video upload failed: %s", describe_error(e))
+        raise NetworkError("Could not upload the video to Telegram.") from None
+
+    if not data.get("ok"):
+        description = data.get("description", f"HTTP {response.status_code}")
+        if response.status_code == 429:
+            retry_after = data.get("parameters", {}).get("retry_after", 5)
+            raise RetryAfter(retry_after)
+        if response.status_code == 400:
+            raise BadRequest(description)
+        if response.status_code == 403:
+            raise Forbidden(description)
+        raise TelegramError(description)
+
+    sent = Message.de_json(data["result"], bot)
+    if sent is None:
+        raise TelegramError("Telegram returned no message for the video.")
+    return sent
@@ -0,0 +1,69 @@
+import logging
+from typing import Protocol
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message cost of role markers and separators in chat formats
+MESSAGE_OVERHEAD = 4
+
+
+class TokenEstimator(Protocol):
+    name: str
+
+    def count(self, text: str) -> int: ...
+
+
+class HeuristicEstimator:
+    """Fast approximation (~4 characters per token); good enough for budgeting."""
+
+    name = "heuristic"
+
+    def __init__(self, chars_per_token: float = 4.0) -> None:
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token) + 1
+
+
+class TiktokenEstimator:
+    """Exact counts for OpenAI-style tokenizers. Requires the optional `tiktoken` package."""
+
+    def __init__(self, encoding: str = "cl100k_base") -> None:
+        import tiktoken
+
+        self._encoding = tiktoken.get_encoding(encoding)
+        self.name = f"tiktoken:{encoding}"
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+# Tokenizer that best matches each provider's models when TOKENIZER=tiktoken
+_PROVIDER_ENCODINGS: dict[str, str] = {
+    "openai": "o200k_base",
+    "deepseek": "cl100k_base",
+    "groq": "cl100k_base",
+    "nvidia": "cl100k_base",
+}
+
+_estimators: dict[str, TokenEstimator] = {}
+
+
+def get_estimator(provider: str, tokenizer: str = "heuristic") -> TokenEstimator:
+    """Returns a (cached) estimator for the provider, falling back to the heuristic."""
+    provider = provider.lower()
+    cache_key = f"{tokenizer}:{provider}"
+    if cache_key in _estimators:
+        return _estimators[cache_key]
+
+    estimator: TokenEstimator = HeuristicEstimator()
+    if tokenizer == "tiktoken" and provider in _PROVIDER_ENCODINGS:
+        try:
+            estimator = TiktokenEstimator(_PROVIDER_ENCODINGS[provider])
+        except Exception as e:
+            logger.warning(
+                "⚠️ tiktoken unavailable (%s), using heuristic estimator.", e
+            )
+
+    _estimators[cache_key] = estimator
+    return estimator
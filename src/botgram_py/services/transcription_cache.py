@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+import os
+import re
+
+from cachetools import LRUCache
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+# (text, audio size in bytes, seconds the original download + transcription took)
+_Entry = tuple[str, int, float]
+
+
+class TranscriptionCache:
+    """
+    Transcriptions keyed by Telegram's `file_unique_id`, which is stable across
+    forwards and re-sends of the same file. Backed by an in-memory LRU and an
+    optional on-disk tier that survives restarts.
+    """
+
+    def __init__(self, max_entries: int, disk_dir: str | None = None) -> None:
+        self._memory: LRUCache[str, _Entry] = LRUCache(maxsize=max_entries)
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.seconds_saved = 0.0
+
+    async def get(self, file_unique_id: str) -> str | None:
+        entry = self._memory.get(file_unique_id)
+        if entry is None and self.disk_dir:
+            entry = await asyncio.to_thread(self._read_disk, file_unique_id)
+            if entry is not None:
+                self._memory[file_unique_id] = entry
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        text, size, seconds = entry
+        self.hits += 1
+        self.bytes_saved += size
+        self.seconds_saved += seconds
+        return text
+
+    async def set(
+        self, file_unique_id: str, text: str, size: int, seconds: float
+    ) -> None:
+        entry = (text, size, seconds)
+        self._memory[file_unique_id] = entry
+        if self.disk_dir:
+            try:
+                await asyncio.to_thread(self._write_disk, file_unique_id, entry)
+            except OSError as e:
+                logger.warning("Could not write transcription to disk cache: %s", e)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "entries": len(self._memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+            "seconds_saved": round(self.seconds_saved, 3),
+        }
+
+    def _path(self, file_unique_id: str) -> str:
+        safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", file_unique_id)
+        return os.path.join(self.disk_dir or "", f"{safe_id}.json")
+
+    def _read_disk(self, file_unique_id: str) -> _Entry | None:
+        try:
+            with open(self._path(file_unique_id), encoding="utf-8") as f:
+                data = json.load(f)
+            return data["text"], int(data["size"]), float(data["seconds"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, file_unique_id: str, entry: _Entry) -> None:
+        text, size, seconds = entry
+        path = self._path(file_unique_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"text": text, "size": size, "seconds": seconds}, f)
+        os.replace(tmp_path, path)
+
+
+transcription_cache = TranscriptionCache(
+    max_entries=config.TRANSCRIPTION_CACHE_SIZE,
+    disk_dir=config.TRANSCRIPTION_CACHE_DIR or None,
+)
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from .. import config
+from ..metrics import UPSTREAM_QUEUE_WAIT_SECONDS, UPSTREAM_REJECTED
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamOverloaded(ConnectionError):
+    """Raised when a request waited too long for a free upstream slot."""
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for one upstream, adapted with AIMD: every successful call
+    grows the limit by 1/limit (≈ +1 per round of calls), while 429/5xx or network
+    errors halve it. Callers beyond the limit wait in a FIFO queue for at most
+    `max_queue_wait` seconds and then fail fast with UpstreamOverloaded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue_wait: float,
+        min_concurrency: int = 1,
+        decrease_cooldown: float = 1.0,
+    ) -> None:
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_queue_wait = max_queue_wait
+        self.decrease_cooldown = decrease_cooldown
+
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._last_decrease = 0.0
+
+        # Metrics
+        self._wait_seconds = UPSTREAM_QUEUE_WAIT_SECONDS.labels(name)
+        self._rejected = UPSTREAM_REJECTED.labels(name)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self) -> None:
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self._wait_seconds.observe(0.0)
+            return
+
+        start = time.monotonic()
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.max_queue_wait)
+        except asyncio.TimeoutError:
+            self._rejected.inc()
+            logger.warning(
+                "⚠️ %s overloaded: no slot after %.1fs (limit %d, queue %d).",
+                self.name,
+                self.max_queue_wait,
+                int(self.limit),
+                len(self._waiters),
+            )
+            raise UpstreamOverloaded(
+                "❌ Service busy, please try again in a moment."
+            ) from None
+        except asyncio.CancelledError:
+            # Cancelled right after being granted a slot: hand it back
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if not future.done() or future.cancelled():
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+
+        self._wait_seconds.observe(time.monotonic() - start)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def record(self, overloaded: bool) -> None:
+        """Feeds the outcome of a call (overloaded = 429, 5xx or network error)."""
+        if overloaded:
+            now = time.monotonic()
+            # One burst of failures should only count as a single decrease
+            if now - self._last_decrease < self.decrease_cooldown:
+                return
+            self._last_decrease = now
+            self.limit = max(float(self.min_concurrency), self.limit / 2)
+            logger.warning(
+                "📉 %s concurrency reduced to %d.", self.name, int(self.limit)
+            )
+        elif self.limit < self.max_concurrency:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+
+def is_overload_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+_limiters: dict[str, AdaptiveLimiter] = {}
+
+
+def get_limiter(name: str, max_concurrency: int | None = None) -> AdaptiveLimiter:
+    """Returns the shared limiter of an upstream (e.g. "groq", "whisper")."""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = AdaptiveLimiter(
+            name,
+            max_concurrency=max_concurrency or config.UPSTREAM_MAX_CONCURRENCY,
+            max_queue_wait=config.UPSTREAM_MAX_QUEUE_WAIT,
+        )
+        _limiters[name] = limiter
+    return limiter
+
+
+def all_limiters() -> list[AdaptiveLimiter]:
+    return list(_limiters.values())
@@ -4,34 +4,202 @@ import os
 import re
 import shutil
 import tempfile
-from typing import Any
+import time
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import Executor
+from typing import Any, TypeVar
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import httpx
+from cachetools import TTLCache
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
+
+from .. import config, metrics
+from .circuit_breaker import CircuitOpen, get_breaker
+from .upstream_limits import is_overload_status
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 COBALT_API_URL = "https://api.cobalt.tools"
 # Asynchronous client for Cobalt
 http_client = httpx.AsyncClient(timeout=15.0)
 
+cobalt_breaker = get_breaker("cobalt")
+upstream_metrics = metrics.upstream("cobalt")
+
+# Bot API limit for files sent by bots
+TELEGRAM_MAX_UPLOAD = 50 * 1024 * 1024
+TOO_LARGE_MESSAGE = "❌ The video is too large to send via Telegram (>50MB)."
+
+# Normalized URL -> what the yt-dlp probe found
+_probes: TTLCache[str, "VideoProbe"] = TTLCache(
+    maxsize=config.VIDEO_PROBE_CACHE_SIZE, ttl=config.VIDEO_PROBE_TTL
+)
+# Normalized URLs whose Cobalt file was over TELEGRAM_MAX_UPLOAD (skipped next time)
+_cobalt_too_large: TTLCache[str, bool] = TTLCache(
+    maxsize=config.VIDEO_PROBE_CACHE_SIZE, ttl=config.VIDEO_PROBE_TTL
+)
+# Metadata yt-dlp doesn't need to download a probed video
+_HEAVY_INFO_KEYS = {
+    "formats",
+    "thumbnails",
+    "subtitles",
+    "automatic_captions",
+    "heatmap",
+    "chapters",
+    "requested_formats",
+    "requested_downloads",
+    "requested_subtitles",
+}
+
+# Query parameters that only track where a link was shared from
+_TRACKING_PARAMS = {"si", "s", "feature", "pp", "igsh", "igshid", "fbclid"}
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a video link, so its different spellings share one download."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower().removeprefix("www.").removeprefix("m.")
+    if host in ("twitter.com", "mobile.twitter.com"):
+        host = "x.com"
+    path = parts.path.rstrip("/")
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query)
+        if key not in _TRACKING_PARAMS and not key.startswith("utm_")
+    ]
+
+    if host == "youtu.be" or (host == "youtube.com" and path.startswith("/shorts/")):
+        query = [("v", path.rsplit("/", 1)[-1])]
+        host, path = "youtube.com", "/watch"
+    elif host == "youtube.com" and path == "/watch":
+        # Only the video id matters (playlists aren't downloaded)
+        query = [(key, value) for key, value in query if key == "v"]
+
+    return urlunsplit(("https", host, path, urlencode(sorted(query)), ""))
+
+
+class VideoStream:
+    """
+    A Cobalt download read as it arrives, to be piped straight into the upload.
+    Single use: `finished` is set once it has been read (or closed). Read through,
+    it is also written to `spool_path`, which `path` then gives for other uploads.
+    """
+
+    def __init__(
+        self, response: httpx.Response, size: int, chunk_size: int, spool_path: str
+    ) -> None:
+        self.size = size
+        self.finished = asyncio.Event()
+        self.path: str | None = None
+        self._response = response
+        self._chunk_size = chunk_size
+        self._spool_path = spool_path
+        self.taken = False
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        if self.taken:
+            raise RuntimeError("Video stream already consumed.")
+        self.taken = True
+        complete = False
+        try:
+            with open(self._spool_path, "wb") as f:
+                async for chunk in self._response.aiter_bytes(self._chunk_size):
+                    await asyncio.to_thread(f.write, chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                self.path = self._spool_path
+            await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._response.aclose()
+        self.finished.set()
+
 
-def _download_yt_dlp(url: str, temp_dir: str) -> str:
-    """Isolated synchronous function to run in a thread."""
+# A file path, or a download still in progress
+VideoSource = str | VideoStream
+
+
+async def _open_cobalt_media(media_url: str, filename: str) -> VideoSource | None:
+    """
+    Streams Cobalt's file when its size is known and small enough; otherwise (no
+    Content-Length, or a large one) it is spooled to `filename`. None, before
+    reading any of it when the headers tell, if it can't be sent to Telegram.
+    """
+    response = await http_client.send(
+        http_client.build_request("GET", media_url), stream=True
+    )
+    try:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        size = int(length) if length and length.isdigit() else None
+        if size is not None and size > TELEGRAM_MAX_UPLOAD:
+            return None
+        if size is not None and size <= config.VIDEO_STREAM_MAX_BYTES:
+            return VideoStream(response, size, config.VIDEO_STREAM_CHUNK_SIZE, filename)
+
+        written = 0
+        with open(filename, "wb") as f:
+            async for chunk in response.aiter_bytes(config.VIDEO_STREAM_CHUNK_SIZE):
+                written += len(chunk)
+                if written > TELEGRAM_MAX_UPLOAD:
+                    break
+                await asyncio.to_thread(f.write, chunk)
+        if written > TELEGRAM_MAX_UPLOAD:
+            os.unlink(filename)
+            return None
+    except BaseException:
+        await response.aclose()
+        raise
+    await response.aclose()
+    return filename
+
+
+class _CobaltTooLarge(Exception):
+    """Cobalt's file can't be sent to Telegram: a smaller format may still be."""
+
+
+class VideoProbe:
+    """
+    What yt-dlp found for a link before downloading it: the format to fetch (None
+    for the default selection, when sizes are unknown), its estimated size, and
+    the trimmed metadata to download it without extracting it again. When no
+    format fits Telegram's limit, the smallest one is kept, marked `too_large`.
+    """
+
+    def __init__(
+        self,
+        format_spec: str | None,
+        size: int | None,
+        too_large: bool,
+        info: dict[str, Any] | None,
+    ) -> None:
+        self.format_spec = format_spec
+        self.size = size
+        self.too_large = too_large
+        self.info = info
+
+
+def _ydl_options(
+    url: str, format_spec: str | None = None, max_bytes: int = TELEGRAM_MAX_UPLOAD
+) -> dict[str, Any]:
     is_youtube = "youtube" in url.lower() or "youtu.be" in url.lower()
-    format_spec = (
+    default_spec = (
         "bestvideo[ext=mp4][height<=720]+bestaudio[ext=m4a]/best[ext=mp4]/best"
         if is_youtube
         else "best[ext=mp4]/bestvideo+bestaudio/best"
     )
-
-    ydl_opts: Any = {
-        "outtmpl": f"{temp_dir}/%(id)s.%(ext)s",
-        "format": format_spec,
+    return {
+        "format": format_spec or default_spec,
         "quiet": True,
         "no_warnings": True,
         "noplaylist": True,
-        "max_filesize": 50 * 1024 * 1024,
+        "max_filesize": max_bytes,  # Also stops unknown sizes midway
         "merge_output_format": "mp4",
         "extractor_args": {
             "youtube": {
@@ -46,8 +214,111 @@ def _download_yt_dlp(url: str, temp_dir: str) -> str:
         "geo_bypass": True,
     }
 
+
+def _estimated_size(fmt: dict[str, Any], duration: float | None) -> int | None:
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if not size and fmt.get("tbr") and duration:
+        size = fmt["tbr"] * 1000 / 8 * duration  # tbr is in kbit/s
+    return int(size) if size else None
+
+
+def _pick_format(
+    info: dict[str, Any], limit: int, max_height: int | None
+) -> tuple[list[dict[str, Any]] | None, int | None]:
+    """
+    The best formats (one, or video + audio) whose estimated size fits `limit`:
+    (formats, size). The smallest ones when nothing fits; (None, None) when sizes
+    are unknown.
+    """
+    formats = info.get("formats") or []
+    duration = info.get("duration")
+    videos = [f for f in formats if f.get("vcodec") != "none"]
+    audios = [
+        f for f in formats if f.get("vcodec") == "none" and f.get("acodec") != "none"
+    ]
+
+    candidates: list[tuple[list[dict[str, Any]], int | None]] = []
+    for video in videos:
+        if max_height and (video.get("height") or 0) > max_height:
+            continue
+        size = _estimated_size(video, duration)
+        if video.get("acodec") != "none":
+            candidates.append(([video], size))
+            continue
+        for audio in audios:
+            audio_size = _estimated_size(audio, duration)
+            total = size + audio_size if size and audio_size else None
+            candidates.append(([video, audio], total))
+
+    sized = [(pair, size) for pair, size in candidates if size is not None]
+    fitting = [(pair, size) for pair, size in sized if size <= limit]
+    if fitting:
+
+        def quality(candidate: tuple[list[dict[str, Any]], int | None]) -> tuple:
+            pair = candidate[0]
+            return (
+                pair[0].get("height") or 0,
+                all(f.get("ext") in ("mp4", "m4a") for f in pair),  # No remux needed
+                sum(f.get("tbr") or 0 for f in pair),
+            )
+
+        return max(fitting, key=quality)
+    if len(sized) < len(candidates) or not candidates:
+        return None, None
+    return min(sized, key=lambda candidate: candidate[1] or 0)
+
+
+def _probe_yt_dlp(url: str) -> VideoProbe:
+    """Isolated synchronous function to run in a thread (extracts, doesn't download)."""
+    is_youtube = "youtube" in url.lower() or "youtu.be" in url.lower()
+    with YoutubeDL(_ydl_options(url)) as ydl:
+        info: Any = ydl.extract_info(url, download=False)
+        if not info or info.get("_type") == "playlist":
+            return VideoProbe(None, None, False, None)
+        chosen, size = _pick_format(
+            info, TELEGRAM_MAX_UPLOAD, 720 if is_youtube else None
+        )
+        if chosen is None or size is None:
+            return VideoProbe(None, None, False, None)
+
+        # Only what the download needs, so cached probes stay small
+        info = {
+            key: value
+            for key, value in ydl.sanitize_info(info).items()
+            if key not in _HEAVY_INFO_KEYS
+        }
+        info["formats"] = ydl.sanitize_info(chosen)
+        spec = "+".join(f["format_id"] for f in chosen)
+        return VideoProbe(spec, size, size > TELEGRAM_MAX_UPLOAD, info)
+
+
+def _download_yt_dlp(
+    url: str,
+    temp_dir: str,
+    probe: VideoProbe | None = None,
+    max_bytes: int = TELEGRAM_MAX_UPLOAD,
+    cancel_path: str | None = None,
+) -> str:
+    """
+    Isolated synchronous function to run in a thread. The download stops at its
+    next chunk once a file exists at `cancel_path`.
+    """
+    ydl_opts: Any = _ydl_options(url, probe.format_spec if probe else None, max_bytes)
+    ydl_opts["outtmpl"] = f"{temp_dir}/%(id)s.%(ext)s"
+    if cancel_path is not None:
+
+        def stop_if_cancelled(_: dict[str, Any]) -> None:
+            if os.path.exists(cancel_path):
+                raise DownloadCancelled("Download cancelled.")
+
+        ydl_opts["progress_hooks"] = [stop_if_cancelled]
+
     with YoutubeDL(ydl_opts) as ydl:
-        info: Any = ydl.extract_info(url, download=True)
+        if probe and probe.info:
+            # Reuses the probe's extraction (formats are only valid for a while)
+            info: Any = ydl.process_ie_result(dict(probe.info), download=True)
+        else:
+            info = ydl.extract_info(url, download=True)
         video_title = info.get("title", "Unknown Video") if info else "Unknown Video"
         logger.info(f"📥 Downloaded via yt-dlp: {video_title}")
 
@@ -57,8 +328,56 @@ def _download_yt_dlp(url: str, temp_dir: str) -> str:
         raise RuntimeError("Downloaded file not found on disk.")
 
 
-async def download_video(url: str) -> str:
-    """Video download: Try Async Cobalt first. If it fails, delegate to yt-dlp in a thread."""
+def _in_worker(fn: Callable[..., T], *args: Any) -> T:
+    """Runs in a worker process (yt-dlp's own exceptions don't always unpickle)."""
+    try:
+        return fn(*args)
+    except Exception as e:
+        raise RuntimeError(str(e)) from None
+
+
+async def _run_yt_dlp(executor: Executor | None, fn: Callable[..., T], *args: Any) -> T:
+    if executor is None:
+        return await asyncio.to_thread(fn, *args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _in_worker, fn, *args)
+
+
+async def probe_video(url: str, executor: Executor | None = None) -> VideoProbe:
+    """yt-dlp's metadata for `url`, cached per normalized URL for VIDEO_PROBE_TTL."""
+    key = normalize_url(url)
+    probe = _probes.get(key)
+    if probe is None:
+        probe = await _run_yt_dlp(executor, _probe_yt_dlp, url)
+        _probes[key] = probe
+        if probe.size:
+            logger.info(
+                "🔎 Probed %s: format %s, ~%.1f MB%s",
+                key,
+                probe.format_spec,
+                probe.size / 1024 / 1024,
+                " (too large)" if probe.too_large else "",
+            )
+    return probe
+
+
+async def download_video(
+    url: str,
+    temp_dir: str | None = None,
+    executor: Executor | None = None,
+    max_bytes: int = TELEGRAM_MAX_UPLOAD,
+    cancel_path: str | None = None,
+) -> VideoSource:
+    """
+    Video download: Try Async Cobalt first (streamed, see _open_cobalt_media). If it
+    fails, delegate to yt-dlp on `executor` (a thread by default) and return the file.
+    yt-dlp probes the link first, to pick the best format that fits Telegram's limit
+    and turn away videos with none before downloading anything. With a `max_bytes`
+    over that limit (the caller will make it fit), the smallest format is fetched
+    instead when none fits, if it is under `max_bytes`.
+    A given `temp_dir` stays the caller's to remove. Creating a file at
+    `cancel_path` stops a yt-dlp download running in another process.
+    """
     if not re.search(
         r"(youtube|youtu\.be|facebook|instagram|tiktok|twitter|x\.com)",
         url,
@@ -66,50 +385,76 @@ async def download_video(url: str) -> str:
     ):
         raise ValueError("❌ Link not supported.")
 
-    temp_dir = tempfile.mkdtemp()
+    key = normalize_url(url)
+    owns_dir = temp_dir is None
+    temp_dir = temp_dir or tempfile.mkdtemp()
     filename = os.path.join(temp_dir, "video.mp4")
 
     try:
-        logger.info("🔄 Attempting download via Cobalt...")
-        headers: dict[str, str] = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-        }
-        payload: dict[str, str | bool] = {
-            "url": url,
-            "vQuality": "720",
-            "filenamePattern": "basic",
-            "isAudioOnly": False,
-        }
+        if key in _cobalt_too_large:
+            raise _CobaltTooLarge()
+        # Skipped straight to yt-dlp (CircuitOpen) while Cobalt is down
+        async with cobalt_breaker.guard():
+            logger.info("🔄 Attempting download via Cobalt...")
+            headers: dict[str, str] = {
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+            }
+            payload: dict[str, str | bool] = {
+                "url": url,
+                "vQuality": "720",
+                "filenamePattern": "basic",
+                "isAudioOnly": False,
+            }
 
-        response = await http_client.post(
-            f"{COBALT_API_URL}/api/json", json=payload, headers=headers
-        )
+            start = time.monotonic()
+            try:
+                response = await http_client.post(
+                    f"{COBALT_API_URL}/api/json", json=payload, headers=headers
+                )
+            except httpx.RequestError:
+                upstream_metrics.observe(None, time.monotonic() - start)
+                raise
+            upstream_metrics.observe(response.status_code, time.monotonic() - start)
 
-        if response.status_code == 200:
-            data: dict[str, Any] = response.json()
-            if "url" in data:
-                async with http_client.stream("GET", data["url"]) as r:
-                    r.raise_for_status()
-                    with open(filename, "wb") as f:
-                        async for chunk in r.aiter_bytes(chunk_size=8192):
-                            f.write(chunk)
+            if response.status_code == 200:
+                data: dict[str, Any] = response.json()
+                if "url" in data:
+                    source = await _open_cobalt_media(data["url"], filename)
+                    if source is None:
+                        _cobalt_too_large[key] = True
+                        raise _CobaltTooLarge()
+                    logger.info("✅ Successful download via Cobalt")
+                    return source
 
-                logger.info("✅ Successful download via Cobalt")
-                return filename
+            # 429/5xx count against the circuit
+            if is_overload_status(response.status_code):
+                response.raise_for_status()
 
         logger.warning(
             f"⚠️ Cobalt returned unexpected response or error: {response.status_code}"
         )
 
+    except CircuitOpen:
+        logger.info("⏭️ Cobalt circuit open, using local yt-dlp.")
+    except _CobaltTooLarge:
+        logger.info(
+            "📏 Cobalt's file is over 50MB, looking for a smaller one with yt-dlp."
+        )
     except Exception as e:
         logger.warning(f"⚠️ Cobalt failed ({str(e)}), switching to local yt-dlp...")
 
     try:
-        return await asyncio.to_thread(_download_yt_dlp, url, temp_dir)
+        probe = await probe_video(url, executor)
+        if probe.too_large and (probe.size or 0) > max_bytes:
+            raise ValueError(TOO_LARGE_MESSAGE)
+        return await _run_yt_dlp(
+            executor, _download_yt_dlp, url, temp_dir, probe, max_bytes, cancel_path
+        )
     except Exception as e:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        if owns_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
         if "sign in" in str(e).lower():
             raise ValueError("🔒 It couldn't download video (Sign in required)")
         raise e
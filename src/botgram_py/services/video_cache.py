@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import weakref
+from collections import OrderedDict
+
+from cachetools import LRUCache
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+
+class VideoCache:
+    """
+    Videos already handled by /dl, keyed by normalized URL (video_api.normalize_url).
+
+    The Telegram `file_id` of each video sent lets the next request for the same link
+    re-send it without downloading or uploading anything. With a `disk_dir`, recent
+    files are also kept there (least recently used first out, `max_bytes` in total),
+    which spares the download when there is no usable file_id, e.g. after a restart.
+    """
+
+    def __init__(
+        self, max_entries: int, disk_dir: str | None = None, max_bytes: int = 0
+    ) -> None:
+        # Key -> (file_id, size of the video)
+        self._file_ids: LRUCache[str, tuple[str, int]] = LRUCache(maxsize=max_entries)
+        self.disk_dir = disk_dir
+        self.max_bytes = max_bytes
+        # File name -> size, least recently used first
+        self._files: OrderedDict[str, int] = OrderedDict()
+        self.disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_index()
+
+        # One upload per video at a time, so concurrent requests reuse its file_id
+        self._upload_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+
+        self.file_id_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    # --- Telegram file ids ---
+
+    def file_id(self, key: str) -> str | None:
+        entry = self._file_ids.get(key)
+        if entry is None:
+            return None
+        file_id, size = entry
+        self.file_id_hits += 1
+        self.bytes_saved += size
+        return file_id
+
+    def set_file_id(self, key: str, file_id: str, size: int) -> None:
+        self._file_ids[key] = (file_id, size)
+
+    def forget_file_id(self, key: str) -> None:
+        self._file_ids.pop(key, None)
+
+    def upload_lock(self, key: str) -> asyncio.Lock:
+        lock = self._upload_locks.get(key)
+        if lock is None:
+            lock = self._upload_locks[key] = asyncio.Lock()
+        return lock
+
+    # --- Files on disk ---
+
+    async def restore(self, key: str, temp_dir: str) -> str | None:
+        """Links the cached video of `key` into `temp_dir` and returns it, if any."""
+        name = self._file_name(key)
+        if not self.disk_dir or name not in self._files:
+            self.misses += 1
+            return None
+
+        cached, path = self._disk_path(name), os.path.join(temp_dir, "video.mp4")
+        try:
+            # A link of its own: evicting the cached copy can't pull it from under us
+            await asyncio.to_thread(_link_or_copy, cached, path)
+            # Recency survives restarts through the modification time
+            await asyncio.to_thread(os.utime, cached)
+        except OSError as e:
+            logger.warning("Could not read video from disk cache: %s", e)
+            self._drop(name)
+            self.misses += 1
+            return None
+
+        self._files.move_to_end(name)
+        self.disk_hits += 1
+        self.bytes_saved += self._files[name]
+        return path
+
+    async def keep(self, key: str, path: str) -> None:
+        """Copies a freshly downloaded video into the disk tier."""
+        if not self.disk_dir:
+            return
+        name = self._file_name(key)
+        try:
+            size = os.path.getsize(path)
+            if size > self.max_bytes:
+                return
+            await asyncio.to_thread(_link_or_copy, path, self._disk_path(name))
+        except OSError as e:
+            logger.warning("Could not write video to disk cache: %s", e)
+            return
+
+        if name in self._files:
+            self.disk_bytes -= self._files.pop(name)
+        self._files[name] = size
+        self.disk_bytes += size
+        while self.disk_bytes > self.max_bytes:
+            self._drop(next(iter(self._files)))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "file_ids": len(self._file_ids),
+            "files": len(self._files),
+            "disk_bytes": self.disk_bytes,
+            "file_id_hits": self.file_id_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+        }
+
+    def _file_name(self, key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()[:32] + ".mp4"
+
+    def _disk_path(self, name: str) -> str:
+        return os.path.join(self.disk_dir or "", name)
+
+    def _drop(self, name: str) -> None:
+        self.disk_bytes -= self._files.pop(name, 0)
+        try:
+            os.unlink(self._disk_path(name))
+        except FileNotFoundError:
+            pass
+
+    def _load_index(self) -> None:
+        """Picks up the files of a previous run, oldest access first."""
+        entries = []
+        for entry in os.scandir(self.disk_dir or ""):
+            if entry.is_file() and entry.name.endswith(".mp4"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self.disk_bytes += size
+        while self.disk_bytes > self.max_bytes and self._files:
+            self._drop(next(iter(self._files)))
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    tmp = f"{dst}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+video_cache = VideoCache(
+    max_entries=config.VIDEO_CACHE_SIZE,
+    disk_dir=config.VIDEO_CACHE_DIR or None,
+    max_bytes=config.VIDEO_CACHE_MAX_BYTES,
+)
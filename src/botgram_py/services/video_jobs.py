@@ -0,0 +1,291 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, suppress
+from typing import Any
+
+from .. import config
+from .video_api import VideoSource, VideoStream, download_video, normalize_url
+from .video_cache import video_cache
+from .video_transcode import video_transcoder
+
+logger = logging.getLogger(__name__)
+
+
+class VideoJob:
+    """One download, shared by every request for the same (normalized) URL."""
+
+    def __init__(self, key: str, url: str) -> None:
+        self.key = key
+        self.url = url
+        self.temp_dir = tempfile.mkdtemp(prefix="video-")
+        # Created to stop the job's yt-dlp worker: outside temp_dir, which yt-dlp
+        # would recreate if it were removed
+        self.cancel_path = f"{self.temp_dir}.cancel"
+        # Calls still running in a worker process, even after the task is cancelled
+        self.pending: set[Future[Any]] = set()
+        self.holders = 0
+        # Share (0-1) of the video re-encoded so far, None when it isn't transcoded
+        self.transcoding: float | None = None
+        self.task: asyncio.Task[None] | None = None
+        self.result: asyncio.Future[VideoSource] = (
+            asyncio.get_running_loop().create_future()
+        )
+
+
+class _JobExecutor(Executor):
+    """Submits to `executor`, keeping track of the job's calls until they finish."""
+
+    def __init__(self, executor: Executor, job: VideoJob) -> None:
+        self._executor = executor
+        self._job = job
+
+    def submit(
+        self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any
+    ) -> Future[Any]:
+        future = self._executor.submit(fn, *args, **kwargs)
+        self._job.pending.add(future)
+        future.add_done_callback(self._job.pending.discard)
+        return future
+
+
+class VideoJobQueue:
+    """
+    Runs video downloads on `workers` slots, first come first served, with yt-dlp
+    (and the ffmpeg merges it starts) in as many worker processes; videos too large
+    to send are then re-encoded by the video transcoder, if enabled. At most
+    `max_queued` downloads wait for a slot and each user may have `max_per_user`
+    requests queued or running. Concurrent requests for the same URL share one
+    download; a download nobody is waiting for anymore is cancelled.
+    """
+
+    def __init__(self, workers: int, max_queued: int, max_per_user: int) -> None:
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.max_per_user = max(1, max_per_user)
+        self._jobs: dict[str, VideoJob] = {}
+        self._waiting: list[VideoJob] = []
+        self._running = 0
+        self._per_user: dict[int, int] = {}
+        self._moved: asyncio.Event | None = None
+        self._executor: ProcessPoolExecutor | None = None
+
+        # Metrics
+        self.completed_total = 0
+        self.deduplicated_total = 0
+        self.rejected_total = 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def position(self, job: VideoJob) -> int:
+        """1-based place of `job` among the waiting downloads, 0 once it has started."""
+        try:
+            return self._waiting.index(job) + 1
+        except ValueError:
+            return 0
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @asynccontextmanager
+    async def request(self, url: str, user_id: int) -> AsyncIterator[VideoJob]:
+        """
+        Queues (or joins) the download of `url` for one user, raising ValueError when
+        the user or the queue is over its limit. The downloaded file stays on disk
+        until every request sharing it has exited.
+        """
+        if self._per_user.get(user_id, 0) >= self.max_per_user:
+            self.rejected_total += 1
+            raise ValueError(
+                f"❌ You already have {self.max_per_user} video(s) in progress."
+            )
+
+        key = normalize_url(url)
+        job = self._jobs.get(key)
+        if job is not None:
+            self.deduplicated_total += 1
+        elif len(self._waiting) >= self.max_queued:
+            self.rejected_total += 1
+            raise ValueError("❌ Too many videos in the queue, try again later.")
+        else:
+            job = self._jobs[key] = VideoJob(key, url)
+            self._waiting.append(job)
+            self._pump()
+
+        job.holders += 1
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        try:
+            yield job
+        finally:
+            remaining = self._per_user[user_id] - 1
+            if remaining > 0:
+                self._per_user[user_id] = remaining
+            else:
+                del self._per_user[user_id]
+            job.holders -= 1
+            if job.holders == 0:
+                self._abandon(job)
+
+    async def positions(self, job: VideoJob) -> AsyncIterator[int]:
+        """Yields the job's queue position every time it changes, until it starts."""
+        last = None
+        while (position := self.position(job)) > 0:
+            moved = self._get_moved()
+            if position != last:
+                last = position
+                yield position
+            await moved.wait()
+
+    async def wait(self, job: VideoJob) -> VideoSource:
+        """
+        The downloaded file, or a VideoStream to read while it downloads (only one
+        request can: the others should reuse what it sent). Raises what the download
+        raised.
+        """
+        # Shielded: one request giving up must not cancel the others' download
+        return await asyncio.shield(job.result)
+
+    def _pump(self) -> None:
+        started = False
+        while self._waiting and self._running < self.workers:
+            job = self._waiting.pop(0)
+            self._running += 1
+            job.task = asyncio.create_task(self._run(job), name=f"video-{job.key}")
+            job.task.add_done_callback(lambda _, j=job: self._finished(j))
+            started = True
+        if started:
+            self._notify()
+
+    async def _run(self, job: VideoJob) -> None:
+        try:
+            await self._download(job)
+        finally:
+            # A cancelled yt-dlp worker runs until it sees the cancel marker: the
+            # slot is only free once its process is
+            # (copied: calls are discarded from the set on the executor's thread)
+            if pending := list(job.pending):
+                await asyncio.gather(
+                    *map(asyncio.wrap_future, pending), return_exceptions=True
+                )
+
+    async def _download(self, job: VideoJob) -> None:
+        try:
+            source = await video_cache.restore(job.key, job.temp_dir)
+            if source is None:
+                executor = _JobExecutor(self._get_executor(), job)
+                source = await download_video(
+                    job.url,
+                    job.temp_dir,
+                    executor,
+                    video_transcoder.max_input_bytes,
+                    job.cancel_path,
+                )
+                if isinstance(source, str):
+                    source = await self._fit(job, source)
+                    await video_cache.keep(job.key, source)
+        except BrokenProcessPool as e:
+            # A worker died (out of memory...): new pool next time
+            self._executor = None
+            logger.error("Video worker crashed: %s", e)
+            job.result.set_exception(
+                ConnectionError("❌ The video worker crashed, try again.")
+            )
+        except Exception as e:
+            job.result.set_exception(e)
+        else:
+            job.result.set_result(source)
+            if isinstance(source, VideoStream):
+                # Still downloading while it is uploaded: the slot is held until then
+                try:
+                    await source.finished.wait()
+                finally:
+                    await source.aclose()
+
+    async def _fit(self, job: VideoJob, path: str) -> str:
+        def progress(done: float) -> None:
+            job.transcoding = done
+
+        try:
+            return await video_transcoder.fit(path, progress)
+        finally:
+            job.transcoding = None
+
+    def _finished(self, job: VideoJob) -> None:
+        self._running -= 1
+        if not job.result.done():  # Cancelled
+            job.result.cancel()
+        if job.result.cancelled() or job.result.exception() is not None:
+            # A failed download is retried by the next request instead of shared
+            self._forget(job)
+        else:
+            self.completed_total += 1
+        if job.holders == 0:
+            self._cleanup(job)
+        self._pump()
+
+    def _abandon(self, job: VideoJob) -> None:
+        """Nobody is waiting for `job` anymore."""
+        self._forget(job)
+        if job in self._waiting:
+            self._waiting.remove(job)
+            job.result.cancel()
+            self._cleanup(job)
+            self._notify()
+        elif job.task is not None and not job.task.done():
+            if not job.result.done():
+                logger.info("🚫 Video download cancelled: %s", job.key)
+                with suppress(OSError):
+                    open(job.cancel_path, "w").close()
+            job.task.cancel()  # Cleaned up by _finished
+        else:
+            self._cleanup(job)
+
+    def _forget(self, job: VideoJob) -> None:
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+
+    def _cleanup(self, job: VideoJob) -> None:
+        # A transcode still running here stops once the folder is gone
+        shutil.rmtree(job.temp_dir, ignore_errors=True)
+        with suppress(FileNotFoundError):
+            os.unlink(job.cancel_path)
+
+    def _get_moved(self) -> asyncio.Event:
+        if self._moved is None:
+            self._moved = asyncio.Event()
+        return self._moved
+
+    def _notify(self) -> None:
+        """Wakes up every `positions` iterator: the queue has moved."""
+        if self._moved is not None:
+            self._moved.set()
+            self._moved = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+
+video_jobs = VideoJobQueue(
+    workers=config.VIDEO_WORKERS,
+    max_queued=config.VIDEO_QUEUE_SIZE,
+    max_per_user=config.VIDEO_MAX_JOBS_PER_USER,
+)
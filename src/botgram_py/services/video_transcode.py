@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import suppress
+
+from .. import config, metrics
+from .video_api import TELEGRAM_MAX_UPLOAD
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = shutil.which("ffmpeg")
+
+# Share of the size limit given to the streams: the rest covers the MP4 container
+# and the encoder overshooting its average bitrate
+SIZE_MARGIN = 0.94
+# Largest output height for a video bitrate (kbit/s): fewer pixels look better than
+# a starved encoder at full resolution
+HEIGHT_FOR_BITRATE = ((400, 360), (900, 480), (2000, 720))
+MAX_HEIGHT = 1080
+
+TRANSCODES = metrics.Counter(
+    "botgram_video_transcodes_total",
+    "Videos re-encoded to fit Telegram's upload limit, by outcome.",
+    ("result",),
+)
+TRANSCODE_SECONDS = metrics.Histogram(
+    "botgram_video_transcode_seconds",
+    "Time spent re-encoding one video.",
+    buckets=(5, 15, 30, 60, 120, 300, 600, 1200),
+)
+
+_DURATION = re.compile(rb"Duration: (\d+):(\d\d):(\d\d(?:\.\d+)?)")
+
+
+class TooLong(ValueError):
+    """Even the lowest acceptable bitrate wouldn't fit the video in the limit."""
+
+
+def _duration(ffmpeg: str, src: str) -> float:
+    """The container's duration in seconds, as ffmpeg reports it (no ffprobe needed)."""
+    result = subprocess.run(
+        [ffmpeg, "-nostdin", "-hide_banner", "-i", src], capture_output=True
+    )
+    match = _DURATION.search(result.stderr)
+    if not match:
+        raise RuntimeError("Could not read the video's duration.")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _encode(
+    ffmpeg: str,
+    src: str,
+    dst: str,
+    progress_path: str,
+    duration: float,
+    video_kbps: int,
+    audio_kbps: int,
+    preset: str,
+    threads: int,
+) -> None:
+    """
+    One single-pass, bitrate-targeted x264 encode. Progress (0-1) is written to
+    `progress_path`; the encode is killed if the folder holding `dst` disappears
+    (the download was cancelled and cleaned up).
+    """
+    height = next(
+        (h for kbps, h in HEIGHT_FOR_BITRATE if video_kbps < kbps), MAX_HEIGHT
+    )
+    workdir = os.path.dirname(dst)
+    process = subprocess.Popen(
+        [ffmpeg, "-nostdin", "-v", "error", "-y", "-i", src]
+        + ["-map", "0:v:0", "-map", "0:a:0?", "-sn", "-dn"]
+        # Even width for yuv420p, never upscaled
+        + ["-vf", f"scale=-2:'min({height},ih)':flags=fast_bilinear"]
+        + ["-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p"]
+        + ["-b:v", f"{video_kbps}k", "-maxrate", f"{video_kbps * 3 // 2}k"]
+        + ["-bufsize", f"{video_kbps * 2}k", "-threads", str(threads)]
+        + ["-c:a", "aac", "-b:a", f"{audio_kbps}k", "-ac", "2"]
+        + ["-movflags", "+faststart", "-progress", "pipe:1", dst],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    assert process.stdout is not None and process.stderr is not None
+    try:
+        for line in process.stdout:
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            if key != "out_time_us" or not value.isdigit():
+                continue
+            if not os.path.isdir(workdir):
+                raise RuntimeError("Transcoding cancelled.")
+            tmp = f"{progress_path}.tmp"
+            with open(tmp, "w") as f:
+                f.write(str(min(1.0, int(value) / 1e6 / duration)))
+            os.replace(tmp, progress_path)
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, ffmpeg, b"", stderr)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def _transcode_file(
+    ffmpeg: str,
+    src: str,
+    dst: str,
+    progress_path: str,
+    limit: int,
+    preset: str,
+    audio_kbps: int,
+    min_video_kbps: int,
+    threads: int,
+) -> int:
+    """
+    Runs in a worker process: re-encodes `src` into `dst` at the average bitrate
+    that fills `limit` bytes over the video's duration, and once more at a lower
+    one if the encoder overshot. Returns the size of `dst`.
+    """
+    duration = _duration(ffmpeg, src)
+    budget_kbps = limit * 8 * SIZE_MARGIN / 1000 / max(duration, 1.0)
+    video_kbps = int(budget_kbps - audio_kbps)
+    if video_kbps < min_video_kbps:
+        raise TooLong(
+            f"❌ The video is too long ({duration / 60:.0f} min) to fit in 50MB."
+        )
+
+    size = 0
+    for _ in range(2):
+        _encode(
+            ffmpeg,
+            src,
+            dst,
+            progress_path,
+            duration,
+            video_kbps,
+            audio_kbps,
+            preset,
+            threads,
+        )
+        size = os.path.getsize(dst)
+        if size <= limit:
+            break
+        video_kbps = int(video_kbps * limit / size * SIZE_MARGIN)
+    return size
+
+
+class VideoTranscoder:
+    """
+    Re-encodes videos too large for Telegram so that they fit: H.264/AAC at the
+    bitrate the size limit allows for their duration, scaled down when that
+    bitrate is low. Runs ffmpeg in a pool of `workers` processes (at most that many
+    encodes at once), with x264's `preset` traded for speed: the bitrate, not the
+    preset, decides the size.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        workers: int,
+        preset: str,
+        threads: int,
+        audio_kbps: int,
+        min_video_kbps: int,
+        max_input_bytes: int,
+    ) -> None:
+        self.enabled = enabled and FFMPEG is not None
+        self.workers = max(1, workers)
+        self.preset = preset
+        self.threads = threads
+        self.audio_kbps = audio_kbps
+        self.min_video_kbps = min_video_kbps
+        self._max_input_bytes = max_input_bytes
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def max_input_bytes(self) -> int:
+        """Largest download worth fetching: what can be sent, or transcoded to fit."""
+        if not self.enabled:
+            return TELEGRAM_MAX_UPLOAD
+        return max(self._max_input_bytes, TELEGRAM_MAX_UPLOAD)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def fit(
+        self, src: str, on_progress: Callable[[float], None] | None = None
+    ) -> str:
+        """
+        `src` re-encoded next to it to fit TELEGRAM_MAX_UPLOAD, or `src` itself if it
+        already fits or couldn't be transcoded. Raises TooLong (a ValueError) when
+        no acceptable bitrate fits. `on_progress` gets the encode's progress (0-1).
+        """
+        size = os.path.getsize(src)
+        if not self.enabled or size <= TELEGRAM_MAX_UPLOAD:
+            return src
+
+        assert FFMPEG is not None
+        base = os.path.splitext(src)[0]
+        dst, progress_path = f"{base}.fit.mp4", f"{base}.progress"
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        future = loop.run_in_executor(
+            self._get_executor(),
+            _transcode_file,
+            FFMPEG,
+            src,
+            dst,
+            progress_path,
+            TELEGRAM_MAX_UPLOAD,
+            self.preset,
+            self.audio_kbps,
+            self.min_video_kbps,
+            self.threads,
+        )
+        try:
+            while not future.done():
+                await asyncio.wait({future}, timeout=1.0)
+                if on_progress is not None:
+                    with suppress(OSError, ValueError):
+                        with open(progress_path) as f:
+                            on_progress(float(f.read()))
+            new_size = future.result()
+        except TooLong:
+            TRANSCODES.labels("too_long").inc()
+            raise
+        except (OSError, subprocess.SubprocessError, BrokenProcessPool) as e:
+            if isinstance(e, BrokenProcessPool):
+                self._executor = None
+            TRANSCODES.labels("failed").inc()
+            stderr = getattr(e, "stderr", b"") or b""
+            logger.warning(
+                "Video transcoding failed: %s %s",
+                e,
+                stderr.decode(errors="replace")[-300:],
+            )
+            return src
+        finally:
+            # Cancelled: the worker stops on its own once the job's folder is gone
+            future.cancel()
+            with suppress(FileNotFoundError):
+                os.unlink(progress_path)
+
+        elapsed = time.monotonic() - start
+        TRANSCODE_SECONDS.observe(elapsed)
+        if new_size > TELEGRAM_MAX_UPLOAD:
+            TRANSCODES.labels("too_large").inc()
+            return src
+        TRANSCODES.labels("ok").inc()
+        logger.info(
+            "🎞️ Video transcoded in %.1fs: %.1f MB -> %.1f MB.",
+            elapsed,
+            size / 1024 / 1024,
+            new_size / 1024 / 1024,
+        )
+        os.unlink(src)  # Only the version that can be sent is kept
+        return dst
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+
+video_transcoder = VideoTranscoder(
+    enabled=config.VIDEO_TRANSCODE,
+    workers=config.VIDEO_TRANSCODE_WORKERS,
+    preset=config.VIDEO_TRANSCODE_PRESET,
+    threads=config.VIDEO_TRANSCODE_THREADS,
+    audio_kbps=config.VIDEO_TRANSCODE_AUDIO_KBPS,
+    min_video_kbps=config.VIDEO_TRANSCODE_MIN_VIDEO_KBPS,
+    max_input_bytes=config.VIDEO_TRANSCODE_MAX_INPUT_BYTES,
+)
+
+if config.VIDEO_TRANSCODE and FFMPEG is None:
+    logger.warning(
+        "⚠️ VIDEO_TRANSCODE is on but ffmpeg wasn't found; large videos are refused."
+    )
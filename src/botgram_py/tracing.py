@@ -0,0 +1,192 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from typing import Any
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """One timed operation of a trace, exported as an OTLP-like JSON object."""
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "name",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "error",
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None) -> None:
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: dict[str, Any] = {}
+        self.error: str | None = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": (
+                {"code": "ERROR", "message": self.error}
+                if self.error
+                else {"code": "OK"}
+            ),
+        }
+
+
+class FileExporter:
+    """
+    Appends finished spans as JSON lines (one OTLP-like span per line). Spans are
+    handed to a background thread, so the event loop never blocks on file I/O.
+    """
+
+    def __init__(self, path: str, batch_size: int = 256) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self._queue: queue.SimpleQueue[Span | None] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self.dropped = 0
+
+    def export(self, span: Span) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="trace-exporter", daemon=True
+            )
+            self._thread.start()
+        self._queue.put(span)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get())
+
+            stop = None in batch
+            lines = [
+                json.dumps(s.to_dict(), default=str) for s in batch if s is not None
+            ]
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n" if lines else "")
+            except OSError as e:
+                self.dropped += len(lines)
+                logger.warning("Could not write %d spans: %s", len(lines), e)
+            if stop:
+                return
+
+
+class Tracer:
+    """
+    Minimal tracer: the sampling decision is taken once per trace, at its root span
+    (an incoming update), and inherited by every child span. Unsampled traces and
+    a zero sample rate cost a context variable lookup per span.
+    """
+
+    def __init__(self, sample_rate: float, exporter: FileExporter | None) -> None:
+        self.sample_rate = sample_rate if exporter else 0.0
+        self.exporter = exporter
+        # Current span; False marks a trace that wasn't sampled
+        self._current: contextvars.ContextVar[Span | bool | None] = (
+            contextvars.ContextVar("current_span", default=None)
+        )
+        self._noop = nullcontext(None)
+
+    def current(self) -> Span | bool | None:
+        """Opaque handle of the current trace, to resume it in another task."""
+        return self._current.get()
+
+    @contextmanager
+    def attach(self, handle: Span | bool | None) -> Iterator[None]:
+        token = self._current.set(handle)
+        try:
+            yield
+        finally:
+            self._current.reset(token)
+
+    def span(self, name: str, **attributes: Any) -> Any:
+        """Context manager yielding the new Span, or None when not sampled."""
+        if self.sample_rate <= 0:
+            return self._noop
+        parent = self._current.get()
+        if parent is False:
+            return self._noop
+        if parent is None and random.random() >= self.sample_rate:
+            return self._sampled_out()
+        return self._span(name, parent, attributes)
+
+    @contextmanager
+    def _sampled_out(self) -> Iterator[None]:
+        token = self._current.set(False)
+        try:
+            yield None
+        finally:
+            self._current.reset(token)
+
+    @contextmanager
+    def _span(
+        self, name: str, parent: Span | None, attributes: dict[str, Any]
+    ) -> Iterator[Span]:
+        if parent is None:
+            span = Span(name, f"{random.getrandbits(128):032x}", None)
+        else:
+            span = Span(name, parent.trace_id, parent.span_id)
+        span.attributes.update(attributes)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._current.reset(token)
+            span.end_ns = time.time_ns()
+            assert self.exporter is not None
+            self.exporter.export(span)
+
+    def shutdown(self) -> None:
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+
+tracer = Tracer(
+    sample_rate=config.TRACE_SAMPLE_RATE,
+    exporter=(
+        FileExporter(config.TRACE_EXPORT_PATH) if config.TRACE_EXPORT_PATH else None
+    ),
+)
+span = tracer.span
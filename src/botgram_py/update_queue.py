@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any
+
+from telegram import Update
+from telegram.ext import Application
+
+from .tracing import span, tracer
+
+logger = logging.getLogger(__name__)
+
+POLICY_REJECT = "reject"
+POLICY_DROP_OLDEST = "drop_oldest"
+
+
+class UpdateDispatcher:
+    """
+    Processes webhook updates on a pool of background workers.
+
+    Updates wait in one queue per chat; any free worker takes the next chat that
+    has work and handles one of its updates, so messages of the same chat are
+    always handled in order while a slow chat never holds up the others.
+    `max_size` bounds the updates waiting across all chats.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        workers: int,
+        max_size: int,
+        policy: str = POLICY_REJECT,
+    ) -> None:
+        if policy not in (POLICY_REJECT, POLICY_DROP_OLDEST):
+            raise ValueError(f"❌ Unsupported queue policy: {policy}")
+
+        self._application = application
+        self._policy = policy
+        self._workers = max(1, workers)
+        self._max_size = max(1, max_size)
+        # Chat key -> its waiting (sequence number, update, trace handle of the
+        # webhook request that received it). A chat is listed while it has updates
+        # waiting or one being processed.
+        self._chats: dict[int, deque[tuple[int, Update, Any]]] = {}
+        # Chats with waiting updates and none being processed, in arrival order
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._queued = 0
+        self._unfinished = 0
+        self._sequence = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks: list[asyncio.Task[None]] = []
+        self._accepting = False
+
+    @property
+    def depth(self) -> int:
+        """Number of updates waiting to be processed."""
+        return self._queued
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"update-worker-{i}")
+            for i in range(self._workers)
+        ]
+        self._accepting = True
+        logger.info("📬 Update dispatcher started with %d workers.", len(self._tasks))
+
+    def submit(self, update: Update) -> bool:
+        """
+        Enqueues an update without waiting for it to be processed.
+        Returns False when the update was rejected (queue full or shutting down).
+        """
+        if not self._accepting:
+            return False
+
+        if self._queued >= self._max_size:
+            if self._policy == POLICY_REJECT:
+                logger.warning(
+                    "⚠️ Update queue full, rejecting update %s.", update.update_id
+                )
+                return False
+
+            dropped = self._drop_oldest()
+            logger.warning(
+                "⚠️ Update queue full, dropped oldest update %s.", dropped.update_id
+            )
+
+        key = self._chat_key(update)
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = deque()
+            self._ready.put_nowait(key)
+        self._sequence += 1
+        chat.append((self._sequence, update, tracer.current()))
+        self._queued += 1
+        self._unfinished += 1
+        self._idle.clear()
+        return True
+
+    async def stop(self, timeout: float) -> None:
+        """Stops accepting updates and waits up to `timeout` seconds for the backlog."""
+        self._accepting = False
+
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "⚠️ Drain timed out, discarding %d pending updates.", self.depth
+            )
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _chat_key(self, update: Update) -> int:
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return update.update_id
+
+    def _drop_oldest(self) -> Update:
+        """Removes the update waiting the longest, whichever chat it belongs to."""
+        key = min(
+            (key for key, chat in self._chats.items() if chat),
+            key=lambda key: self._chats[key][0][0],
+        )
+        _, update, _ = self._chats[key].popleft()
+        # An emptied chat stays listed: it is still in the ready queue or running
+        self._finish(queued=True)
+        return update
+
+    def _finish(self, queued: bool) -> None:
+        if queued:
+            self._queued -= 1
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._idle.set()
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            chat = self._chats[key]
+            if not chat:  # Its updates were dropped while it waited
+                del self._chats[key]
+                continue
+
+            _, update, trace = chat.popleft()
+            self._queued -= 1
+            try:
+                with tracer.attach(trace), span("update", update_id=update.update_id):
+                    await self._application.process_update(update)
+            except Exception as e:
+                logger.error(
+                    "Error processing update %s: %s", update.update_id, e, exc_info=True
+                )
+            finally:
+                # Back of the line: other chats get a turn between its updates
+                if chat:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                self._finish(queued=False)
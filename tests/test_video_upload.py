@@ -0,0 +1,74 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+import httpx
+
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+from src.botgram_py.handlers import video  # noqa: E402
+from src.botgram_py.services import video_jobs as video_jobs_module  # noqa: E402
+from src.botgram_py.services.video_api import VideoStream  # noqa: E402
+
+URL = "https://youtube.com/watch?v=shared"
+CONTENT = b"video bytes " * 1000
+
+
+class SharedStreamUploadTest(unittest.IsolatedAsyncioTestCase):
+    async def test_second_holder_uploads_spooled_file_without_file_id(self) -> None:
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(
+                lambda _: httpx.Response(200, content=CONTENT)
+            )
+        )
+        self.addAsyncCleanup(client.aclose)
+
+        async def download_video(url, temp_dir, *args):
+            response = await client.send(client.build_request("GET", url), stream=True)
+            return VideoStream(
+                response, len(CONTENT), 1024, os.path.join(temp_dir, "video.mp4")
+            )
+
+        uploads: list[bytes] = []
+
+        async def send_video(message, content, size, caption, chunk_size):
+            if isinstance(content, str):
+                with open(content, "rb") as f:
+                    uploads.append(f.read())
+            else:
+                uploads.append(b"".join([chunk async for chunk in content]))
+            # Sent as an animation: Telegram returns no video, so no file_id
+            return mock.Mock(video=None)
+
+        queue = video_jobs_module.VideoJobQueue(workers=1, max_queued=5, max_per_user=5)
+        self.addCleanup(queue.shutdown)
+        messages = [mock.AsyncMock() for _ in range(2)]
+        statuses = [mock.AsyncMock() for _ in range(2)]
+
+        with (
+            mock.patch.object(video_jobs_module, "download_video", download_video),
+            mock.patch.object(
+                video_jobs_module.video_cache,
+                "restore",
+                mock.AsyncMock(return_value=None),
+            ),
+            mock.patch.object(video, "video_jobs", queue),
+            mock.patch.object(video.telegram_files, "send_video", send_video),
+        ):
+            await asyncio.gather(
+                *(
+                    video._download_and_send(message, status, URL, user_id)
+                    for user_id, (message, status) in enumerate(zip(messages, statuses))
+                )
+            )
+
+        self.assertEqual(uploads, [CONTENT, CONTENT])
+        self.assertEqual(queue.deduplicated_total, 1)
+        for status in statuses:
+            status.edit_text.assert_not_called()
+            status.delete.assert_awaited_once()
+
+
+if __name__ == "__main__":
+    unittest.main()